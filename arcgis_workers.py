@@ -0,0 +1,21 @@
+"""
+Run process pools from ArcGIS Pro script tools.
+
+Script tools run inside of ArcGISPro.exe, which is then sys.executable, so
+every worker of a process pool would start another copy of ArcGIS Pro.
+Call use_python_workers before starting the pool.
+
+Author: Jesse Morgan
+"""
+import multiprocessing
+import os
+import sys
+
+
+def use_python_workers():
+    """
+    Start worker processes with the Python of ArcGIS Pro when running inside
+    of ArcGIS Pro.  Does nothing when the script is run with Python.
+    """
+    if os.path.basename(sys.executable).lower() == "arcgispro.exe":
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe"))
@@ -1,250 +1,934 @@
-"""Create focal 50 rasters for the Risk Rating 2.0 requirements.
-
-General steps:
-
-1. Create the following folder structure:
-    Focal_Work
-        NED_1_arcsec_source (tiles from USGS go here)
-        NED_1_arcsec_working
-            Buffered_Rasters
-            Focal_Rasters
-            Clipped_Rasters
-            Final_Rasters
-        NED_1_3_arcsec_source (tiles from USGS go here)
-        NED_1_3_arcsec_working
-            Buffered_Rasters
-            Focal_Rasters
-            Clipped_Rasters
-            Final_Rasters
-        Scripts
-
-2. Download all the NED 1 Arcsec and NED 1/3 Arcsec rasters from the USGS AWS website.
-   Store these in their respective folders inside of the 'Focal_Work' folder.
-
-   a. List bucket contents: aws s3 ls s3://prd-tnm/StagedProducts/Elevation/ --human-readable --summarize --no-sign-request
-   b. Download NED 1/3:
-       aws s3 sync "s3://prd-tnm/StagedProducts/Elevation/13/TIFF/current/" . --exclude "*.db" --exclude "*.vrt" --exclude "*.gpkg" --exclude "*.xml" --exclude "*.jpg" --no-sign-request
-   c. Download NED 1arc:
-       aws s3 sync "s3://prd-tnm/StagedProducts/Elevation/1/TIFF/current/" . --exclude "*.db" --exclude "*.vrt" --exclude "*.gpkg" --exclude "*.xml" --exclude "*.jpg" --no-sign-request
-   
-3. Create a tile index that contains a field called 'tile_name' which contains the
-   names of each tile. A field named 'location' should also exist with the absolute path
-   to each tile.
-   Name the tiles indexes: ned_1_3_tile_index.shp and ned_1_tile_index.shp.
-   Store these in the scripts folder.
-4. Ensure a county_boundaries shapefile exists in the Scripts folder.  Make sure all the features
-   in the county_boundaries shapefile has a tile associated with it.  If not, put the name of the feature
-   in skip_list variable below.  The county_boundaries shapefile should have a 'Place_Name' field that
-   stores the county name and state abbreviate.  All spaces should be replaced with an _.  Ensure
-   all diacritics are replace.
-5. Run the tool from the command prompt passing in either 'ned_1' or 'ned_1_3'.
-6. The final focal 50 rasters will be located in 'Final_Rasters' folder.  All other rasters can be deleted.
-
-Notes:
-    - If only certain counties need to be exported, put their names in the 'county_list' list below.
-    - All datasets should be GCS.
-    - The program will not overwrite any datasets.  If a raster already exists, the program will skip it.
-    - All hard coded paths are in the Variables section below.
-    - There are some magic numbers in the program but they are related to the Risk Rating 2.0 requirements.
-    - There is a 'raster_type' variable which represents processing the NED 1 arcsec or NED 1/3 arcsec rasters.
-      Change this to reflect which rasters are being processed.
-
-This program could be automated more and error catching added.  I'm leaving as is since this will be rarely ran.
-
-Author: Jesse Morgan
-Date: 4/5/2023
-"""
-import arcpy
-import os
-import sys
-from arcpy.sa import *
-
-def main(ned, county_shapefile):
-    if ned == 'ned_1':
-        raster_type = "1"  # For 1 arcsec
-    elif ned == 'ned_1_3':
-        raster_type = "1_3"  # For 1/3 arcsec
-    else:
-        print(f"ERROR: received {ned} when the parameter should be either 'ned_1' or 'ned_1_3'")
-        sys.exit(1)
-
-    # Variables
-    path = r'C:\GIS\Focal_Work'
-    outpath = r'D:\Focal_Work'
-    county_boundaries = os.path.join(path, 'Scripts', county_shapefile)
-    buffered_rasters = os.path.join(outpath, 'NED_' + raster_type + '_arcsec_working\Buffered_Rasters')
-    focal_rasters = os.path.join(outpath, 'NED_' + raster_type + '_arcsec_working\Focal_Rasters')
-    tiles = os.path.join(path, "Scripts", "ned_" + raster_type + "_tile_index.shp")
-    main_folder = os.path.join(path, 'NED_' + raster_type + '_arcsec_source')
-    clipped_rasters = os.path.join(outpath, 'NED_' + raster_type + '_arcsec_working\Clipped_Rasters')
-    final_rasters = os.path.join(outpath, 'NED_' + raster_type + '_arcsec_working\Final_Rasters')
-
-    # Make feature layers
-    if arcpy.Exists("county_boundaries"):
-        arcpy.Delete_management("county_boundaries")
-    county_boundaries_lyr = arcpy.MakeFeatureLayer_management(county_boundaries, "county_boundaries")
-
-    if arcpy.Exists("tiles"):
-        arcpy.Delete_management("tiles")
-    tiles_lyr = arcpy.MakeFeatureLayer_management(tiles, "tiles")
-
-    # Get the count of the rows
-    row_count = int(arcpy.GetCount_management(county_boundaries)[0])
-    counter = 1
-
-    # Use this list if only certain counties should be exported.  Otherwise, leave the list empty.
-    county_list = []
-    if len(county_list) != 0:
-        row_count = len(county_list)
-
-    # Use this list to skip counties.
-    skip_list = ['Rose_Island_AS', 'Swains_Island_AS']
-    if len(skip_list) != 0 and len(county_list) == 0:
-        row_count -= len(skip_list)
-
-    # Iterate through the county boundaries
-    with arcpy.da.SearchCursor(county_boundaries_lyr, "Place_Name") as cursor:
-        for row in cursor:
-            county_name = row[0]
-
-            # Check if only certain counties are to be processed.
-            if len(county_list) != 0:
-                if county_name not in county_list:
-                    continue
-
-            # Check if a county is listed in the skip_list.
-            if county_name in skip_list:
-                print("\t...in skip_list. Skipping...")
-                continue
-
-            # Check to see if the final raster already exists.  If so, continue
-            if arcpy.Exists(os.path.join(final_rasters, county_name + "_focal.tif")):
-                print(f"{county_name} final raster already exists.  Skipping...")
-                counter += 1
-                continue
-
-            print(f"{county_name}: {counter} of {row_count}")
-            raster_list = []
-
-            # Select the current county
-            current_county = arcpy.management.SelectLayerByAttribute(
-                in_layer_or_view=county_boundaries_lyr,
-                selection_type="NEW_SELECTION",
-                where_clause="Place_Name = '" + county_name + "'")
-
-            # Select intersecting tiles out to 1,000 feet.  This will cover the 500 feet requirement.
-            selected_tiles = arcpy.management.SelectLayerByLocation(
-                in_layer=tiles_lyr,
-                overlap_type="WITHIN_A_DISTANCE",
-                select_features=current_county,
-                search_distance="1000 Feet",
-                selection_type="NEW_SELECTION")
-
-            # Append the paths to the raster_list
-            with arcpy.da.SearchCursor(selected_tiles, "tile_name") as raster_cursor:
-                for raster_row in raster_cursor:
-                    raster = raster_row[0]
-                    if raster_type == "1_3":
-                        folder_name = raster.replace('USGS_13_', '')
-                    else:
-                        folder_name = raster.replace('USGS_1_', '')
-                    raster_path = os.path.join(main_folder,
-                                               folder_name.replace(".tif", ""),
-                                               raster)
-                    if raster_path not in raster_list:
-                        raster_list.append(raster_path)
-
-            # Check the paths to the rasters exists.
-            for r in raster_list:            
-                if not os.path.exists(r):
-                    print(f"\tFAIL: '{r}' does not exist.")
-                    sys.exit(1)
-
-            # Check for extra characters in the county name that could affect the naming of the rasters.
-            if "-" in county_name:
-                county_name = county_name.replace("-", "")
-            if "'" in county_name:
-                county_name = county_name.replace("'", "")
-            if " " in county_name:
-                county_name = county_name.replace(" ", "")                
-
-            # Mosaic the rasters
-            print("\t...creating mosaic...")
-            buffer_raster = county_name + "_buffered.tif"
-            arcpy.management.MosaicToNewRaster(
-                input_rasters=raster_list,
-                output_location=buffered_rasters,
-                raster_dataset_name_with_extension=buffer_raster,
-                number_of_bands=1,
-                pixel_type="32_BIT_FLOAT")
-
-            # Buffer the current county boundary.  600-meters will cover the 500-meter requirement.
-            buffered_boundary = arcpy.analysis.Buffer(
-                in_features=current_county,
-                out_feature_class=r"in_memory\Buffer",
-                buffer_distance_or_field="600 Meters",
-                dissolve_option="ALL")
-
-            # Clip the raster
-            print("\t...clipping...")
-            clipped_raster = os.path.join(clipped_rasters, county_name + "_clipped.tif")
-            outExtractByMask = ExtractByMask(
-                os.path.join(buffered_rasters, county_name + "_buffered.tif"),
-                buffered_boundary,
-                "INSIDE")
-            outExtractByMask.save(clipped_raster)
-
-            # Remove the buffer in memory
-            arcpy.Delete_management(buffered_boundary)
-
-            # Create Focal Raster.  Note: these are not compressed.
-            print("\t...creating focal raster...")
-            focal_raster = county_name + "_focal.tif"
-            # 500-meter radius is needed. NED 1 arcsec cell size is about 30 meters.  NED 1/3 arcsec
-            # cell size is about 10 meters. Therefore, use 500/30 = 16.67, rounded to 17 for NED 1 arsec.
-            # Else use 50 for NED 1/3 arcsec (50 * 10 meter cell size = 500 meters).
-            if raster_type == '1_3':
-                cell_radius = 50
-            else:
-                cell_radius = 17
-            neighborhood_type = NbrCircle(cell_radius, "CELL")  
-            outFocalStatistics = FocalStatistics(
-                in_raster=clipped_raster,
-                neighborhood=neighborhood_type,
-                statistics_type="MEAN",
-                ignore_nodata="NODATA")
-            outFocalStatistics.save(os.path.join(focal_rasters, focal_raster))
-
-            # Compress the final raster by copying it.
-            print("\t...compressing...")
-            final_raster = os.path.join(final_rasters, county_name + "_focal.tif")
-            arcpy.management.CopyRaster(
-                in_raster=os.path.join(focal_rasters, focal_raster),
-                out_rasterdataset=final_raster,
-                pixel_type="32_BIT_FLOAT")
-
-            # Delete the temporary rasters to save space.
-            if arcpy.Exists(os.path.join(buffered_rasters, buffer_raster)):
-                arcpy.Delete_management(os.path.join(buffered_rasters, buffer_raster))
-            if arcpy.Exists(clipped_raster):
-                arcpy.Delete_management(clipped_raster)
-            if arcpy.Exists(os.path.join(focal_rasters, focal_raster)):
-                arcpy.Delete_management(os.path.join(focal_rasters, focal_raster))     
-
-            # Final message
-            print("\t...done\n")
-            counter += 1
-
-    print("\n\nEnd of line.")
-
-if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        ned = sys.argv[1]
-        county_shapefile = sys.argv[2]
-
-        if ned not in ["ned_1", "ned_1_3"]:
-            print("ERROR: Parameter needs to be either 'ned_1' or 'ned_1_3'")
-            sys.exit(1)
-        main(ned, county_shapefile)
-    else:
-        print("ERROR: Parameter required.  Use either 'ned_1' or 'ned_1_3'") 
+"""Create focal 50 rasters for the Risk Rating 2.0 requirements.
+
+General steps:
+
+1. Create the following folder structure:
+    Focal_Work
+        NED_1_arcsec_source (tiles from USGS go here)
+        NED_1_arcsec_working
+            Final_Rasters
+        NED_1_3_arcsec_source (tiles from USGS go here)
+        NED_1_3_arcsec_working
+            Final_Rasters
+        Scripts
+
+2. Download all the NED 1 Arcsec and NED 1/3 Arcsec rasters from the USGS AWS website.
+   Store these in their respective folders inside of the 'Focal_Work' folder.
+
+   a. List bucket contents: aws s3 ls s3://prd-tnm/StagedProducts/Elevation/ --human-readable --summarize --no-sign-request
+   b. Download NED 1/3:
+       aws s3 sync "s3://prd-tnm/StagedProducts/Elevation/13/TIFF/current/" . --exclude "*.db" --exclude "*.vrt" --exclude "*.gpkg" --exclude "*.xml" --exclude "*.jpg" --no-sign-request
+   c. Download NED 1arc:
+       aws s3 sync "s3://prd-tnm/StagedProducts/Elevation/1/TIFF/current/" . --exclude "*.db" --exclude "*.vrt" --exclude "*.gpkg" --exclude "*.xml" --exclude "*.jpg" --no-sign-request
+   
+3. Create a tile index that contains a field called 'tile_name' which contains the
+   names of each tile. A field named 'location' should also exist with the absolute path
+   to each tile.
+   Name the tiles indexes: ned_1_3_tile_index.shp and ned_1_tile_index.shp.
+   Store these in the scripts folder.
+4. Ensure a county_boundaries shapefile exists in the Scripts folder.  Make sure all the features
+   in the county_boundaries shapefile has a tile associated with it.  If not, put the name of the feature
+   in skip_list variable below.  The county_boundaries shapefile should have a 'Place_Name' field that
+   stores the county name and state abbreviate.  All spaces should be replaced with an _.  Ensure
+   all diacritics are replace.
+5. Run the tool from the command prompt passing in either 'ned_1' or 'ned_1_3'.
+   Add 'tile_first' after the county shapefile to calculate the focal mean once per NED
+   tile (in Tile_Focal_Rasters) and clip each county from the focal tiles.  Tiles shared
+   by neighboring counties are then only filtered once.  The focal tiles are named with
+   their statistics, distance and cell radius, so runs with other settings make their own.
+   Add 'workers=<n>' to process n counties at a time.  Counties are only started while
+   their estimated scratch space fits in 'disk_gb=<n>' (default 80% of the free space on
+   the output drive), largest counties first.
+   Add 'stats=MEAN,STD,MINIMUM,MAXIMUM' (any of them) to also get the focal standard
+   deviation, minimum or maximum from the same pass.  They are written as extra bands of
+   the focal raster after the mean, which is always band 1.
+6. The final focal 50 rasters will be located in 'Final_Rasters' folder.  All other rasters can be deleted.
+
+Notes:
+    - If only certain counties need to be exported, put their names in the 'county_list' list below.
+    - All datasets should be GCS.
+    - The program will not overwrite any finished datasets.  Each county's progress is recorded in
+      the 'Journal' folder of the working folder.  A rerun skips the counties the journal lists as
+      finished and removes the partial rasters left by a crash, so those counties are made again.
+      Final rasters from before the journal are read back and added to the journal when they
+      are complete.
+    - All hard coded paths are in the Variables section below.
+    - There are some magic numbers in the program but they are related to the Risk Rating 2.0 requirements.
+    - There is a 'raster_type' variable which represents processing the NED 1 arcsec or NED 1/3 arcsec rasters.
+      Change this to reflect which rasters are being processed.
+
+This program could be automated more and error catching added.  I'm leaving as is since this will be rarely ran.
+
+Author: Jesse Morgan
+Date: 4/5/2023
+"""
+import arcpy
+import hashlib
+import json
+import math
+import numpy as np
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+import focal_engine
+import tiled_geotiff
+
+
+def virtual_mosaic(in_rasters):
+    """Describe a set of aligned rasters as one mosaic without writing it to disk.
+
+    Returns a dictionary with the extent, cell size and spatial reference of the mosaic
+    and the extent and NoData value of each raster.  Cells are read by mosaic_window.
+    """
+    rasters = []
+    for in_raster in in_rasters:
+        raster = arcpy.Raster(in_raster)
+        extent = raster.extent
+        rasters.append((in_raster, extent.XMin, extent.YMin, extent.XMax, extent.YMax, raster.noDataValue))
+
+    first = arcpy.Raster(in_rasters[0])
+    cell_width, cell_height = first.meanCellWidth, first.meanCellHeight
+    x_min = min(r[1] for r in rasters)
+    y_max = max(r[4] for r in rasters)
+    return {"rasters": rasters,
+            "x_min": x_min,
+            "y_max": y_max,
+            "cell_width": cell_width,
+            "cell_height": cell_height,
+            "rows": int(round((y_max - min(r[2] for r in rasters)) / cell_height)),
+            "cols": int(round((max(r[3] for r in rasters) - x_min) / cell_width)),
+            "bands": first.bandCount,
+            "spatial_reference": first.spatialReference}
+
+
+def mosaic_window(mosaic, x_min, y_max, nrows, ncols):
+    """Read a window of a virtual mosaic as float64 with NoData as NaN.
+
+    Multiband mosaics return a (band, row, column) window.  Only the rasters that overlap
+    the window are read.  Where the rasters overlap, the last raster with data wins, like
+    the LAST mosaic method.  Cells that are not covered by any raster are NaN.
+    """
+    cell_width, cell_height = mosaic["cell_width"], mosaic["cell_height"]
+    bands = mosaic.get("bands", 1)
+    window = np.full((bands, nrows, ncols), np.nan, dtype=np.float64)
+    for in_raster, raster_x_min, raster_y_min, raster_x_max, raster_y_max, nodata in mosaic["rasters"]:
+
+        # The part of the window covered by the raster
+        row_start = max(int(round((y_max - raster_y_max) / cell_height)), 0)
+        row_end = min(int(round((y_max - raster_y_min) / cell_height)), nrows)
+        col_start = max(int(round((raster_x_min - x_min) / cell_width)), 0)
+        col_end = min(int(round((raster_x_max - x_min) / cell_width)), ncols)
+        if row_start >= row_end or col_start >= col_end:
+            continue
+
+        cells = arcpy.RasterToNumPyArray(
+            in_raster=in_raster,
+            lower_left_corner=arcpy.Point(x_min + col_start * cell_width, y_max - row_end * cell_height),
+            ncols=col_end - col_start,
+            nrows=row_end - row_start)
+        values = cells.astype(np.float64).reshape(bands, row_end - row_start, col_end - col_start)
+        if nodata is not None:
+            values[values == nodata] = np.nan
+
+        covered = window[:, row_start:row_end, col_start:col_end]
+        np.copyto(covered, values, where=~np.isnan(values))
+    return window[0] if bands == 1 else window
+
+
+def mosaic_grid(mosaic, extent):
+    """Return (x_min, y_max, rows, cols) of the mosaic cells that cover an extent."""
+    cell_width, cell_height = mosaic["cell_width"], mosaic["cell_height"]
+    col_start = max(int(math.floor((extent.XMin - mosaic["x_min"]) / cell_width)), 0)
+    col_end = min(int(math.ceil((extent.XMax - mosaic["x_min"]) / cell_width)), mosaic["cols"])
+    row_start = max(int(math.floor((mosaic["y_max"] - extent.YMax) / cell_height)), 0)
+    row_end = min(int(math.ceil((mosaic["y_max"] - extent.YMin) / cell_height)), mosaic["rows"])
+    return (mosaic["x_min"] + col_start * cell_width, mosaic["y_max"] - row_start * cell_height,
+            max(row_end - row_start, 0), max(col_end - col_start, 0))
+
+
+def polygon_edges(shape):
+    """Return the edges of every ring of a polygon as an array of (x0, y0, x1, y1)."""
+    edges = []
+    for part in shape:
+        ring = []
+        # A None point starts an interior ring
+        for point in list(part) + [None]:
+            if point is None:
+                if len(ring) > 1:
+                    ring = np.array(ring)
+                    edges.append(np.column_stack([ring, np.roll(ring, -1, axis=0)]))
+                ring = []
+            else:
+                ring.append((point.X, point.Y))
+    if not edges:
+        return np.zeros((0, 4))
+    return np.concatenate(edges)
+
+
+def polygon_mask(edges, x_min, y_max, cell_width, cell_height, nrows, ncols):
+    """Find the cells of a window whose centers are inside of a polygon.
+
+    Each row of cell centers is scanned for the x values where it crosses the polygon
+    edges.  Holes are handled by the even-odd rule, like ExtractByMask.
+    """
+    mask = np.zeros((nrows, ncols), dtype=bool)
+    centers_y = y_max - (np.arange(nrows) + 0.5) * cell_height
+    if nrows == 0 or len(edges) == 0:
+        return mask
+
+    # Only the edges that reach the window's rows
+    low, high = np.minimum(edges[:, 1], edges[:, 3]), np.maximum(edges[:, 1], edges[:, 3])
+    edges = edges[(high >= centers_y[-1]) & (low <= centers_y[0])]
+    x0, y0, x1, y1 = edges.T
+
+    for row, y in enumerate(centers_y):
+        crosses = (y0 <= y) != (y1 <= y)
+        xs = np.sort(x0[crosses] + (y - y0[crosses]) * (x1[crosses] - x0[crosses]) /
+                     (y1[crosses] - y0[crosses]))
+        starts = np.clip(np.ceil((xs[0::2] - x_min) / cell_width - 0.5), 0, ncols).astype(np.int64)
+        ends = np.clip(np.ceil((xs[1::2] - x_min) / cell_width - 0.5), 0, ncols).astype(np.int64)
+        inside = np.zeros(ncols + 1, dtype=np.int64)
+        np.add.at(inside, starts, 1)
+        np.add.at(inside, ends, -1)
+        mask[row] = np.cumsum(inside[:ncols]) > 0
+    return mask
+
+
+def clip_reader(mosaic, edges, x_min, y_max, cols):
+    """Make a reader for focal_engine that returns rows of a mosaic clipped to a polygon.
+
+    Rows start at y_max.  Cells outside of the polygon are NaN, like ExtractByMask.
+    """
+    cell_width, cell_height = mosaic["cell_width"], mosaic["cell_height"]
+
+    def read(row, nrows):
+        window_y_max = y_max - row * cell_height
+        window = mosaic_window(mosaic, x_min, window_y_max, nrows, cols)
+        window[..., ~polygon_mask(edges, x_min, window_y_max, cell_width, cell_height, nrows, cols)] = np.nan
+        return window
+
+    return read
+
+
+def read_strips(reader, rows, strip_rows=1024):
+    """Read a raster one strip of rows at a time, without any focal calculation."""
+    for row in range(0, rows, strip_rows):
+        yield row, reader(row, min(strip_rows, rows - row)).astype(np.float32)
+
+
+def stack_statistics(strips, statistics):
+    """Turn strips of focal_engine statistics into strips with one band per statistic."""
+    for row, results in strips:
+        if len(statistics) == 1:
+            yield row, results[statistics[0]]
+        else:
+            yield row, np.stack([results[statistic] for statistic in statistics])
+
+
+def write_strips(strips, rows, cols, x_min, y_max, cell_width, cell_height, spatial_reference, out_raster,
+                 band_names=None):
+    """Write strips of rows from focal_engine to a compressed float GeoTIFF with NaN as NoData.
+
+    The strips are compressed in a thread pool while the next strip is calculated, so the
+    raster is only written once and never uncompressed.  Strips with more than one band
+    need band_names.
+    """
+    tiled_geotiff.write_strips(
+        out_path=out_raster,
+        strips=strips,
+        rows=rows,
+        cols=cols,
+        dtype=np.float32,
+        x_min=x_min,
+        y_max=y_max,
+        cell_width=cell_width,
+        cell_height=cell_height,
+        epsg=spatial_reference.factoryCode,
+        geographic=spatial_reference.type == "Geographic",
+        nodata=-3.4028235e38,
+        band_names=band_names if band_names and len(band_names) > 1 else None)
+    tiled_geotiff.define_projection(out_raster, spatial_reference)
+
+
+def tile_path(main_folder, raster_type, tile_name):
+    """Return the path to a NED tile from its name in the tile index."""
+    if raster_type == "1_3":
+        folder_name = tile_name.replace('USGS_13_', '')
+    else:
+        folder_name = tile_name.replace('USGS_1_', '')
+    return os.path.join(main_folder, folder_name.replace(".tif", ""), tile_name)
+
+
+def read_tile_extents(tiles):
+    """Return a dictionary of tile name to (x_min, y_min, x_max, y_max) from the tile index."""
+    tile_extents = {}
+    with arcpy.da.SearchCursor(tiles, ["tile_name", "SHAPE@"]) as cursor:
+        for tile_name, shape in cursor:
+            extent = shape.extent
+            tile_extents[tile_name] = (extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+    return tile_extents
+
+
+def build_str_tree(boxes, node_size=16):
+    """Pack (x_min, y_min, x_max, y_max) boxes into a Sort-Tile-Recursive tree.
+
+    The boxes are sorted into vertical slices by x and then by y inside of each slice,
+    and every node_size consecutive entries are grouped into a parent node.  Returns a
+    tuple of (box order, list of level boxes from the leaves up, node_size).
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    slice_size = node_size * max(1, math.ceil(math.sqrt(len(boxes) / node_size)))
+    by_x = np.argsort((boxes[:, 0] + boxes[:, 2]) / 2, kind="stable")
+    order = [np.zeros(0, dtype=np.int64)]
+    for start in range(0, len(boxes), slice_size):
+        in_slice = by_x[start:start + slice_size]
+        order.append(in_slice[np.argsort((boxes[in_slice, 1] + boxes[in_slice, 3]) / 2, kind="stable")])
+    order = np.concatenate(order)
+
+    levels = [boxes[order]]
+    while len(levels[-1]) > node_size:
+        children = levels[-1]
+        starts = np.arange(0, len(children), node_size)
+        levels.append(np.column_stack([np.minimum.reduceat(children[:, 0], starts),
+                                       np.minimum.reduceat(children[:, 1], starts),
+                                       np.maximum.reduceat(children[:, 2], starts),
+                                       np.maximum.reduceat(children[:, 3], starts)]))
+    return order, levels, node_size
+
+
+def query_str_tree(tree, box):
+    """Return the indices of the boxes in an STR tree that overlap a box."""
+    order, levels, node_size = tree
+    x_min, y_min, x_max, y_max = box
+    candidates = np.arange(len(levels[-1]))
+    for depth in range(len(levels) - 1, -1, -1):
+        level = levels[depth][candidates]
+        hits = candidates[(level[:, 0] <= x_max) & (level[:, 2] >= x_min) &
+                          (level[:, 1] <= y_max) & (level[:, 3] >= y_min)]
+        if depth == 0:
+            return order[hits]
+        candidates = (hits[:, None] * node_size + np.arange(node_size)).ravel()
+        candidates = candidates[candidates < len(levels[depth - 1])]
+    return order[:0]
+
+
+def dataset_checksum(datasets):
+    """Return a SHA-1 checksum of the files that make up a list of shapefiles."""
+    digest = hashlib.sha1()
+    for dataset in datasets:
+        base = os.path.splitext(dataset)[0]
+        for extension in [".shp", ".shx", ".dbf", ".prj"]:
+            if os.path.exists(base + extension):
+                with open(base + extension, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_checksum(path):
+    """Return the SHA-1 checksum of a file."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_county_tiles(county_boundaries, tiles, search_feet=1000):
+    """Find the tiles within search_feet of every county.
+
+    The tiles come from an STR tree of the tile extents.  The data is GCS, so the
+    distance is checked in degrees with the east-west degree length at the county's
+    highest latitude.  That is the shortest degree in the county, so no tile within the
+    distance is missed.
+    """
+    tile_names = []
+    tile_shapes = []
+    with arcpy.da.SearchCursor(tiles, ["tile_name", "SHAPE@"]) as cursor:
+        for tile_name, shape in cursor:
+            tile_names.append(tile_name)
+            tile_shapes.append(shape)
+    tree = build_str_tree([(shape.extent.XMin, shape.extent.YMin, shape.extent.XMax, shape.extent.YMax)
+                           for shape in tile_shapes])
+
+    search_meters = search_feet * 0.3048
+    county_tiles = {}
+    with arcpy.da.SearchCursor(county_boundaries, ["Place_Name", "SHAPE@"]) as cursor:
+        for county_name, shape in cursor:
+            extent = shape.extent
+            latitude = min(max(abs(extent.YMin), abs(extent.YMax)), 89.0)
+            distance = search_meters / (111320.0 * math.cos(math.radians(latitude)))
+
+            names = county_tiles.setdefault(county_name, [])
+            for index in sorted(query_str_tree(tree, (extent.XMin - distance, extent.YMin - distance,
+                                                      extent.XMax + distance, extent.YMax + distance))):
+                if tile_names[index] not in names and shape.distanceTo(tile_shapes[index]) <= distance:
+                    names.append(tile_names[index])
+    return county_tiles
+
+
+def load_county_tiles(lookup_file, county_boundaries, tiles):
+    """Load the county to tile lookup, or build it when the tile index or counties changed.
+
+    The lookup is keyed by a checksum of the tile index and the county boundaries.
+    """
+    checksum = dataset_checksum([tiles, county_boundaries])
+    if os.path.exists(lookup_file):
+        with open(lookup_file) as f:
+            lookup = json.load(f)
+        if lookup.get("checksum") == checksum:
+            return lookup["counties"]
+
+    print("Building the county to tile lookup...")
+    lookup = {"checksum": checksum, "counties": build_county_tiles(county_boundaries, tiles)}
+    with open(lookup_file, "w") as f:
+        json.dump(lookup, f)
+    return lookup["counties"]
+
+
+def tile_neighbors(tile_name, tile_extents, tile_tree, distance):
+    """Return the names of the tiles within distance of a tile, including the tile itself.
+
+    tile_tree is the STR tree of the tile extents, in the order of tile_extents.
+    """
+    tile_names = list(tile_extents)
+    x_min, y_min, x_max, y_max = tile_extents[tile_name]
+    return [tile_names[index] for index in sorted(query_str_tree(
+        tile_tree, (x_min - distance, y_min - distance, x_max + distance, y_max + distance)))]
+
+
+def focal_kernel(cell_radius, distance, cell_width, cell_height, y_max, spatial_reference):
+    """Return the focal_engine kernel for a raster.
+
+    Geographic rasters get an ellipse that covers distance meters at the latitude of each
+    strip.  Other rasters use a circle of cell_radius cells.
+    """
+    if spatial_reference.type == "Geographic":
+        return focal_engine.geographic_kernel(distance, cell_width, cell_height, y_max)
+    spans = focal_engine.circle_spans(cell_radius)
+    return lambda row, nrows: spans
+
+
+def focal_tile(tile_raster, neighbor_rasters, out_raster, cell_radius, distance, ignore_nodata="NODATA",
+               statistics=("MEAN",), strip_rows=1024):
+    """Calculate the focal statistics of one NED tile, one band per statistic.
+
+    The halo around the tile is read from the neighboring tiles, so the focal statistics at
+    the tile edges are the same as the focal statistics of a mosaic.
+    """
+    raster = arcpy.Raster(tile_raster)
+    rows, cols = raster.height, raster.width
+    cell_width, cell_height = raster.meanCellWidth, raster.meanCellHeight
+    mosaic = virtual_mosaic(neighbor_rasters)
+    kernel = focal_kernel(cell_radius, distance, cell_width, cell_height, raster.extent.YMax,
+                          raster.spatialReference)
+
+    def strips():
+        # Read each strip of the tile widened by the halo.  Rows of the halo are inside of
+        # the widened tile, so the engine does not treat them as outside of the raster.
+        for row in range(0, rows, strip_rows):
+            nrows = min(strip_rows, rows - row)
+            spans = kernel(row, nrows)
+            halo_rows, halo_cols = focal_engine.span_halo(spans)
+            window = mosaic_window(mosaic,
+                                   raster.extent.XMin - halo_cols * cell_width,
+                                   raster.extent.YMax - (row - halo_rows) * cell_height,
+                                   nrows + 2 * halo_rows, cols + 2 * halo_cols)
+            function = focal_engine.window_function(spans, statistics)
+            results = function(window, spans, 0, len(window), ignore_nodata, statistics)
+            yield row, {statistic: values[:, halo_cols:halo_cols + cols]
+                        for statistic, values in results.items()}
+
+    write_strips(stack_statistics(strips(), statistics), rows, cols, raster.extent.XMin, raster.extent.YMax,
+                 cell_width, cell_height, raster.spatialReference, out_raster, statistics)
+
+
+def focal_tile_path(tile_name, settings):
+    """Return the path of a NED tile's focal raster.
+
+    The statistics, distance and cell radius are part of the name, so a focal tile is only
+    reused by runs that would make the same bands.
+    """
+    statistics = "_".join(settings["statistics"])
+    suffix = f"_focal_{statistics}_{settings['distance']:g}m_r{settings['cell_radius']}.tif"
+    return os.path.join(settings["tile_focal_rasters"], tile_name.replace(".tif", suffix))
+
+
+def create_focal_tile(tile_name, settings):
+    """Create the focal raster of a NED tile if it does not exist and return its path."""
+    main_folder, raster_type = settings["main_folder"], settings["raster_type"]
+    focal_tile_raster = focal_tile_path(tile_name, settings)
+    if not arcpy.Exists(focal_tile_raster):
+        # The east-west halo is widest at the tile's highest latitude
+        x_min, y_min, x_max, y_max = settings["tile_extents"][tile_name]
+        latitude = min(max(abs(y_min), abs(y_max)), 89.0)
+        halo = max(settings["distance"] / focal_engine.meters_per_degree(latitude)[0],
+                   settings["cell_radius"] * settings["cell_size"])
+        neighbors = tile_neighbors(tile_name, settings["tile_extents"], settings["tile_tree"],
+                                   halo + 10 * settings["cell_size"])
+        focal_tile(
+            tile_raster=tile_path(main_folder, raster_type, tile_name),
+            neighbor_rasters=[tile_path(main_folder, raster_type, name) for name in neighbors],
+            out_raster=focal_tile_raster,
+            cell_radius=settings["cell_radius"],
+            distance=settings["distance"],
+            ignore_nodata="NODATA",
+            statistics=settings["statistics"])
+    return focal_tile_raster
+
+
+def final_raster_path(final_rasters, county_name):
+    """Return the path of a county's final raster.
+
+    Characters in the county name that could affect the naming of the rasters are removed.
+    """
+    for character in ["-", "'", " "]:
+        county_name = county_name.replace(character, "")
+    return os.path.join(final_rasters, county_name + "_focal.tif")
+
+
+def journal_stage(journal_folder, county_name, stage, path, **details):
+    """Append a stage of a county's final raster to the journal.
+
+    Each process appends to its own segment so workers never interleave records.  The
+    record is synced to disk before the county moves on to the next stage.
+    """
+    record = dict(county=county_name, stage=stage, path=path, time=time.time(), **details)
+    segment = os.path.join(journal_folder, f"journal_{os.getpid()}.jsonl")
+    with open(segment, "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def journal_final(journal_folder, county_name, path, statistics):
+    """Record a finished final raster with its size, modified time and checksum."""
+    journal_stage(journal_folder, county_name, "final", path, bytes=os.path.getsize(path),
+                  modified=os.path.getmtime(path), checksum=file_checksum(path), statistics=statistics)
+
+
+def read_journal(journal_folder):
+    """Return the latest journal record of each final raster.
+
+    A line cut off by a crash is skipped, which leaves the raster at its previous stage.
+    """
+    records = []
+    for name in os.listdir(journal_folder):
+        if not name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(journal_folder, name)) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+    latest = {}
+    for record in sorted(records, key=lambda record: record["time"]):
+        latest[record["path"]] = record
+    return latest
+
+
+def remove_raster(path):
+    """Delete a raster and its sidecar files, such as the .aux.xml."""
+    folder, name = os.path.split(path)
+    for file_name in os.listdir(folder):
+        if file_name == name or file_name.startswith(name + "."):
+            os.remove(os.path.join(folder, file_name))
+
+
+def readable_raster(path):
+    """Check that a raster opens and that its last row can be read, which fails when the
+    file was cut off."""
+    try:
+        raster = arcpy.Raster(path)
+        arcpy.RasterToNumPyArray(raster, arcpy.Point(raster.extent.XMin, raster.extent.YMin),
+                                 raster.width, 1)
+    except Exception:
+        return False
+    return True
+
+
+def sweep_outputs(journal_folder, settings):
+    """Remove what a crashed run left behind and return the final rasters that are finished.
+
+    - .part files are removed from both output folders.
+    - A final raster whose last journal stage is not final was being made when the run
+      stopped, so it is removed.
+    - A final raster the journal lists as final is finished when it has the recorded size
+      and focal statistics.  When its modified time changed, its checksum must also match.
+    - A final raster from before the journal is read back.  If it reads, it is added to the
+      journal as finished.  Otherwise it is removed.
+
+    Rasters that are not finished are made again and replaced.  Only one run should use the
+    output folders at a time.
+    """
+    journal = read_journal(journal_folder)
+
+    # Partial rasters from a crash
+    for folder in [settings["final_rasters"], settings["tile_focal_rasters"]]:
+        if not os.path.exists(folder):
+            continue
+        for name in os.listdir(folder):
+            if name.endswith(".part"):
+                print(f"Removing partial {name}...")
+                os.remove(os.path.join(folder, name))
+
+    finished = set()
+    if not os.path.exists(settings["final_rasters"]):
+        return finished
+    for name in os.listdir(settings["final_rasters"]):
+        if not name.endswith("_focal.tif"):
+            continue
+        path = os.path.join(settings["final_rasters"], name)
+        record = journal.get(path)
+
+        if record is None:
+            # Made before the journal, when a crash could leave a cut off raster
+            if readable_raster(path):
+                print(f"Adding {name} to the journal...")
+                journal_final(journal_folder, None, path, ["MEAN"])
+                if settings["statistics"] == ["MEAN"]:
+                    finished.add(path)
+            else:
+                print(f"Removing unreadable {name}...")
+                remove_raster(path)
+        elif record["stage"] != "final":
+            print(f"Removing unfinished {name}...")
+            remove_raster(path)
+        elif (record["statistics"] == settings["statistics"] and os.path.getsize(path) == record["bytes"]
+              and (os.path.getmtime(path) == record["modified"] or file_checksum(path) == record["checksum"])):
+            finished.add(path)
+    return finished
+
+
+def process_county(county_name, county_json, tile_names, settings):
+    """Create the final focal raster for one county.
+
+    The county geometry is passed as JSON so this can run in a worker process.  Each stage
+    is recorded in the journal, ending with the checksum of the final raster.  Problems are
+    raised rather than exiting, so the other counties of a run keep going.
+    """
+    journal_folder = settings["journal"]
+    final_raster = final_raster_path(settings["final_rasters"], county_name)
+    current_county = arcpy.AsShape(county_json, True)
+    main_folder, raster_type = settings["main_folder"], settings["raster_type"]
+    cell_radius = settings["cell_radius"]
+
+    # Append the paths to the raster_list
+    raster_list = [tile_path(main_folder, raster_type, raster) for raster in tile_names]
+
+    # Check the paths to the rasters exists.
+    for r in raster_list:
+        if not os.path.exists(r):
+            raise FileNotFoundError(f"'{r}' does not exist.")
+    journal_stage(journal_folder, county_name, "tiles", final_raster, tiles=tile_names)
+
+    # Calculate the focal mean of any tiles that do not have one yet
+    mosaic_list = raster_list
+    if settings["tile_first"]:
+        print(f"\t{county_name}...creating focal tiles...")
+        mosaic_list = []
+        for tile_name in tile_names:
+            mosaic_list.append(create_focal_tile(tile_name, settings))
+
+    # Buffer the current county boundary.  600-meters will cover the 500-meter requirement.
+    buffered_boundary = arcpy.analysis.Buffer(
+        in_features=current_county,
+        out_feature_class=r"in_memory\Buffer",
+        buffer_distance_or_field="600 Meters",
+        dissolve_option="ALL")
+    with arcpy.da.SearchCursor(buffered_boundary, "SHAPE@") as buffer_cursor:
+        buffer_shape = next(buffer_cursor)[0]
+
+    # Remove the buffer in memory
+    arcpy.Delete_management(buffered_boundary)
+
+    # The mosaic is never written.  Strips are read from the tiles and clipped to the
+    # buffer as they are needed.
+    mosaic = virtual_mosaic(mosaic_list)
+    x_min, y_max, rows, cols = mosaic_grid(mosaic, buffer_shape.extent)
+    reader = clip_reader(mosaic, polygon_edges(buffer_shape), x_min, y_max, cols)
+    journal_stage(journal_folder, county_name, "clipped", final_raster, rows=rows, cols=cols)
+
+    # Create the compressed final raster.  The focal tiles are clipped straight to the
+    # final raster.  It is written to a .part file that is renamed when it is complete.
+    print(f"\t{county_name}...creating focal raster...")
+    if settings["tile_first"]:
+        strips = read_strips(reader, rows)
+    else:
+        kernel = focal_kernel(cell_radius, settings["distance"], mosaic["cell_width"], mosaic["cell_height"],
+                              y_max, mosaic["spatial_reference"])
+        strips = stack_statistics(focal_engine.focal_statistics_strips(
+            reader, rows, cols, cell_radius, ignore_nodata="NODATA", kernel=kernel,
+            statistics=settings["statistics"]), settings["statistics"])
+    write_strips(strips, rows, cols, x_min, y_max, mosaic["cell_width"], mosaic["cell_height"],
+                 mosaic["spatial_reference"], final_raster, settings["statistics"])
+    journal_stage(journal_folder, county_name, "focal", final_raster)
+
+    journal_final(journal_folder, county_name, final_raster, settings["statistics"])
+    return county_name
+
+
+def estimate_scratch_bytes(county_shape, tile_names, settings):
+    """Estimate the most disk space a county needs while it is processed.
+
+    Only the compressed final raster is written, but it is counted at 4 bytes per cell
+    and band since compression varies.  There is one band per focal statistic.  In tile
+    first mode, focal tiles that do not exist yet are added at 4 bytes per cell and band
+    of a full tile.
+    """
+    extent = county_shape.extent
+    latitude = min(max(abs(extent.YMin), abs(extent.YMax)), 89.0)
+    margin_y = 600 / 111320.0
+    margin_x = margin_y / math.cos(math.radians(latitude))
+    rows = (extent.YMax - extent.YMin + 2 * margin_y) / settings["cell_size"]
+    cols = (extent.XMax - extent.XMin + 2 * margin_x) / settings["cell_size"]
+    bands = len(settings.get("statistics", ["MEAN"]))
+    scratch = 4 * rows * cols * bands
+
+    if settings["tile_first"]:
+        tile_cells = (1 / settings["cell_size"] + 12) ** 2
+        new_tiles = [tile_name for tile_name in tile_names
+                     if not arcpy.Exists(focal_tile_path(tile_name, settings))]
+        scratch += 4 * tile_cells * bands * len(new_tiles)
+    return int(scratch)
+
+
+def run_counties_parallel(jobs, settings, max_workers, disk_budget, counter, row_count):
+    """Run the counties in a process pool while the estimated scratch space fits the budget.
+
+    Counties are started largest first.  A county is only started when its estimate plus
+    the estimates of the running counties is under disk_budget bytes.  A county that is
+    larger than the whole budget runs by itself.  A county that fails is reported and the
+    others keep going.
+
+    jobs - list of (county name, county JSON, tile names, estimated bytes)
+
+    Returns the names of the counties that failed.
+    """
+    pending = sorted(jobs, key=lambda job: job[3], reverse=True)
+    running = {}
+    in_use = 0
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Start the largest counties that fit
+            for job in list(pending):
+                if len(running) >= max_workers:
+                    break
+                if in_use + job[3] <= disk_budget or not running:
+                    pending.remove(job)
+                    future = executor.submit(process_county, job[0], job[1], job[2], settings)
+                    running[future] = job
+                    in_use += job[3]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                in_use -= job[3]
+                try:
+                    future.result()
+                except Exception as error:
+                    print(f"{job[0]}: FAIL: {error}")
+                    failures.append(job[0])
+                    continue
+                print(f"{job[0]}: {counter} of {row_count}...done")
+                counter += 1
+    return failures
+
+
+def main(ned, county_shapefile, tile_first=False, max_workers=1, disk_budget_gb=None, statistics=("MEAN",)):
+    if ned == 'ned_1':
+        raster_type = "1"  # For 1 arcsec
+    elif ned == 'ned_1_3':
+        raster_type = "1_3"  # For 1/3 arcsec
+    else:
+        print(f"ERROR: received {ned} when the parameter should be either 'ned_1' or 'ned_1_3'")
+        sys.exit(1)
+
+    # Variables
+    path = r'C:\GIS\Focal_Work'
+    outpath = r'D:\Focal_Work'
+    county_boundaries = os.path.join(path, 'Scripts', county_shapefile)
+    tiles = os.path.join(path, "Scripts", "ned_" + raster_type + "_tile_index.shp")
+    main_folder = os.path.join(path, 'NED_' + raster_type + '_arcsec_source')
+    final_rasters = os.path.join(outpath, 'NED_' + raster_type + '_arcsec_working\Final_Rasters')
+    tile_focal_rasters = os.path.join(outpath, 'NED_' + raster_type + '_arcsec_working\Tile_Focal_Rasters')
+    journal_folder = os.path.join(outpath, 'NED_' + raster_type + '_arcsec_working\Journal')
+
+    # 500-meter radius is needed. NED 1 arcsec cell size is about 30 meters.  NED 1/3 arcsec
+    # cell size is about 10 meters. Therefore, use 500/30 = 16.67, rounded to 17 for NED 1 arsec.
+    # Else use 50 for NED 1/3 arcsec (50 * 10 meter cell size = 500 meters).
+    # The cells are only that size near the equator in GCS, so GCS rasters use an ellipse that
+    # covers 500 meters at each latitude instead.  The cell radius is for projected rasters.
+    distance = 500.0
+    if raster_type == '1_3':
+        cell_radius = 50
+        cell_size = 1 / 10800
+    else:
+        cell_radius = 17
+        cell_size = 1 / 3600
+
+    # In tile first mode the focal mean is calculated once per tile and the counties are
+    # clipped from the focal tiles.  The tiles overlap by a few cells, so look a little
+    # past the halo for neighbors.
+    tile_extents = None
+    tile_tree = None
+    if tile_first:
+        if not os.path.exists(tile_focal_rasters):
+            os.makedirs(tile_focal_rasters)
+        tile_extents = read_tile_extents(tiles)
+        tile_tree = build_str_tree(list(tile_extents.values()))
+
+    settings = {"raster_type": raster_type,
+                "main_folder": main_folder,
+                "final_rasters": final_rasters,
+                "tile_focal_rasters": tile_focal_rasters,
+                "tile_first": tile_first,
+                "tile_extents": tile_extents,
+                "tile_tree": tile_tree,
+                "cell_radius": cell_radius,
+                "distance": distance,
+                "statistics": ["MEAN"] + [statistic for statistic in statistics if statistic != "MEAN"],
+                "cell_size": cell_size,
+                "journal": journal_folder}
+
+    # Clean up after any run that crashed and find the counties that are already finished
+    if not os.path.exists(journal_folder):
+        os.makedirs(journal_folder)
+    finished = sweep_outputs(journal_folder, settings)
+
+    # The tiles within 1,000 feet of each county.  This will cover the 500 feet requirement.
+    county_tiles = load_county_tiles(
+        lookup_file=os.path.join(path, "Scripts", "ned_" + raster_type + "_county_tiles.json"),
+        county_boundaries=county_boundaries,
+        tiles=tiles)
+
+    # Get the count of the rows
+    row_count = int(arcpy.GetCount_management(county_boundaries)[0])
+    counter = 1
+
+    # Use this list if only certain counties should be exported.  Otherwise, leave the list empty.
+    county_list = []
+    if len(county_list) != 0:
+        row_count = len(county_list)
+
+    # Use this list to skip counties.
+    skip_list = ['Rose_Island_AS', 'Swains_Island_AS']
+    if len(skip_list) != 0 and len(county_list) == 0:
+        row_count -= len(skip_list)
+
+    # Counties for the process pool and the counties that failed
+    jobs = []
+    failures = []
+
+    # Iterate through the county boundaries
+    with arcpy.da.SearchCursor(county_boundaries, ["Place_Name", "SHAPE@"]) as cursor:
+        for row in cursor:
+            county_name = row[0]
+            current_county = row[1]
+
+            # Check if only certain counties are to be processed.
+            if len(county_list) != 0:
+                if county_name not in county_list:
+                    continue
+
+            # Check if a county is listed in the skip_list.
+            if county_name in skip_list:
+                print("\t...in skip_list. Skipping...")
+                continue
+
+            # Check the journal to see if the final raster is finished.  If so, continue
+            if final_raster_path(final_rasters, county_name) in finished:
+                print(f"{county_name} final raster already exists.  Skipping...")
+                counter += 1
+                continue
+
+            tile_names = county_tiles.get(county_name, [])
+            if max_workers > 1:
+                jobs.append((county_name, current_county.JSON, tile_names,
+                             estimate_scratch_bytes(current_county, tile_names, settings)))
+                continue
+
+            print(f"{county_name}: {counter} of {row_count}")
+            try:
+                process_county(county_name, current_county.JSON, tile_names, settings)
+            except Exception as error:
+                print(f"\tFAIL: {error}")
+                failures.append(county_name)
+                continue
+
+            # Final message
+            print("\t...done\n")
+            counter += 1
+
+    if jobs:
+        # Focal tiles are shared between counties, so make them before the counties run at
+        # the same time.  Otherwise two workers could write the same tile.
+        if tile_first:
+            print("Creating focal tiles...")
+            tile_jobs = sorted({tile_name for _, _, tile_names, _ in jobs for tile_name in tile_names})
+            failed_tiles = set()
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(create_focal_tile, tile_name, settings): tile_name
+                           for tile_name in tile_jobs}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as error:
+                        print(f"{futures[future]}: FAIL: {error}")
+                        failed_tiles.add(futures[future])
+
+            # Counties that need a tile that failed are not started
+            for job in [job for job in jobs if failed_tiles.intersection(job[2])]:
+                print(f"{job[0]}: FAIL: a focal tile of the county failed")
+                failures.append(job[0])
+                jobs.remove(job)
+            jobs = [job[:3] + (estimate_scratch_bytes(arcpy.AsShape(job[1], True), job[2], settings),)
+                    for job in jobs]
+
+        # Leave 20 percent of the free space on the output drive when there is no budget.
+        if disk_budget_gb is None:
+            disk_budget = 0.8 * shutil.disk_usage(outpath).free
+        else:
+            disk_budget = disk_budget_gb * 1024 ** 3
+        failures += run_counties_parallel(jobs, settings, max_workers, disk_budget, counter, row_count)
+
+    if failures:
+        print(f"\n\n{len(failures)} counties failed: {', '.join(failures)}")
+        sys.exit(1)
+    print("\n\nEnd of line.")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        ned = sys.argv[1]
+        county_shapefile = sys.argv[2]
+
+        # Options after the county shapefile: tile_first, workers=<n>, disk_gb=<n>, stats=<list>
+        options = sys.argv[3:]
+        tile_first = "tile_first" in options
+        max_workers = 1
+        disk_budget_gb = None
+        statistics = ["MEAN"]
+        for option in options:
+            if option.startswith("workers="):
+                max_workers = int(option.split("=")[1])
+            elif option.startswith("disk_gb="):
+                disk_budget_gb = float(option.split("=")[1])
+            elif option.startswith("stats="):
+                statistics = option.split("=")[1].upper().split(",")
+                for statistic in statistics:
+                    if statistic not in focal_engine.STATISTICS:
+                        print(f"ERROR: {statistic} is not one of {', '.join(focal_engine.STATISTICS)}")
+                        sys.exit(1)
+
+        if ned not in ["ned_1", "ned_1_3"]:
+            print("ERROR: Parameter needs to be either 'ned_1' or 'ned_1_3'")
+            sys.exit(1)
+        main(ned, county_shapefile, tile_first, max_workers, disk_budget_gb, statistics)
+    else:
+        print("ERROR: Parameter required.  Use either 'ned_1' or 'ned_1_3'")
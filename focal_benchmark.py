@@ -0,0 +1,149 @@
+"""
+Benchmark the focal mean methods against a brute-force reference.
+
+Synthetic DEM patches with NoData holes are filtered with the circular focal
+mean at the NED radii (17 cells for NED 1 arcsec, 50 cells for NED 1/3 arcsec)
+and at a very large radius of 200 cells by three methods:
+
+    brute - focal_engine.brute_focal_mean, which visits every neighborhood cell
+    span  - focal_engine's summed-area span method, which create_focal_rasters
+            uses for small radii
+    fft   - focal_engine's FFT convolution of the values and of the valid cell
+            counts, which method="auto" picks for large radii
+
+Each method is run with ignore_nodata DATA and NODATA.  The span method is
+skipped at radius 200, since the neighborhood is too large for its count
+plane.  The max absolute error against brute, the cells per second and the
+peak memory (tracemalloc) are printed.  A method fails when its NoData cells
+differ from brute or its error is over the tolerance, and then the script
+exits with 1.  Any focal engine used by create_focal_rasters has to pass this.
+
+Usage: python focal_benchmark.py [rows] [cols]
+
+Author: Jesse Morgan
+"""
+import sys
+import time
+import tracemalloc
+import numpy as np
+import focal_engine
+
+# Largest absolute difference from brute allowed, in meters
+TOLERANCE = 1e-3
+
+
+def synthetic_dem(rows, cols, seed=0):
+    """
+    Create a DEM patch with ridges, noise and NoData holes.
+
+    parameters:
+        rows - the number of rows
+        cols - the number of columns
+        seed - the random seed
+
+    returns:
+        A float64 array in meters with NoData as NaN.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:rows, 0:cols] / 100.0
+    dem = 300.0 + 80.0 * np.sin(x * 1.3) * np.cos(y * 0.7) + 25.0 * np.sin(x * 4.1 + y * 2.9)
+    dem += rng.normal(0.0, 2.0, (rows, cols))
+
+    # A lake, a few voids and a strip off the edge of the data
+    dem[(y - rows / 250.0) ** 2 + (x - cols / 300.0) ** 2 < (rows / 1000.0) ** 2] = np.nan
+    for _ in range(5):
+        row, col = rng.integers(0, rows), rng.integers(0, cols)
+        dem[row:row + 3, col:col + 4] = np.nan
+    dem[:, :cols // 20] = np.nan
+    return dem
+
+
+def fft_focal_mean(array, radius, ignore_nodata="NODATA"):
+    """
+    Calculate the focal mean with focal_engine's FFT convolutions.
+    """
+    return focal_engine.focal_mean(array, radius, ignore_nodata=ignore_nodata, method="fft")
+
+
+def span_focal_mean(array, radius, ignore_nodata="NODATA"):
+    """
+    Calculate the focal mean with focal_engine's spans.
+    """
+    return focal_engine.focal_mean(array, radius, ignore_nodata=ignore_nodata, method="span")
+
+
+METHODS = {"brute": focal_engine.brute_focal_mean,
+           "span": span_focal_mean,
+           "fft": fft_focal_mean}
+
+
+def span_fits(radius):
+    """
+    Return whether the span method can calculate a circle of the radius.
+    """
+    try:
+        focal_engine.check_spans(focal_engine.circle_spans(radius))
+    except ValueError:
+        return False
+    return True
+
+
+def run_method(method, array, radius, ignore_nodata):
+    """
+    Run one method and measure it.
+
+    returns:
+        The result, the seconds it took and the peak memory in bytes.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = METHODS[method](array, radius, ignore_nodata=ignore_nodata)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def benchmark(rows, cols):
+    """
+    Run every method at the NED radii and compare them to brute.
+
+    returns:
+        True when every method passes.
+    """
+    dem = synthetic_dem(rows, cols)
+    cells = rows * cols
+    passed = True
+    print(f"{rows} x {cols} DEM, {int(np.isnan(dem).sum())} NoData cells")
+    print(f"{'radius':>6} {'nodata':>6} {'method':>6} {'max error':>10} {'cells/sec':>12} {'peak MB':>8}")
+    for radius in [17, 50, 200]:
+        for ignore_nodata in ["DATA", "NODATA"]:
+            expected = None
+            for method in METHODS:
+                if method == "span" and not span_fits(radius):
+                    print(f"{radius:>6} {ignore_nodata:>6} {method:>6} skipped, too large for the count plane")
+                    continue
+                result, seconds, peak = run_method(method, dem, radius, ignore_nodata)
+                if expected is None:
+                    expected = result
+                    error = 0.0
+                else:
+                    valid = ~np.isnan(expected)
+                    error = float(np.max(np.abs(result[valid] - expected[valid]), initial=0.0))
+                    if not np.array_equal(np.isnan(result), np.isnan(expected)):
+                        print(f"FAIL: {method} NoData cells differ from brute")
+                        passed = False
+                    elif error > TOLERANCE:
+                        print(f"FAIL: {method} error is over {TOLERANCE}")
+                        passed = False
+                print(f"{radius:>6} {ignore_nodata:>6} {method:>6} {error:>10.2e} {cells / seconds:>12,.0f} "
+                      f"{peak / 1024 ** 2:>8.1f}")
+    return passed
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    cols = int(sys.argv[2]) if len(sys.argv) > 2 else rows
+    if not benchmark(rows, cols):
+        sys.exit(1)
+    print("OK")
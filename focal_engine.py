@@ -0,0 +1,739 @@
+"""
+Circular focal mean for large rasters without arcpy.
+
+The circular neighborhood is split into one horizontal span per row offset.
+Each span is summed in constant time from a row-wise prefix sum (summed-area)
+table, so a cell costs O(radius) instead of O(radius ** 2).  Rasters are
+processed in strips of rows with a halo of radius rows above and below.
+
+Cells are in the neighborhood when their centers are within the radius of the
+processing cell, which matches NbrCircle(radius, "CELL").  Cells outside of
+the raster are not counted.
+
+NoData (NaN) is handled by carrying a value sum plane and a valid count plane
+through the same spans.  The mean is sum / count.  With ignore_nodata="DATA"
+a cell has a value when any of its neighborhood is valid.  With
+ignore_nodata="NODATA" a cell is NoData when any of its neighborhood is
+NoData, the same as FocalStatistics.  The sums are float64 and the counts are
+uint16, so a strip needs 10 bytes per cell.
+
+Rasters in a geographic coordinate system have cells that get narrower toward
+the poles.  For those, geographic_kernel builds an elliptical neighborhood that
+covers a distance in meters, with the x radius scaled by the latitude of each
+strip.  The spans are cached by latitude band, so they are only built once per
+band and the cost per strip is the same as for a circle.
+
+For large radii the spans cost more than a convolution, so MEAN and STD can
+also be calculated by FFT.  Each strip is cut into blocks of columns that are
+convolved with the neighborhood (overlap-save), with the kernel transform
+cached by neighborhood and block size.  The valid cells and the NoData cells
+are convolved the same way to get the counts.  With method="auto" the FFT is
+used when the neighborhood is at least the crossover radius, which is measured
+the first time it is needed.
+
+Run this file to check the engine against a brute-force reference.
+
+Author: Jesse Morgan
+"""
+import functools
+import math
+import sys
+import time
+import numpy as np
+
+
+def circle_spans(radius):
+    """
+    Split a circular neighborhood into horizontal spans.
+
+    parameters:
+        radius - the radius in cells
+
+    returns:
+        A tuple of (row offsets, half widths).  The span for a row offset
+        covers the column offsets -half width to +half width.
+    """
+    offsets = np.arange(-radius, radius + 1)
+    half_widths = np.floor(np.sqrt(radius ** 2 - offsets ** 2) + 1e-9).astype(np.int64)
+    return offsets, half_widths
+
+
+def ellipse_spans(radius_x, radius_y):
+    """
+    Split an elliptical neighborhood into horizontal spans.
+
+    Cells are in the neighborhood when (dx / radius_x) ** 2 + (dy / radius_y) ** 2
+    is at most 1.
+
+    parameters:
+        radius_x - the radius across columns in cells
+        radius_y - the radius across rows in cells
+
+    returns:
+        A tuple of (row offsets, half widths) like circle_spans.
+    """
+    halo = int(math.floor(radius_y + 1e-9))
+    offsets = np.arange(-halo, halo + 1)
+    half_widths = np.floor(radius_x * np.sqrt(np.maximum(1 - (offsets / radius_y) ** 2, 0)) + 1e-9)
+    return offsets, half_widths.astype(np.int64)
+
+
+def span_halo(spans):
+    """
+    Return the (rows, columns) a neighborhood reaches past the processing cell.
+    """
+    offsets, half_widths = spans
+    return int(-offsets[0]), int(half_widths.max())
+
+
+def meters_per_degree(latitude):
+    """
+    Return the (east-west, north-south) length in meters of a degree at a latitude.
+    """
+    phi = math.radians(latitude)
+    return (111412.84 * math.cos(phi) - 93.5 * math.cos(3 * phi),
+            111132.92 - 559.82 * math.cos(2 * phi) + 1.175 * math.cos(4 * phi))
+
+
+@functools.lru_cache(maxsize=None)
+def band_spans(distance, cell_width, cell_height, latitude):
+    """
+    Build the elliptical spans for a distance at a latitude.  Cached, so call it
+    with a quantized latitude.
+    """
+    meters_x, meters_y = meters_per_degree(latitude)
+    return ellipse_spans(distance / (cell_width * meters_x), distance / (cell_height * meters_y))
+
+
+def geographic_kernel(distance, cell_width, cell_height, y_max, band=0.05):
+    """
+    Make a kernel for focal_mean_strips that covers a distance in a GCS raster.
+
+    parameters:
+        distance - the neighborhood radius in meters
+        cell_width - the cell width in degrees
+        cell_height - the cell height in degrees
+        y_max - the top of the raster in degrees
+        band - the latitude band, in degrees, that shares a set of spans
+
+    returns:
+        A function of (first row, number of rows) that returns the spans for
+        the latitude at the middle of the strip.
+    """
+    def kernel(row, nrows):
+        latitude = y_max - (row + nrows / 2) * cell_height
+        latitude = min(abs(round(latitude / band) * band), 89.0)
+        return band_spans(distance, cell_width, cell_height, latitude)
+
+    return kernel
+
+
+def row_prefix_sums(plane, radius, dtype=np.float64):
+    """
+    Build a row-wise prefix sum table with radius columns of zeros on each side.
+
+    Integer tables may overflow.  Span sums are still exact as long as the sum
+    of one neighborhood fits in the type, because the overflow cancels.
+
+    parameters:
+        plane - 2-D array
+        radius - the number of columns of zeros, at least the widest span
+        dtype - the type of the table
+
+    returns:
+        An array of shape (rows, columns + 2 * radius + 1).  The sum of
+        plane[i, a:b] is table[i, b + radius] - table[i, a + radius].
+    """
+    rows, cols = plane.shape
+    table = np.zeros((rows, cols + 2 * radius + 1), dtype=dtype)
+    np.cumsum(plane, axis=1, dtype=dtype, out=table[:, radius + 1:radius + 1 + cols])
+    table[:, radius + 1 + cols:] = table[:, radius + cols:radius + 1 + cols]
+    return table
+
+
+def span_sums(table, spans, out_rows, cols):
+    """
+    Sum a prefix sum table over the neighborhood spans.
+
+    parameters:
+        table - table from row_prefix_sums with the spans' halo rows above and
+                below the output rows
+        spans - spans from circle_spans or ellipse_spans
+        out_rows - the number of output rows
+        cols - the number of columns
+
+    returns:
+        An array of shape (out_rows, cols) of the same type as the table.
+    """
+    halo = span_halo(spans)[0]
+    pad = (table.shape[1] - cols - 1) // 2
+    sums = np.zeros((out_rows, cols), dtype=table.dtype)
+    for offset, half_width in zip(*spans):
+        rows = table[halo + offset:halo + offset + out_rows]
+        sums += rows[:, pad + half_width + 1:pad + half_width + 1 + cols]
+        sums -= rows[:, pad - half_width:pad - half_width + cols]
+    return sums
+
+
+def extent_counts(spans, row_in_extent, cols):
+    """
+    Count the neighborhood cells that are inside of the raster.
+
+    parameters:
+        spans - spans from circle_spans or ellipse_spans
+        row_in_extent - boolean array for the window rows, including the halo
+        cols - the number of columns
+
+    returns:
+        A uint16 array of shape (window rows - 2 * halo rows, cols).
+    """
+    offsets, half_widths = spans
+    radius = span_halo(spans)[0]
+    out_rows = len(row_in_extent) - 2 * radius
+
+    # Columns in the span for each row offset, clipped to the raster
+    col = np.arange(cols)
+    col_counts = (np.minimum(col[None, :] + half_widths[:, None], cols - 1)
+                  - np.maximum(col[None, :] - half_widths[:, None], 0) + 1)
+
+    # Whether the row for each output row and row offset is in the raster
+    row_index = np.arange(out_rows)[:, None] + radius + offsets[None, :]
+    counts = row_in_extent[row_index].astype(np.float32) @ col_counts.astype(np.float32)
+    return counts.astype(np.uint16)
+
+
+def check_spans(spans):
+    """
+    Make sure the neighborhood cell count fits in the uint16 count plane of the
+    span method.  The FFT does not have a count plane.
+
+    parameters:
+        spans - spans from circle_spans or ellipse_spans
+    """
+    if np.sum(2 * spans[1] + 1) > np.iinfo(np.uint16).max:
+        raise ValueError(f"A neighborhood of {np.sum(2 * spans[1] + 1)} cells is too large "
+                         f"for the count plane.")
+
+
+def sliding_extreme(plane, half_width, function):
+    """
+    Find the minimum or maximum of each row over a moving span of columns.
+
+    This is the van Herk/Gil-Werman algorithm.  The row is cut into blocks the
+    size of the span, and every span is covered by the suffix of one block and
+    the prefix of the next, so each cell costs three comparisons whatever the
+    width of the span.
+
+    parameters:
+        plane - 2-D float array
+        half_width - the span covers the columns -half width to +half width
+        function - np.minimum or np.maximum
+
+    returns:
+        A float64 array of the same shape.  Columns outside of the plane are
+        ignored.
+    """
+    rows, cols = plane.shape
+    size = 2 * half_width + 1
+    fill = np.inf if function is np.minimum else -np.inf
+    blocks = -(-(cols + 2 * half_width) // size)
+
+    padded = np.full((rows, blocks * size), fill)
+    padded[:, half_width:half_width + cols] = plane
+    padded = padded.reshape(rows, blocks, size)
+    prefix = function.accumulate(padded, axis=2).reshape(rows, -1)
+    suffix = function.accumulate(padded[:, :, ::-1], axis=2)[:, :, ::-1].reshape(rows, -1)
+
+    # The span of output column c starts at padded column c
+    return function(suffix[:, :cols], prefix[:, size - 1:size - 1 + cols])
+
+
+STATISTICS = ["MEAN", "STD", "MINIMUM", "MAXIMUM"]
+
+
+def focal_statistics_window(window, spans, first_row=None, raster_rows=None, ignore_nodata="NODATA",
+                            statistics=("MEAN",)):
+    """
+    Calculate focal statistics of the middle rows of a window in one pass.
+
+    MEAN and STD come from prefix sums of the values and their squares.  The
+    values are shifted by the window mean first so the squares do not lose
+    precision.  MINIMUM and MAXIMUM come from a moving minimum or maximum of
+    each distinct span width, combined across the row offsets.  STD is the
+    population standard deviation, as in FocalStatistics.
+
+    parameters:
+        window - float array with the spans' halo rows above and below the
+                 output rows.  NoData is NaN.
+        spans - spans from circle_spans or ellipse_spans
+        first_row - the raster row of the first window row.  Defaults to the
+                    window being the whole raster with its halo.
+        raster_rows - the number of rows in the raster
+        ignore_nodata - DATA or NODATA, as in FocalStatistics
+        statistics - any of MEAN, STD, MINIMUM and MAXIMUM
+
+    returns:
+        A dictionary of statistic to float32 array of the window's middle rows.
+    """
+    check_spans(spans)
+    rows, cols = window.shape
+    radius, pad = span_halo(spans)
+    out_rows = rows - 2 * radius
+    if first_row is None:
+        first_row, raster_rows = -radius, out_rows
+
+    window_row = first_row + np.arange(rows)
+    row_in_extent = (window_row >= 0) & (window_row < raster_rows)
+
+    valid = ~np.isnan(window)
+    shift = float(window[valid].mean()) if valid.any() else 0.0
+    values = np.where(valid, window - shift, 0.0)
+
+    counts = span_sums(row_prefix_sums(valid, pad, np.uint16), spans, out_rows, cols)
+    if ignore_nodata == "NODATA":
+        # Every neighborhood cell inside of the raster must be valid
+        has_value = counts == extent_counts(spans, row_in_extent, cols)
+    else:
+        has_value = counts > 0
+
+    results = {}
+    if "MEAN" in statistics or "STD" in statistics:
+        means = np.zeros((out_rows, cols), dtype=np.float64)
+        np.divide(span_sums(row_prefix_sums(values, pad), spans, out_rows, cols), counts,
+                  out=means, where=has_value)
+        if "MEAN" in statistics:
+            results["MEAN"] = means + shift
+        if "STD" in statistics:
+            squares = np.zeros((out_rows, cols), dtype=np.float64)
+            np.divide(span_sums(row_prefix_sums(values * values, pad), spans, out_rows, cols), counts,
+                      out=squares, where=has_value)
+            results["STD"] = np.sqrt(np.maximum(squares - means * means, 0.0))
+
+    offsets, half_widths = spans
+    for statistic, function, fill in [("MINIMUM", np.minimum, np.inf), ("MAXIMUM", np.maximum, -np.inf)]:
+        if statistic not in statistics:
+            continue
+        plane = np.where(valid, window, fill)
+        extreme = np.full((out_rows, cols), fill)
+        for half_width in np.unique(half_widths):
+            moving = sliding_extreme(plane, half_width, function)
+            for offset in offsets[half_widths == half_width]:
+                function(extreme, moving[radius + offset:radius + offset + out_rows], out=extreme)
+        results[statistic] = extreme
+
+    for statistic in results:
+        output = np.full((out_rows, cols), np.nan, dtype=np.float32)
+        output[has_value] = results[statistic][has_value]
+        results[statistic] = output
+    return results
+
+
+def fast_length(n):
+    """
+    Return the smallest length of at least n with only 2, 3 and 5 as factors.
+    """
+    best = 2 * n
+    power_5 = 1
+    while power_5 < best:
+        power_3 = power_5
+        while power_3 < best:
+            length = power_3
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            power_3 *= 3
+        power_5 *= 5
+    return best
+
+
+@functools.lru_cache(maxsize=8)
+def kernel_transform(offsets, half_widths, shape):
+    """
+    Build the real FFT of a neighborhood centered on the origin.  Cached, so
+    call it with tuples of the spans.
+
+    parameters:
+        offsets - tuple of row offsets
+        half_widths - tuple of half widths
+        shape - the (rows, columns) of the transform
+
+    returns:
+        A complex array from np.fft.rfft2.
+    """
+    kernel = np.zeros(shape)
+    for offset, half_width in zip(offsets, half_widths):
+        columns = np.arange(-half_width, half_width + 1) % shape[1]
+        kernel[offset % shape[0], columns] = 1.0
+    return np.fft.rfft2(kernel)
+
+
+def fft_statistics_window(window, spans, first_row=None, raster_rows=None, ignore_nodata="NODATA",
+                          statistics=("MEAN",), block_cols=1024):
+    """
+    Calculate the focal MEAN and STD of the middle rows of a window by FFT.
+
+    The window is convolved in blocks of columns with the halo columns of the
+    neighbors on each side.  The transform is at least the block plus one halo
+    wide, so columns outside of the raster wrap onto zeros and are not counted.
+    The counts are rounded to whole cells.  See focal_statistics_window for the
+    parameters.
+
+    parameters:
+        block_cols - the number of output columns per block
+
+    returns:
+        A dictionary of statistic to float32 array of the window's middle rows.
+    """
+    if not set(statistics) <= {"MEAN", "STD"}:
+        raise ValueError(f"The FFT only calculates MEAN and STD, not {', '.join(statistics)}.")
+    rows, cols = window.shape
+    radius, pad = span_halo(spans)
+    out_rows = rows - 2 * radius
+    if first_row is None:
+        first_row, raster_rows = -radius, out_rows
+
+    window_row = first_row + np.arange(rows)
+    row_in_extent = (window_row >= 0) & (window_row < raster_rows)
+
+    valid = ~np.isnan(window)
+    shift = float(window[valid].mean()) if valid.any() else 0.0
+    values = np.where(valid, window - shift, 0.0)
+
+    # Planes of valid cells, NoData cells inside of the raster, values and squares
+    planes = [valid.astype(np.float64), (~valid & row_in_extent[:, None]).astype(np.float64), values]
+    if "STD" in statistics:
+        planes.append(values * values)
+    planes = np.stack(planes)
+
+    block_cols = min(block_cols, cols)
+    shape = (fast_length(rows), fast_length(block_cols + 2 * pad))
+    transform = kernel_transform(tuple(spans[0].tolist()), tuple(spans[1].tolist()), shape)
+    sums = np.empty((len(planes), out_rows, cols))
+    for col in range(0, cols, block_cols):
+        ncols = min(block_cols, cols - col)
+        start, end = max(col - pad, 0), min(col + ncols + pad, cols)
+        block = np.fft.irfft2(np.fft.rfft2(planes[:, :, start:end], shape) * transform, shape)
+        sums[:, :, col:col + ncols] = block[:, radius:radius + out_rows, col - start:col - start + ncols]
+
+    counts = np.rint(sums[0])
+    has_value = counts > 0
+    if ignore_nodata == "NODATA":
+        has_value &= np.rint(sums[1]) == 0
+
+    results = {}
+    means = np.zeros((out_rows, cols))
+    np.divide(sums[2], counts, out=means, where=has_value)
+    if "MEAN" in statistics:
+        results["MEAN"] = means + shift
+    if "STD" in statistics:
+        squares = np.zeros((out_rows, cols))
+        np.divide(sums[3], counts, out=squares, where=has_value)
+        results["STD"] = np.sqrt(np.maximum(squares - means * means, 0.0))
+
+    for statistic in results:
+        output = np.full((out_rows, cols), np.nan, dtype=np.float32)
+        output[has_value] = results[statistic][has_value]
+        results[statistic] = output
+    return results
+
+
+@functools.lru_cache(maxsize=None)
+def fft_crossover(trial_cols=1024, trial_rows=256):
+    """
+    Measure the smallest radius at which the FFT is faster than the spans on
+    this machine.  Cached, so it is only measured once per process.
+
+    returns:
+        The radius in cells, or infinity when the FFT never wins.
+    """
+    rng = np.random.default_rng(0)
+    for radius in [8, 16, 32, 64, 128]:
+        spans = circle_spans(radius)
+        window = rng.normal(100.0, 25.0, (trial_rows + 2 * radius, trial_cols))
+        seconds = []
+        for function in [focal_statistics_window, fft_statistics_window]:
+            # The second run has the kernel transform cached
+            for _ in range(2):
+                start = time.perf_counter()
+                function(window, spans)
+            seconds.append(time.perf_counter() - start)
+        if seconds[1] < seconds[0]:
+            return radius
+    return math.inf
+
+
+def window_function(spans, statistics=("MEAN",), method="auto"):
+    """
+    Pick the function that calculates a window's focal statistics.
+
+    parameters:
+        spans - spans from circle_spans or ellipse_spans
+        statistics - the statistics that are needed
+        method - span, fft or auto.  Auto uses the FFT when it can calculate
+                 the statistics and the neighborhood reaches the crossover.
+
+    returns:
+        focal_statistics_window or fft_statistics_window.
+    """
+    if method == "fft":
+        return fft_statistics_window
+    if (method == "auto" and set(statistics) <= {"MEAN", "STD"}
+            and max(span_halo(spans)) >= fft_crossover()):
+        return fft_statistics_window
+    return focal_statistics_window
+
+
+def focal_mean_window(window, spans, first_row=None, raster_rows=None, ignore_nodata="NODATA"):
+    """
+    Calculate the focal mean of the middle rows of a window.  See
+    focal_statistics_window.
+
+    returns:
+        A float32 array with the focal mean of the window's middle rows.
+    """
+    return focal_statistics_window(window, spans, first_row, raster_rows, ignore_nodata)["MEAN"]
+
+
+def focal_statistics_strips(reader, rows, cols, radius, strip_rows=1024, ignore_nodata="NODATA",
+                            kernel=None, statistics=("MEAN",), method="auto"):
+    """
+    Calculate focal statistics of a raster one strip of rows at a time.
+
+    parameters:
+        reader - function of (first row, number of rows) that returns a float
+                 array of shape (number of rows, cols) with NoData and rows
+                 outside of the raster as NaN
+        rows - the number of rows in the raster
+        cols - the number of columns in the raster
+        radius - the radius in cells of a circular neighborhood
+        strip_rows - the number of output rows per strip
+        ignore_nodata - DATA or NODATA, as in FocalStatistics
+        kernel - optional function of (first row, number of rows) that returns
+                 the spans for a strip, such as geographic_kernel.  Replaces
+                 the circle.
+        statistics - any of MEAN, STD, MINIMUM and MAXIMUM
+        method - span, fft or auto, see window_function
+
+    returns:
+        A generator of (first row, dictionary of statistic to float32 strip).
+    """
+    if kernel is None:
+        spans = circle_spans(radius)
+        kernel = lambda row, nrows: spans
+
+    for row in range(0, rows, strip_rows):
+        nrows = min(strip_rows, rows - row)
+        spans = kernel(row, nrows)
+        halo = span_halo(spans)[0]
+        window = reader(row - halo, nrows + 2 * halo)
+        function = window_function(spans, statistics, method)
+        yield row, function(window, spans, row - halo, rows, ignore_nodata, statistics)
+
+
+def focal_mean_strips(reader, rows, cols, radius, strip_rows=1024, ignore_nodata="NODATA", kernel=None,
+                      method="auto"):
+    """
+    Calculate the focal mean of a raster one strip of rows at a time.  See
+    focal_statistics_strips.
+
+    returns:
+        A generator of (first row, float32 focal mean strip).
+    """
+    for row, results in focal_statistics_strips(reader, rows, cols, radius, strip_rows, ignore_nodata,
+                                                kernel, method=method):
+        yield row, results["MEAN"]
+
+
+def array_reader(array):
+    """
+    Make a strip reader for an in memory array.
+
+    parameters:
+        array - 2-D array with NoData as NaN
+
+    returns:
+        A function for focal_mean_strips.
+    """
+    rows, cols = array.shape
+
+    def read(row, nrows):
+        window = np.full((nrows, cols), np.nan, dtype=np.float64)
+        start, end = max(row, 0), min(row + nrows, rows)
+        if start < end:
+            window[start - row:end - row] = array[start:end]
+        return window
+
+    return read
+
+
+def focal_mean(array, radius, strip_rows=1024, ignore_nodata="NODATA", kernel=None, method="auto"):
+    """
+    Calculate the focal mean of an in memory array.
+
+    parameters:
+        array - 2-D array with NoData as NaN
+        radius - the radius in cells
+        strip_rows - the number of output rows per strip
+        ignore_nodata - DATA or NODATA, as in FocalStatistics
+        kernel - optional span function, see focal_mean_strips
+        method - span, fft or auto, see window_function
+
+    returns:
+        A float32 array of the same shape.
+    """
+    rows, cols = array.shape
+    result = np.empty((rows, cols), dtype=np.float32)
+    for row, strip in focal_mean_strips(array_reader(array), rows, cols, radius, strip_rows,
+                                        ignore_nodata, kernel, method):
+        result[row:row + len(strip)] = strip
+    return result
+
+
+def brute_focal_statistics(array, radius, ignore_nodata="NODATA", spans=None):
+    """
+    Calculate the focal statistics by visiting every neighborhood cell.  This
+    is the reference for checking the engine.
+
+    parameters:
+        array - 2-D array with NoData as NaN
+        radius - the radius in cells
+        ignore_nodata - DATA or NODATA, as in FocalStatistics
+        spans - optional spans that replace the circle
+
+    returns:
+        A dictionary of statistic to float64 array of the same shape.
+    """
+    rows, cols = array.shape
+    if spans is None:
+        spans = circle_spans(radius)
+    sums = np.zeros((rows, cols), dtype=np.float64)
+    squares = np.zeros((rows, cols), dtype=np.float64)
+    counts = np.zeros((rows, cols), dtype=np.float64)
+    minimums = np.full((rows, cols), np.inf)
+    maximums = np.full((rows, cols), -np.inf)
+    nodata = np.zeros((rows, cols), dtype=bool)
+
+    for dy, half_width in zip(*spans):
+        if abs(dy) >= rows:
+            continue
+        # Neighbors more than a raster width away are never inside of the raster
+        for dx in range(max(-half_width, 1 - cols), min(half_width, cols - 1) + 1):
+            # Output cells whose neighbor at (dy, dx) is inside of the raster
+            out_rows = slice(max(0, -dy), min(rows, rows - dy))
+            out_cols = slice(max(0, -dx), min(cols, cols - dx))
+            neighbors = array[max(0, dy):min(rows, rows + dy), max(0, dx):min(cols, cols + dx)]
+            sums[out_rows, out_cols] += np.nan_to_num(neighbors)
+            squares[out_rows, out_cols] += np.nan_to_num(neighbors) ** 2
+            counts[out_rows, out_cols] += ~np.isnan(neighbors)
+            np.fmin(minimums[out_rows, out_cols], neighbors, out=minimums[out_rows, out_cols])
+            np.fmax(maximums[out_rows, out_cols], neighbors, out=maximums[out_rows, out_cols])
+            nodata[out_rows, out_cols] |= np.isnan(neighbors)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+        results = {"MEAN": means,
+                   "STD": np.sqrt(np.maximum(squares / counts - means ** 2, 0.0)),
+                   "MINIMUM": minimums,
+                   "MAXIMUM": maximums}
+    for statistic in results:
+        results[statistic][counts == 0] = np.nan
+        if ignore_nodata == "NODATA":
+            results[statistic][nodata] = np.nan
+    return results
+
+
+def brute_focal_mean(array, radius, ignore_nodata="NODATA", spans=None):
+    """
+    Calculate the focal mean by visiting every neighborhood cell.  See
+    brute_focal_statistics.
+
+    returns:
+        A float64 array of the same shape.
+    """
+    return brute_focal_statistics(array, radius, ignore_nodata, spans)["MEAN"]
+
+
+def self_check():
+    """
+    Compare the engine to the brute-force reference on random arrays.
+
+    returns:
+        The largest absolute difference.
+    """
+    rng = np.random.default_rng(42)
+    worst = 0.0
+    # A radius of 200 is too large for the span count plane, so only the FFT is checked
+    for rows, cols, radius, strip_rows, methods in [(60, 45, 5, 7, ["span", "fft"]),
+                                                    (120, 90, 17, 50, ["span", "fft"]),
+                                                    (130, 140, 50, 64, ["span", "fft"]),
+                                                    (300, 40, 200, 64, ["fft"])]:
+        array = rng.normal(100.0, 25.0, (rows, cols))
+        array[rng.random((rows, cols)) < 0.05 / radius ** 2] = np.nan
+        array[:rows // 5, :cols // 4] = np.nan
+
+        for ignore_nodata in ["DATA", "NODATA"]:
+            expected = brute_focal_mean(array, radius, ignore_nodata)
+            for method in methods:
+                result = focal_mean(array, radius, strip_rows, ignore_nodata, method=method)
+
+                if not np.array_equal(np.isnan(result), np.isnan(expected)):
+                    print(f"FAIL: NoData cells differ for radius {radius}, {ignore_nodata} and {method}")
+                    sys.exit(1)
+                valid = ~np.isnan(expected)
+                error = float(np.max(np.abs(result[valid] - expected[valid]), initial=0.0))
+                print(f"{rows} x {cols}, radius {radius}, {ignore_nodata}, {method}: {int(valid.sum())} cells, "
+                      f"max absolute error {error:.2e}")
+                worst = max(worst, error)
+
+    # A 500 meter neighborhood of 1 arc-second cells in Alaska, where the strips
+    # cross latitude bands
+    cell_size = 1 / 3600
+    kernel = geographic_kernel(500.0, cell_size, cell_size, 66.0, band=0.01)
+    array = rng.normal(100.0, 25.0, (160, 120))
+    array[rng.random(array.shape) < 0.0005] = np.nan
+    result = focal_mean(array, None, 40, "DATA", kernel)
+    for row in range(0, 160, 40):
+        spans = kernel(row, 40)
+        expected = brute_focal_mean(array, None, "DATA", spans)[row:row + 40]
+        error = float(np.nanmax(np.abs(result[row:row + 40] - expected)))
+        print(f"rows {row} to {row + 40}, ellipse {span_halo(spans)}: max absolute error {error:.2e}")
+        worst = max(worst, error)
+
+    # The FFT in blocks of columns narrower than the ellipse, for the mean and
+    # standard deviation
+    spans = kernel(0, 40)
+    halo = span_halo(spans)[0]
+    expected = brute_focal_statistics(array, None, "DATA", spans)
+    window = array_reader(array)(-halo, 40 + 2 * halo)
+    results = fft_statistics_window(window, spans, -halo, 160, "DATA", ("MEAN", "STD"), block_cols=48)
+    for statistic in ["MEAN", "STD"]:
+        error = float(np.nanmax(np.abs(results[statistic] - expected[statistic][:40])))
+        print(f"{statistic}, FFT blocks: max absolute error {error:.2e}")
+        worst = max(worst, error)
+
+    # Every statistic from one pass
+    array = rng.normal(1500.0, 3.0, (90, 110))
+    array[rng.random(array.shape) < 0.002] = np.nan
+    for ignore_nodata in ["DATA", "NODATA"]:
+        expected = brute_focal_statistics(array, 9, ignore_nodata)
+        results = {}
+        for row, strip in focal_statistics_strips(array_reader(array), 90, 110, 9, 32, ignore_nodata,
+                                                  statistics=STATISTICS):
+            for statistic, values in strip.items():
+                results.setdefault(statistic, []).append(values)
+        for statistic in STATISTICS:
+            result = np.concatenate(results[statistic])
+            if not np.array_equal(np.isnan(result), np.isnan(expected[statistic])):
+                print(f"FAIL: NoData cells differ for {statistic} and {ignore_nodata}")
+                sys.exit(1)
+            error = float(np.nanmax(np.abs(result - expected[statistic])))
+            print(f"{statistic}, {ignore_nodata}: max absolute error {error:.2e}")
+            worst = max(worst, error)
+    return worst
+
+
+if __name__ == '__main__':
+    if self_check() > 1e-3:
+        print("FAIL: the focal mean does not match the reference.")
+        sys.exit(1)
+    print("OK")
@@ -1,117 +1,426 @@
 """QC the elevation values of the FRP WSE grids with the cross sections."""
 import arcpy
+import csv
+import hashlib
+import json
+import numpy as np
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import arcgis_workers
 
-def convert_to_points(xs, pbl, workspace):
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Flood events in the order of the final fields
+EVENTS = ['10pct', '04pct', '02pct', '01pct', '01plus', '0_2pct', '01minus', '01fut',
+          '50pct', '20pct']
+
+# Read bandwidth one county is assumed to use in batch mode, in MB per second.  It is
+# a planning figure for a county sampling rasters on a local disk, not a measurement,
+# so pass the rate your counties actually read at when you know it.
+WORKER_MB_PER_SEC = 150
+
+def polyline_segments(geometry):
     """
-    Convert the cross sections to points where they intersect the profile baselines.
+    Break a polyline into its straight segments.
 
     parameters:
-        xs - cross section feature class
-        pbl - profile baseline feature class
-        workspace - output workspace for the new feature class
+        geometry - an arcpy Polyline
 
     returns:
-        The path to the new feature class that was created.
+        An (n, 4) array of x1, y1, x2, y2 segments.
+    """
+    segments = []
+    for part in geometry:
+        vertices = [(point.X, point.Y) for point in part if point is not None]
+        if len(vertices) > 1:
+            vertices = np.array(vertices, dtype=np.float64)
+            segments.append(np.hstack([vertices[:-1], vertices[1:]]))
 
+    if not segments:
+        return np.empty((0, 4))
+    return np.vstack(segments)
+
+
+def _segment_cells(segments, origin, cell_size):
     """
+    Expand each segment into the grid cells covered by its bounding box.
 
-    # Output path to the new feataure class
-    intersect_fc = os.path.join(workspace, "xs_pbl_intersect")
+    parameters:
+        segments - (n, 4) array of segments
+        origin - the x, y origin of the grid
+        cell_size - the size of a grid cell
 
-    arcpy.AddMessage("Intersecting cross sections and profile baselines...")
+    returns:
+        A tuple of (segment indexes, cell keys) with one entry per covered cell.
+    """
+    col_min = np.floor((np.minimum(segments[:, 0], segments[:, 2]) - origin[0]) / cell_size)
+    col_max = np.floor((np.maximum(segments[:, 0], segments[:, 2]) - origin[0]) / cell_size)
+    row_min = np.floor((np.minimum(segments[:, 1], segments[:, 3]) - origin[1]) / cell_size)
+    row_max = np.floor((np.maximum(segments[:, 1], segments[:, 3]) - origin[1]) / cell_size)
+
+    widths = (col_max - col_min + 1).astype(np.int64)
+    counts = widths * (row_max - row_min + 1).astype(np.int64)
 
-    # Intersect the cross sections and profile baselines
-    arcpy.analysis.Intersect(
-        in_features=[xs, pbl],
-        out_feature_class=intersect_fc,
-        join_attributes="ALL",
-        output_type="POINT")
+    segment_ids = np.repeat(np.arange(len(segments)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cols = col_min.astype(np.int64)[segment_ids] + local % widths[segment_ids]
+    rows = row_min.astype(np.int64)[segment_ids] + local // widths[segment_ids]
 
-    # Return the path to the new feature class
-    return intersect_fc
+    # Pack the row and column into one key
+    return segment_ids, (rows << 32) + cols
 
 
-def convert_from_multipoint(in_fc):
+def build_segment_index(segments):
     """
-    Convert a multipoint feature.
+    Build a uniform grid index over line segments.
+
+    The cell size is the median segment extent so a segment covers only a
+    few cells.
 
     parameters:
-        in_fc - the multipoint feature class
+        segments - (n, 4) array of segments
 
     returns:
-        The path to the new feature class.
+        A tuple of (origin, cell size, sorted cell keys, key starts, segment indexes).
     """
-    arcpy.AddMessage("Converting multipart to single part...")
+    extents = np.maximum(np.abs(segments[:, 2] - segments[:, 0]),
+                         np.abs(segments[:, 3] - segments[:, 1]))
+    cell_size = float(np.median(extents)) if len(segments) else 1.0
+    if cell_size <= 0:
+        cell_size = 1.0
+
+    origin = (float(np.min(segments[:, [0, 2]])), float(np.min(segments[:, [1, 3]])))
+    segment_ids, keys = _segment_cells(segments, origin, cell_size)
 
-    # Get the path to the feature class
-    fc_path = arcpy.Describe(in_fc).path
+    order = np.argsort(keys, kind="stable")
+    keys, segment_ids = keys[order], segment_ids[order]
+    unique_keys, starts = np.unique(keys, return_index=True)
 
-    # Path to the new feature class
-    new_fc = os.path.join(fc_path, "xs_elev_qc")
+    return origin, cell_size, unique_keys, np.append(starts, len(keys)), segment_ids
+
+
+def query_segment_index(index, segments):
+    """
+    Find the indexed segments whose cells overlap the query segments' boxes.
+
+    parameters:
+        index - the index from build_segment_index
+        segments - (n, 4) array of query segments
 
-    # Convert the multipart feature class
-    arcpy.management.MultipartToSinglepart(
-        in_features=in_fc,
-        out_feature_class=new_fc)
+    returns:
+        A sorted array of candidate indexed segment indexes.
+    """
+    origin, cell_size, unique_keys, starts, segment_ids = index
+    _, keys = _segment_cells(segments, origin, cell_size)
+    keys = np.unique(keys)
 
-    # Delete the multipart feature class
-    arcpy.management.Delete(in_fc)
+    # Keep the query cells that hold indexed segments
+    positions = np.searchsorted(unique_keys, keys)
+    found = positions < len(unique_keys)
+    found[found] = unique_keys[positions[found]] == keys[found]
+    positions = positions[found]
 
-    # Return the path to the new featue class
-    return new_fc
+    if positions.size == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(
+        [segment_ids[starts[pos]:starts[pos + 1]] for pos in positions]))
 
 
-def drop_fields(in_fc):
+def segment_intersections(segments_a, segments_b, tolerance=1e-9):
     """
-    Drop any unneeded fields.
+    Intersect every segment in one set with every segment in another.
 
     parameters:
-        in_fc - the feature class to drop the fields from.
+        segments_a - (n, 4) array of segments
+        segments_b - (m, 4) array of segments
+        tolerance - how far outside of a segment's ends still counts as a hit
 
     returns:
-        None
+        A tuple of (x, y, index into segments_b) arrays for each intersection.
     """
+    p = segments_a[:, None, 0:2]
+    r = segments_a[:, None, 2:4] - p
+    q = segments_b[None, :, 0:2]
+    s = segments_b[None, :, 2:4] - q
 
-    arcpy.AddMessage("Dropping unneeded fields...")
+    denominator = r[..., 0] * s[..., 1] - r[..., 1] * s[..., 0]
+    q_p = q - p
+    parallel = denominator == 0
+    denominator = np.where(parallel, 1.0, denominator)
 
-    # Fields not to delete
-    keep_fields = ["OBJECTID", "SHAPE", "Shape", "XS_LN_ID", "WTR_NM", "STREAM_STN",
-                   "XS_10pct", "XS_04pct", "XS_02pct", "XS_01pct", "XS_01plus",
-                   "XS_0_2pct", "XS_01minus", "XS_01fut", "XS_50pct", "XS_20pct"]
+    t = (q_p[..., 0] * s[..., 1] - q_p[..., 1] * s[..., 0]) / denominator
+    u = (q_p[..., 0] * r[..., 1] - q_p[..., 1] * r[..., 0]) / denominator
 
-    # Get a list of current fields
-    field_names = [field.name for field in arcpy.ListFields(dataset=in_fc)]
+    hits = (~parallel & (t >= -tolerance) & (t <= 1 + tolerance) &
+            (u >= -tolerance) & (u <= 1 + tolerance))
+    a_index, b_index = np.nonzero(hits)
+
+    x = p[a_index, 0, 0] + t[a_index, b_index] * r[a_index, 0, 0]
+    y = p[a_index, 0, 1] + t[a_index, b_index] * r[a_index, 0, 1]
+    return x, y, b_index
 
-    # Fields to drop
-    drop_fields = [field for field in field_names if field not in keep_fields]
 
-    # Drop the fields
-    for drop_field in drop_fields:
-        if "shape" not in drop_field.lower():
-            arcpy.management.DeleteField(
-                in_table=in_fc,
-                drop_field=drop_field,
-                method="DELETE_FIELDS")
+def read_line_segments(in_fc, spatial_ref):
+    """
+    Read the segments of every polyline in a feature class.
 
+    parameters:
+        in_fc - the polyline feature class
+        spatial_ref - the spatial reference to read the coordinates in
 
-def extract_wse_values(in_rasters, in_fc, in_dem):
+    returns:
+        A tuple of ((n, 4) segment array, array of the feature each segment is from).
     """
-    Extract the cell values from the rasters and the DEM and store them
-    in the feature class.
+    all_segments = []
+    feature_ids = []
+    with arcpy.da.SearchCursor(in_fc, ["SHAPE@"], spatial_reference=spatial_ref) as cursor:
+        for feature_id, (shape,) in enumerate(cursor):
+            if shape is None:
+                continue
+            segments = polyline_segments(shape)
+            all_segments.append(segments)
+            feature_ids.append(np.full(len(segments), feature_id))
+
+    if not all_segments:
+        return np.empty((0, 4)), np.empty(0, dtype=np.int64)
+    return np.vstack(all_segments), np.concatenate(feature_ids)
+
+
+def intersect_lines(xs, field_names, pbl_segments, pbl_feature_ids, index, where_clause=None):
+    """
+    Intersect the cross sections with indexed profile baseline segments.
+
+    Each cross section is only tested against the segments in the index cells
+    its own segments cover.  Hits at the same location on the same profile
+    baseline are returned once, like a multipart to single part of the
+    intersect output.
 
     parameters:
-        in_rasters - the rasters to extract values from.  Typically the WSE rasters.
-        in_fc - the feature class to store the extracted values in.
-        in_dem - the DEM
+        xs - cross section feature class
+        field_names - cross section fields to return with each point
+        pbl_segments - (n, 4) array of profile baseline segments
+        pbl_feature_ids - the profile baseline each segment is from
+        index - the segment index from build_segment_index
+        where_clause - optional query to limit the cross sections
 
     returns:
-        None
+        A generator of ((x, y), cross section attribute tuple) for each point.
     """
-    arcpy.AddMessage("Extracting WSE values...")
+    if len(pbl_segments) == 0:
+        return
+
+    with arcpy.da.SearchCursor(xs, ["SHAPE@"] + field_names, where_clause) as cursor:
+        for row in cursor:
+            if row[0] is None:
+                continue
+            xs_segments = polyline_segments(row[0])
+            candidates = query_segment_index(index, xs_segments)
+            if candidates.size == 0:
+                continue
+
+            x, y, hit = segment_intersections(xs_segments, pbl_segments[candidates])
+
+            points = {}
+            for point_x, point_y, feature_id in zip(x, y, pbl_feature_ids[candidates[hit]]):
+                key = (feature_id, round(point_x, 6), round(point_y, 6))
+                points.setdefault(key, (point_x, point_y))
+
+            for point in points.values():
+                yield point, row[1:]
+
+
+def raster_grid(in_raster):
+    """
+    Describe the grid of a raster.
 
-    # Build up the raster list
+    parameters:
+        in_raster - path to the raster
+
+    returns:
+        A tuple of (x_min, y_max, cell_width, cell_height, rows, columns, nodata).
+        The first four values are the raster's affine transform.
+    """
+    raster = arcpy.Raster(in_raster)
+    return (raster.extent.XMin, raster.extent.YMax,
+            raster.meanCellWidth, raster.meanCellHeight,
+            raster.height, raster.width, raster.noDataValue)
+
+
+def read_window(in_raster, grid, row, col, nrows, ncols):
+    """
+    Read a window of cells from a raster as float32 with NoData as NaN.
+
+    Any part of the window that falls outside of the raster is NaN.
+
+    parameters:
+        in_raster - path to the raster
+        grid - the raster's grid from raster_grid
+        row - the first row of the window
+        col - the first column of the window
+        nrows - the number of rows in the window
+        ncols - the number of columns in the window
+
+    returns:
+        A float32 array of shape (nrows, ncols).
+    """
+    x_min, y_max, cell_width, cell_height, raster_rows, raster_cols, nodata = grid
+    window = np.full((nrows, ncols), np.nan, dtype=np.float32)
+
+    # Clip the window to the raster
+    row_start, row_end = max(row, 0), min(row + nrows, raster_rows)
+    col_start, col_end = max(col, 0), min(col + ncols, raster_cols)
+    if row_start >= row_end or col_start >= col_end:
+        return window
+
+    lower_left = arcpy.Point(x_min + col_start * cell_width,
+                             y_max - row_end * cell_height)
+    cells = arcpy.RasterToNumPyArray(
+        in_raster=in_raster,
+        lower_left_corner=lower_left,
+        ncols=col_end - col_start,
+        nrows=row_end - row_start)
+
+    values = cells.astype(np.float32)
+    if nodata is not None:
+        values[cells == nodata] = np.nan
+
+    window[row_start - row:row_end - row, col_start - col:col_end - col] = values
+    return window
+
+
+def morton_codes(block_rows, block_cols):
+    """
+    Interleave the bits of the block rows and columns (Z-order).
+
+    parameters:
+        block_rows - array of block row indices
+        block_cols - array of block column indices
+
+    returns:
+        A uint64 array of Morton codes.
+    """
+    def spread(values):
+        values = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+        for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+                            (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333),
+                            (1, 0x5555555555555555)):
+            values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+        return values
+
+    return spread(block_rows) | (spread(block_cols) << np.uint64(1))
+
+
+def sample_rasters(in_rasters, xy, method="NEAREST", block_size=512):
+    """
+    Sample rasters at points, reading each needed raster block once.
+
+    Rasters that share the same grid are sampled together.  For each grid the
+    points are mapped to cells with that grid's affine transform, sorted into
+    Morton order by block and every block that holds a point is read one time.
+
+    parameters:
+        in_rasters - list of raster paths
+        xy - (n, 2) array of point coordinates in the rasters' spatial reference
+        method - NEAREST or BILINEAR
+        block_size - the number of rows and columns in a block
+
+    returns:
+        A (points x rasters) float32 array.  NoData and points outside of a
+        raster are NaN.
+    """
+    method = method.upper()
+    if method not in ("NEAREST", "BILINEAR"):
+        raise ValueError(f"Unknown sampling method: {method}")
+
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    samples = np.full((len(xy), len(in_rasters)), np.nan, dtype=np.float32)
+    if len(xy) == 0:
+        return samples
+
+    # Group the rasters that share the same grid
+    grids = {}
+    for index, in_raster in enumerate(in_rasters):
+        grid = raster_grid(in_raster)
+        grids.setdefault(grid[:6], []).append((index, in_raster, grid))
+
+    # Bilinear sampling needs a one cell halo around each block
+    halo = 1 if method == "BILINEAR" else 0
+
+    for (x_min, y_max, cell_width, cell_height, nrows, ncols), members in grids.items():
+        # Map the points to fractional cell positions
+        row_f = (y_max - xy[:, 1]) / cell_height
+        col_f = (xy[:, 0] - x_min) / cell_width
+        rows = np.floor(row_f).astype(np.int64)
+        cols = np.floor(col_f).astype(np.int64)
+
+        inside = np.flatnonzero((rows >= 0) & (rows < nrows) & (cols >= 0) & (cols < ncols))
+        if inside.size == 0:
+            continue
+
+        # Sort the points by block in Morton order
+        block_rows = rows[inside] // block_size
+        block_cols = cols[inside] // block_size
+        codes = morton_codes(block_rows, block_cols)
+        order = np.argsort(codes, kind="stable")
+        inside, codes = inside[order], codes[order]
+        block_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        block_ends = np.r_[block_starts[1:], inside.size]
+
+        for start, end in zip(block_starts, block_ends):
+            points = inside[start:end]
+            row_0 = rows[points[0]] // block_size * block_size - halo
+            col_0 = cols[points[0]] // block_size * block_size - halo
+            size = block_size + 2 * halo
+
+            for index, in_raster, grid in members:
+                block = read_window(in_raster, grid, row_0, col_0, size, size)
+
+                if method == "NEAREST":
+                    samples[points, index] = block[rows[points] - row_0, cols[points] - col_0]
+                    continue
+
+                # Bilinear weights from the four surrounding cell centers
+                anchor_r = np.floor(row_f[points] - 0.5).astype(np.int64)
+                anchor_c = np.floor(col_f[points] - 0.5).astype(np.int64)
+                frac_r = row_f[points] - 0.5 - anchor_r
+                frac_c = col_f[points] - 0.5 - anchor_c
+                local_r = anchor_r - row_0
+                local_c = anchor_c - col_0
+
+                total = np.zeros(points.size)
+                weight_sum = np.zeros(points.size)
+                for d_r, d_c, weight in ((0, 0, (1 - frac_r) * (1 - frac_c)),
+                                         (0, 1, (1 - frac_r) * frac_c),
+                                         (1, 0, frac_r * (1 - frac_c)),
+                                         (1, 1, frac_r * frac_c)):
+                    values = block[local_r + d_r, local_c + d_c]
+                    valid = ~np.isnan(values)
+                    total[valid] += values[valid] * weight[valid]
+                    weight_sum[valid] += weight[valid]
+
+                # Renormalize over the neighbors that have data
+                values = np.full(points.size, np.nan)
+                np.divide(total, weight_sum, out=values, where=weight_sum > 0)
+                samples[points, index] = values
+
+    return samples
+
+
+def wse_raster_list(in_rasters):
+    """
+    Match the WSE rasters to their event field names.
+
+    parameters:
+        in_rasters - the WSE rasters
+
+    returns:
+        A list of [raster, WSE field name] in event order.
+    """
     possible_raster_names = [
         "WSE_10pct", "WSE_04pct", "WSE_02pct", "WSE_01pct", "WSE_01plus",
         "WSE_0_2pct", "WSE_01minus", "WSE_01fut", "WSE_50pct", "WSE_20pct"]
@@ -121,360 +430,989 @@ def extract_wse_values(in_rasters, in_fc, in_dem):
     for raster_name in possible_raster_names:
         for in_raster in in_rasters:
             if raster_name in in_raster:
-                arcpy.AddMessage(f"\t{raster_name} will be extracted...")
                 raster_list.append([in_raster, raster_name])
 
-    # Add the DEM to the list of rasters to extract
-    raster_list.append([in_dem, "DEM"])
+    return raster_list
+
 
-    # Extract the raster cell values
-    arcpy.sa.ExtractMultiValuesToPoints(
-        in_point_features=in_fc,
-        in_rasters=raster_list,
-        bilinear_interpolate_values="NONE")
+def scrv_values(water_names, stations, elevations, cellsize):
+    """
+    Calculate the Slope-Cell Resolution Value (SCRV) for arrays of points.
 
+    The points are grouped by water name and sorted by stream station with a
+    single lexsort.  Points that share a station on the same stream are
+    treated as one station: their DEM values are averaged and every one of
+    them receives the same SCRV.  The first station on each stream, and any
+    station where either DEM value is -9999, gets -9999.
+
+    parameters:
+        water_names - array of WTR_NM values
+        stations - array of STREAM_STN values
+        elevations - array of DEM values (-9999 for NULL)
+        cellsize - the cell size of the DEM
 
-def calc_nulls(in_fc):
+    returns:
+        A float array of SCRV values in the same order as the input arrays.
+    """
+    water_names = np.asarray(water_names)
+    stations = np.asarray(stations, dtype=np.float64)
+    elevations = np.asarray(elevations, dtype=np.float64)
+
+    scrv = np.full(stations.shape, -9999.0)
+    if stations.size == 0:
+        return scrv
+
+    # Group on the water name, then sort on the stream station within each group
+    _, name_codes = np.unique(water_names, return_inverse=True)
+    order = np.lexsort((stations, name_codes))
+    sorted_codes = name_codes[order]
+    sorted_stations = stations[order]
+
+    # Collapse duplicate stations on the same stream into one station
+    new_station = np.ones(order.size, dtype=bool)
+    new_station[1:] = ((sorted_codes[1:] != sorted_codes[:-1]) |
+                       (sorted_stations[1:] != sorted_stations[:-1]))
+    station_ids = np.cumsum(new_station) - 1
+    unique_codes = sorted_codes[new_station]
+    unique_stations = sorted_stations[new_station]
+
+    # Average the DEM of the duplicate stations, ignoring -9999 values
+    sorted_elevations = elevations[order]
+    valid = sorted_elevations != -9999
+    elev_sum = np.bincount(station_ids, weights=np.where(valid, sorted_elevations, 0.0))
+    elev_count = np.bincount(station_ids, weights=valid.astype(np.float64))
+    unique_elevations = np.full(unique_stations.shape, np.nan)
+    np.divide(elev_sum, elev_count, out=unique_elevations, where=elev_count > 0)
+
+    # Difference each station with the previous station on the same stream
+    distance = np.diff(unique_stations)
+    elevation_change = np.diff(unique_elevations)
+    same_stream = unique_codes[1:] == unique_codes[:-1]
+    computable = same_stream & ~np.isnan(elevation_change)
+
+    unique_scrv = np.full(unique_stations.shape, -9999.0)
+    unique_scrv[1:][computable] = (elevation_change[computable] /
+                                   distance[computable] * cellsize)
+
+    # Spread the station values back to the points in the original order
+    scrv[order] = unique_scrv[station_ids]
+    return scrv
+
+
+def line_cells(segments, line_ids, grid):
     """
-    Calculate all the NULL fields to -9999.
+    Find every raster cell along a set of lines with a vectorized DDA.
+
+    Every segment of every line is stepped at most one cell at a time in one
+    pass, and each cell is kept once per line.
 
     parameters:
-        in_fc - the feature class to update
+        segments - (n, 4) array of segments in the raster's coordinates
+        line_ids - the line each segment is from
+        grid - the raster's grid from raster_grid
 
     returns:
-        None
+        A tuple of (line ids, rows, columns) for each cell.
     """
-    arcpy.AddMessage("Calculating nulls to -9999...")
+    x_min, y_max, cell_width, cell_height, nrows, ncols, _ = grid
 
-    # Fields to update
-    field_list = [
-        "XS_10pct", "XS_04pct", "XS_02pct", "XS_01pct", "XS_01plus", "XS_0_2pct", "XS_01minus",
-        "XS_01fut", "XS_50pct", "XS_20pct", "WSE_10pct", "WSE_04pct", "WSE_02pct", "WSE_01pct",
-        "WSE_01plus", "WSE_0_2pct", "WSE_01minus", "WSE_01fut", "WSE_50pct", "WSE_20pct" , "DEM"]
+    col_1 = (segments[:, 0] - x_min) / cell_width
+    row_1 = (y_max - segments[:, 1]) / cell_height
+    col_2 = (segments[:, 2] - x_min) / cell_width
+    row_2 = (y_max - segments[:, 3]) / cell_height
 
-    # List of field names in the feature class
-    field_names = [field.name for field in arcpy.ListFields(dataset=in_fc)]
+    # One step per cell crossed along the major axis
+    steps = np.maximum(np.ceil(np.maximum(np.abs(col_2 - col_1), np.abs(row_2 - row_1))), 1)
+    steps = steps.astype(np.int64)
+    counts = steps + 1
 
-    # Calc the fields
-    for field in field_list:
-        if field in field_names:
-            selected = arcpy.management.SelectLayerByAttribute(
-                in_layer_or_view=in_fc,
-                where_clause=field + " IS NULL")
+    segment_index = np.repeat(np.arange(len(segments)), counts)
+    step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    fraction = step / steps[segment_index]
 
-            arcpy.management.CalculateField(
-                in_table=selected,
-                field=field,
-                expression="-9999")
-    
-def calc_diff_fields(in_fc):
+    cols = np.floor(col_1[segment_index] + fraction * (col_2 - col_1)[segment_index])
+    rows = np.floor(row_1[segment_index] + fraction * (row_2 - row_1)[segment_index])
+    ids = np.asarray(line_ids)[segment_index]
+
+    inside = (rows >= 0) & (rows < nrows) & (cols >= 0) & (cols < ncols)
+
+    # Pack the line, row and column into one key to drop the repeated cells
+    cell_count = int(nrows) * int(ncols)
+    keys = np.sort(ids[inside].astype(np.int64) * cell_count +
+                   rows[inside].astype(np.int64) * int(ncols) + cols[inside].astype(np.int64))
+    keys = keys[np.r_[True, keys[1:] != keys[:-1]]] if keys.size else keys
+    return keys // cell_count, keys % cell_count // int(ncols), keys % int(ncols)
+
+
+def dense_qc(xs, in_rasters, workspace):
     """
-    Calculate the differences between the cross section elevation values and
-    the WSE extracted values.
+    Compare the WSE rasters to the cross section WSELs at every cell along
+    every cross section.
+
+    The cells along all the cross sections are found with one vectorized DDA
+    and sampled with sample_rasters, so each raster block is read once no
+    matter how many cross sections cross it.  The cells are found separately
+    for each grid, since the events' rasters have different extents.  Cells
+    outside of the flood extent are NoData in the WSE rasters and are skipped.
 
     parameters:
-        in_fc - the feature class to update
+        xs - cross section feature class
+        in_rasters - the WSE rasters
+        workspace - output workspace for the xs_dense_qc table
 
     returns:
-        None
+        The path to the new table, or None if there was nothing to sample.
+    """
+    arcpy.AddMessage("Sampling the WSE rasters along the cross sections...")
+
+    raster_list = wse_raster_list(in_rasters)
+    events = [raster_name.replace("WSE_", "") for _, raster_name in raster_list]
+    rasters = [in_raster for in_raster, _ in raster_list]
+    if not rasters:
+        arcpy.AddWarning("There are no WSE rasters or cross sections to sample.")
+        return None
+
+    # Read the cross sections in the raster coordinates
+    field_names = [field.name for field in arcpy.ListFields(dataset=xs)]
+    xs_fields = [field for field in ["XS_" + event for event in events] if field in field_names]
+    spatial_ref = arcpy.Describe(rasters[0]).spatialReference
+
+    attributes = []
+    segments = []
+    line_ids = []
+    with arcpy.da.SearchCursor(xs, ["SHAPE@", "XS_LN_ID", "WTR_NM", "STREAM_STN"] + xs_fields,
+                               spatial_reference=spatial_ref) as cursor:
+        for row in cursor:
+            if row[0] is None:
+                continue
+            line_segments = polyline_segments(row[0])
+            segments.append(line_segments)
+            line_ids.append(np.full(len(line_segments), len(attributes)))
+            attributes.append(row[1:])
+
+    if not attributes:
+        arcpy.AddWarning("There are no WSE rasters or cross sections to sample.")
+        return None
+
+    line_count = len(attributes)
+    segments = np.vstack(segments)
+    line_ids = np.concatenate(line_ids)
+
+    # Group the rasters that share the same grid, as in sample_rasters
+    grids = {}
+    for index, in_raster in enumerate(rasters):
+        grid = raster_grid(in_raster)
+        grids.setdefault(grid[:6], (grid, []))[1].append(index)
+
+    # The cells of each event raster's grid along the lines and their samples
+    event_cells = {}
+    for grid, indexes in grids.values():
+        ids, rows, cols = line_cells(segments, line_ids, grid)
+
+        # Sample at the cell centers
+        xy = np.column_stack([grid[0] + (cols + 0.5) * grid[2], grid[1] - (rows + 0.5) * grid[3]])
+        samples = sample_rasters(in_rasters=[rasters[index] for index in indexes], xy=xy)
+        for column, index in enumerate(indexes):
+            event_cells[index] = (ids, samples[:, column])
+        arcpy.AddMessage(f"\t{len(xy)} cells sampled along {line_count} cross sections.")
+
+    # Per line count, max and mean deviation for each event
+    columns = {"XS_LN_ID": [row[0] or "" for row in attributes],
+               "WTR_NM": [row[1] or "" for row in attributes],
+               "STREAM_STN": [-9999 if row[2] is None else row[2] for row in attributes]}
+
+    for index, event in enumerate(events):
+        count = np.zeros(line_count, dtype=np.int64)
+        max_dev = np.full(line_count, -9999.0)
+        mean_dev = np.full(line_count, -9999.0)
+
+        if "XS_" + event in xs_fields:
+            field_index = 3 + xs_fields.index("XS_" + event)
+            wsel = np.array([-9999 if row[field_index] is None else row[field_index]
+                             for row in attributes], dtype=np.float64)
+
+            ids, wse = event_cells[index]
+            wse = wse.astype(np.float64)
+            valid = ~np.isnan(wse) & (wsel[ids] != -9999)
+            deviation = np.abs(wse[valid] - wsel[ids[valid]])
+
+            count = np.bincount(ids[valid], minlength=line_count)
+            dev_sum = np.bincount(ids[valid], weights=deviation, minlength=line_count)
+            np.maximum.at(max_dev, ids[valid], deviation)
+            np.divide(dev_sum, count, out=mean_dev, where=count > 0)
+
+        columns["N_" + event] = count
+        columns["MAX_" + event] = max_dev
+        columns["MEAN_" + event] = mean_dev
+
+    # Write the table
+    out_table = os.path.join(workspace, "xs_dense_qc")
+    if arcpy.Exists(out_table):
+        arcpy.management.Delete(out_table)
+
+    dtypes = [("XS_LN_ID", "<U25"), ("WTR_NM", "<U100"), ("STREAM_STN", "<f8")]
+    dtypes += [(name, "<i4" if name.startswith("N_") else "<f4") for name in list(columns)[3:]]
+    records = np.empty(line_count, dtype=dtypes)
+    for name in columns:
+        records[name] = columns[name]
+
+    arcpy.da.NumPyArrayToTable(records, out_table)
+    return out_table
+
+
+def read_qc_table(in_fc):
+    """
+    Read the QC columns of a feature class into memory.
+
+    parameters:
+        in_fc - the QC feature class
+
+    returns:
+        A dictionary of field name to NumPy array, in the field order of the
+        feature class.
     """
-    arcpy.AddMessage("Calculating difference fields...")
-
-    field_groups = [
-        ["XS_10pct", "WSE_10pct", "DIF_10pct"],
-        ["XS_04pct", "WSE_04pct", "DIF_04pct"],
-        ["XS_02pct", "WSE_02pct", "DIF_02pct"],
-        ["XS_01pct", "WSE_01pct", "DIF_01pct"],
-        ["XS_01plus", "WSE_01plus", "DIF_01plus"],
-        ["XS_0_2pct", "WSE_0_2pct", "DIF_0_2pct"],
-        ["XS_01minus", "WSE_01minus","DIF_01minus"],
-        ["XS_01fut", "WSE_01fut", "DIF_01fut"],
-        ["XS_50pct", "WSE_50pct", "DIF_50pct"],
-        ["XS_20pct", "WSE_20pct", "DIF_20pct"]
-        ]
-
-    # List of field names in the feature class
     field_names = [field.name for field in arcpy.ListFields(dataset=in_fc)]
+    qc_fields = [field for field in field_names
+                 if field in ("XS_LN_ID", "WTR_NM", "STREAM_STN", "REVIEW", "SCRV", "DEM")
+                 or field.startswith(("XS_", "WSE_", "DIF_", "ERR_"))]
+
+    rows = [row for row in arcpy.da.SearchCursor(in_fc, qc_fields)]
+
+    table = {}
+    for index, field in enumerate(qc_fields):
+        values = [row[index] for row in rows]
+        if field in ("XS_LN_ID", "WTR_NM", "REVIEW") or field.startswith("ERR_"):
+            table[field] = np.array(["" if value is None else value for value in values],
+                                    dtype=object)
+        else:
+            table[field] = np.array([-9999 if value is None else value for value in values],
+                                    dtype=np.float64)
+    return table
 
-    # Iterate through the field pairs
-    for pct, wse, dif in field_groups:
-        if pct in field_names and wse in field_names:
-            arcpy.AddMessage(f"\tCalculating difference of {pct} and {wse}...")
 
-            # Selected all the PCT and WSE rows that are not -9999
-            selected = arcpy.management.SelectLayerByAttribute(
-                in_layer_or_view=in_fc,
-                where_clause=pct + " <> -9999 And " + wse + " <> -9999")
+def qc_differences(table, dif_tolerance=0.5):
+    """
+    Add the DIF_ and ERR_ columns to an in memory QC table.
+
+    The difference is the absolute difference rounded to 0.1.  It is -9999
+    when either value is -9999.
+
+    parameters:
+        table - dictionary of field name to NumPy array
+        dif_tolerance - differences over this are errors
+
+    returns:
+        None
+    """
+    for event in EVENTS:
+        xs_field, wse_field = "XS_" + event, "WSE_" + event
+        if xs_field not in table or wse_field not in table:
+            continue
 
-            # Calculate the absolute difference of the two fields
-            arcpy.management.CalculateField(
-                in_table=selected,
-                field=dif,
-                field_type="FLOAT",
-                expression="round(abs(!" + pct + "!-!" + wse + "!), 1)")
+        xs_values = table[xs_field].astype(np.float64)
+        wse_values = table[wse_field].astype(np.float64)
+        valid = (xs_values != -9999) & (wse_values != -9999)
 
-            # Select all the DIF rows that are NULL
-            selected = arcpy.management.SelectLayerByAttribute(
-                in_layer_or_view=in_fc,
-                where_clause=dif + " IS NULL")
+        dif = np.full(xs_values.shape, -9999.0)
+        dif[valid] = np.round(np.abs(xs_values[valid] - wse_values[valid]), 1)
 
-            # Calculate them to -9999
-            arcpy.management.CalculateField(
-                in_table=selected,
-                field=dif,
-                expression="-9999")
+        table["DIF_" + event] = dif
+        table["ERR_" + event] = np.where(dif > dif_tolerance, "T", "F").astype(object)
 
 
-def calc_diff_error(in_fc):
+def qc_review(table, cellsize, scrv_max=0.3):
     """
-    Calculate the differences between the cross section elevation values and
-    the WSE extracted values are greater than 0.5.
+    Add the SCRV and REVIEW columns to an in memory QC table.
+
+    A point is flagged for review when any ERR_ column is 'T' and its SCRV is
+    at or below the cutoff.
 
     parameters:
-        in_fc - the feature class to update
+        table - dictionary of field name to NumPy array
+        cellsize - the cell size of the DEM
+        scrv_max - errors with an SCRV at or below this are reviewed
 
     returns:
         None
     """
-    arcpy.AddMessage("Calculating difference error...")
+    table["SCRV"] = scrv_values(water_names=table["WTR_NM"], stations=table["STREAM_STN"],
+                                elevations=table["DEM"], cellsize=cellsize)
 
-    # Fields to calculate
-    diff_fields = ["DIF_10pct", "DIF_04pct", "DIF_02pct", "DIF_01pct",
-                   "DIF_01plus", "DIF_0_2pct", "DIF_01minus",
-                   "DIF_01fut", "DIF_50pct", "DIF_20pct"]
+    errors = np.zeros(table["SCRV"].shape, dtype=bool)
+    for event in EVENTS:
+        if "ERR_" + event in table:
+            errors |= table["ERR_" + event] == "T"
 
-    # List of field names in the feature class
-    field_names = [field.name for field in arcpy.ListFields(dataset=in_fc)]
+    review = errors & (table["SCRV"] <= scrv_max) & (table["SCRV"] != -9999)
+    table["REVIEW"] = np.where(review, "T", "F").astype(object)
 
-    # Iterate through the fields
-    for dif_field in diff_fields:
-        if dif_field in field_names:
-            error_field_name = dif_field.replace("DIF", "ERR")
 
-            arcpy.AddMessage(f"\tCalculating {error_field_name}...")
+def qc_fields(table):
+    """
+    List the final QC fields in the table, in the order of the final feature class.
 
-            # Add the ERR field
-            arcpy.management.AddField(
-                in_table=in_fc,
-                field_name=error_field_name,
-                field_type="TEXT",
-                field_length=1)
+    parameters:
+        table - dictionary of field name to NumPy array
 
-            # Selected all rows with a DIF field value > 0.5
-            selected = arcpy.management.SelectLayerByAttribute(
-                in_layer_or_view=in_fc,
-                where_clause=dif_field + " > 0.5 ")
+    returns:
+        A list of [name, type, alias, length] field descriptions.
+    """
+    fields = [["XS_LN_ID", "TEXT", "XS_LN_ID", 25], ["WTR_NM", "TEXT", "WTR_NM", 100],
+              ["STREAM_STN", "DOUBLE", "STREAM_STN", None], ["REVIEW", "TEXT", "REVIEW", 1],
+              ["SCRV", "FLOAT", "SCRV", None], ["DEM", "FLOAT", "DEM", None]]
 
-            # Calculate the ERR field to T
-            arcpy.management.CalculateField(
-                in_table=selected,
-                field=error_field_name,
-                expression="'T'")
+    for event in EVENTS:
+        fields += [["XS_" + event, "DOUBLE", "XS_" + event, None],
+                   ["WSE_" + event, "FLOAT", "WSE_" + event, None],
+                   ["DIF_" + event, "FLOAT", "DIF_" + event, None],
+                   ["ERR_" + event, "TEXT", "ERR_" + event, 1]]
 
-            # Selected all rows with a DIF field value <= 0.5
-            selected = arcpy.management.SelectLayerByAttribute(
-                in_layer_or_view=in_fc,
-                where_clause=dif_field + " <= 0.5 ")
+    return [field for field in fields if field[0] in table]
 
-            # Calculate them to F
-            arcpy.management.CalculateField(
-                in_table=selected,
-                field=error_field_name,
-                expression="'F'")
-            
 
+def write_qc_table(table, out_fc, spatial_ref):
+    """
+    Create the final QC feature class and fill it from an in memory QC table.
 
-def calc_scrv(in_fc, dem):
+    The schema is created up front in the final field order and the rows are
+    written with one InsertCursor.
+
+    parameters:
+        table - dictionary of field name to NumPy array, with the point
+                coordinates in SHAPE@XY
+        out_fc - the feature class to create
+        spatial_ref - the spatial reference of the points
+
+    returns:
+        The path to the new feature class.
     """
-    Calculate the Slope-Cell Resolution Value (SCRV):
+    arcpy.AddMessage(f"Writing {out_fc}...")
+
+    fields = qc_fields(table)
+    field_names = [field[0] for field in fields]
+
+    if arcpy.Exists(out_fc):
+        arcpy.management.Delete(out_fc)
+
+    arcpy.management.CreateFeatureclass(
+        out_path=os.path.dirname(out_fc),
+        out_name=os.path.basename(out_fc),
+        geometry_type="POINT",
+        spatial_reference=spatial_ref)
+
+    arcpy.management.AddFields(
+        in_table=out_fc,
+        field_description=[[name, field_type, alias, length if length else ""]
+                           for name, field_type, alias, length in fields])
+
+    columns = [table["SHAPE@XY"].tolist()] + [table[name].tolist() for name in field_names]
+    with arcpy.da.InsertCursor(out_fc, ["SHAPE@XY"] + field_names) as cursor:
+        for row in zip(*columns):
+            cursor.insertRow(row)
 
-    Elevation change / stream distance * cell size (“Slope-Cell Resolution Value” (SCRV))
+    return out_fc
+
+
+def concat_tables(tables):
+    """
+    Stack in memory QC tables that have the same columns.
 
     parameters:
-        in_fc - the feature class to update
-        dem - the DEM
+        tables - list of dictionaries of field name to NumPy array
+
+    returns:
+        One dictionary of field name to NumPy array.
+    """
+    return {name: np.concatenate([table[name] for table in tables]) for name in tables[0]}
+
+
+def qc_summary(table):
+    """
+    Summarize the QC table by stream and event.
+
+    For every WTR_NM and event the summary has the count of points with a
+    difference, the mean, max and RMSE of the difference, the error rate and
+    the number of points flagged for review.
+
+    parameters:
+        table - dictionary of field name to NumPy array
+
+    returns:
+        A dictionary of summary column name to NumPy array.
+    """
+    water_names, codes = np.unique(table["WTR_NM"].astype(str), return_inverse=True)
+    group_count = len(water_names)
+    review = table["REVIEW"] == "T" if "REVIEW" in table else np.zeros(codes.size, dtype=bool)
+
+    summary = {"WTR_NM": [], "EVENT": [], "COUNT": [], "DIF_MEAN": [], "DIF_MAX": [],
+               "DIF_RMSE": [], "ERR_RATE": [], "REVIEW_COUNT": []}
+
+    for event in EVENTS:
+        dif_field = "DIF_" + event
+        err_field = "ERR_" + event
+        if dif_field not in table:
+            continue
+
+        dif = table[dif_field].astype(np.float64)
+        valid = dif != -9999
+        errors = (table[err_field] == "T") & valid if err_field in table else np.zeros_like(valid)
+
+        count = np.bincount(codes[valid], minlength=group_count)
+        dif_sum = np.bincount(codes[valid], weights=dif[valid], minlength=group_count)
+        dif_squares = np.bincount(codes[valid], weights=dif[valid] ** 2, minlength=group_count)
+        error_count = np.bincount(codes[errors], minlength=group_count)
+        review_count = np.bincount(codes[errors & review], minlength=group_count)
+
+        dif_max = np.full(group_count, -np.inf)
+        np.maximum.at(dif_max, codes[valid], dif[valid])
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            summary["DIF_MEAN"].append(np.where(count > 0, dif_sum / count, np.nan))
+            summary["DIF_RMSE"].append(np.where(count > 0, np.sqrt(dif_squares / count), np.nan))
+            summary["ERR_RATE"].append(np.where(count > 0, error_count / count, np.nan))
+
+        summary["WTR_NM"].append(water_names)
+        summary["EVENT"].append(np.full(group_count, event, dtype=object))
+        summary["COUNT"].append(count)
+        summary["DIF_MAX"].append(np.where(count > 0, dif_max, np.nan))
+        summary["REVIEW_COUNT"].append(review_count)
+
+    return {name: (np.concatenate(columns) if columns else np.empty(0))
+            for name, columns in summary.items()}
+
+
+def write_columns(table, out_path):
+    """
+    Write a dictionary of columns to a Parquet file.  A CSV file is written
+    instead when pyarrow is not installed.
+
+    parameters:
+        table - dictionary of column name to NumPy array
+        out_path - output path without an extension
+
+    returns:
+        The path to the file that was written.
+    """
+    if pa is not None:
+        arrow_table = pa.table({name: (values.astype(str) if values.dtype == object else values)
+                                for name, values in table.items()})
+        pq.write_table(arrow_table, out_path + ".parquet")
+        return out_path + ".parquet"
+
+    arcpy.AddWarning("pyarrow is not installed.  Writing CSV instead of Parquet.")
+    with open(out_path + ".csv", "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(table.keys())
+        writer.writerows(zip(*[values.tolist() for values in table.values()]))
+    return out_path + ".csv"
+
+
+def export_columnar(table, workspace):
+    """
+    Export the QC columns and the per stream summary to columnar files.
+
+    The files are written next to the workspace when it is a geodatabase.
+
+    parameters:
+        table - dictionary of field name to NumPy array
+        workspace - output workspace
 
     returns:
         None
     """
-    arcpy.AddMessage("Calculating the Slope-Cell Resolution Value...")
+    arcpy.AddMessage("Exporting the columnar QC table and summary...")
+
+    out_folder = output_folder(workspace)
+
+    qc_path = write_columns(table, os.path.join(out_folder, "frp_xs_elev_qc"))
+    summary_path = write_columns(qc_summary(table),
+                                 os.path.join(out_folder, "frp_xs_elev_qc_summary"))
+
+    arcpy.AddMessage(f"\t{qc_path}")
+    arcpy.AddMessage(f"\t{summary_path}")
+
+
+def qc_sensitivity(table, dif_tolerances, scrv_cutoffs):
+    """
+    Count the flagged points per stream for every DIF tolerance and SCRV cutoff.
+
+    Every combination is evaluated from the DIF and SCRV arrays already in
+    the table.  A point is an error when any of its differences is over the
+    tolerance, and it is flagged for review when it is an error and its SCRV
+    is at or below the cutoff.  The tolerances are counted one at a time, and
+    each flagged point is counted once at the smallest cutoff it passes, so
+    memory stays a few arrays the size of the points.
+
+    parameters:
+        table - dictionary of field name to NumPy array
+        dif_tolerances - list of DIF tolerances
+        scrv_cutoffs - list of SCRV cutoffs
 
-    # Get the cell size of the DEM
-    desc = arcpy.Describe(dem)
-    cellsize = desc.children[0].meanCellHeight
+    returns:
+        A dictionary of column name to NumPy array with one row per stream,
+        tolerance and cutoff.
+    """
+    water_names, codes = np.unique(table["WTR_NM"].astype(str), return_inverse=True)
+    group_count = len(water_names)
+    tolerances = np.asarray(dif_tolerances, dtype=np.float64)
+    cutoffs = np.asarray(scrv_cutoffs, dtype=np.float64)
+
+    # The largest valid difference of each point
+    max_dif = np.full(codes.size, -np.inf)
+    for event in EVENTS:
+        if "DIF_" + event in table:
+            dif = table["DIF_" + event].astype(np.float64)
+            max_dif = np.maximum(max_dif, np.where(dif != -9999, dif, -np.inf))
+
+    scrv = table["SCRV"].astype(np.float64)
+
+    # The smallest cutoff each point's SCRV is at or below, in sorted order
+    order = np.argsort(cutoffs, kind="stable")
+    first_cutoff = np.searchsorted(cutoffs[order], scrv, side="left")
+    reviewable = (scrv != -9999) & (first_cutoff < cutoffs.size)
+
+    error_count = np.zeros((tolerances.size, group_count), dtype=np.int64)
+    review_count = np.zeros((tolerances.size, cutoffs.size, group_count), dtype=np.int64)
+    for index, tolerance in enumerate(tolerances):
+        errors = max_dif > tolerance
+        error_count[index] = np.bincount(codes[errors], minlength=group_count)
+
+        # A point passes its smallest cutoff and every larger one
+        flagged = errors & reviewable
+        counts = np.bincount(first_cutoff[flagged] * group_count + codes[flagged],
+                             minlength=cutoffs.size * group_count).reshape(cutoffs.size, group_count)
+        review_count[index, order] = np.cumsum(counts, axis=0)
+
+    tolerance_grid, cutoff_grid, name_grid = np.meshgrid(
+        tolerances, cutoffs, np.arange(group_count), indexing="ij")
+
+    return {"WTR_NM": water_names[name_grid.ravel()],
+            "DIF_TOL": tolerance_grid.ravel(),
+            "SCRV_MAX": cutoff_grid.ravel(),
+            "ERR_COUNT": np.broadcast_to(error_count[:, None, :], review_count.shape).ravel(),
+            "REVIEW_COUNT": review_count.ravel()}
+
+
+def export_sensitivity(table, workspace, dif_tolerances, scrv_cutoffs):
+    """
+    Export the sensitivity matrix of flagged counts per stream.
 
-    # Get a list of unique stream names
-    water_names = sorted(list(set([row[0] for row in arcpy.da.SearchCursor(in_fc, ["WTR_NM"])])))
+    parameters:
+        table - dictionary of field name to NumPy array
+        workspace - output workspace
+        dif_tolerances - list of DIF tolerances
+        scrv_cutoffs - list of SCRV cutoffs
 
-    # Add the SCRV field
-    arcpy.management.AddField(
-        in_table=in_fc,
-        field_name="SCRV",
-        field_type="FLOAT")
+    returns:
+        None
+    """
+    arcpy.AddMessage("Exporting the QC tolerance sensitivity...")
 
-    # Iterate through the water names
-    for water_name in water_names:
-        arcpy.AddMessage(f"\tCalculating SCRV for {water_name}")
+    sensitivity_path = write_columns(
+        qc_sensitivity(table, dif_tolerances, scrv_cutoffs),
+        os.path.join(output_folder(workspace), "frp_xs_elev_qc_sensitivity"))
+    arcpy.AddMessage(f"\t{sensitivity_path}")
 
-        # Create a list of lists where the elemnts are the stream station and DEM value
-        station_list = [
-            [row[0], row[1]] for row in arcpy.da.SearchCursor(
-                in_fc, ["STREAM_STN", "DEM"], "WTR_NM = '" + water_name + "'")]
 
-        # Sort the station list on the first element
-        station_list = sorted(station_list, key = lambda x: x[0])
+def output_folder(workspace):
+    """
+    Find the folder for files written next to the QC feature class.
 
-        # Iterate through the list and calcuate the SCRV
-        for index in range(1, len(station_list)):
+    parameters:
+        workspace - output workspace
 
-            # Get the current and previous station lists
-            previous_station = station_list[index - 1]
-            current_station = station_list[index]
+    returns:
+        The workspace, or the folder that holds it when it is a geodatabase.
+    """
+    if arcpy.Describe(workspace).workspaceType != "FileSystem":
+        return os.path.dirname(workspace)
+    return workspace
 
-            # Calculate the difference in distance and elevation
-            distance = current_station[0] - previous_station[0]
-            elevation_change = current_station[1] - previous_station[1]
 
-            # Calculate the SCRV
-            scrv = 0
-            if distance != 0:
-                scrv = elevation_change / distance * cellsize
+def points_table(points, field_names):
+    """
+    Build an in memory QC table from intersection points.
 
-            # Select the row that matches the stream station and water name
-            selected = arcpy.management.SelectLayerByAttribute(
-                in_layer_or_view=in_fc,
-                where_clause="WTR_NM = '" + water_name + "' And STREAM_STN = " + str(current_station[0]))
+    parameters:
+        points - list of ((x, y), attribute tuple) from intersect_lines
+        field_names - the names of the attributes
 
-            # Calculate the selected row to the SCRV
-            arcpy.management.CalculateField(
-                in_table=selected,
-                field="SCRV",
-                expression=scrv)
+    returns:
+        A dictionary of field name to NumPy array with the coordinates in SHAPE@XY.
+    """
+    attributes = list(zip(*[values for _, values in points])) or [()] * len(field_names)
 
-    # Select all the rows with NULL SCRV
-    selected = arcpy.management.SelectLayerByAttribute(
-        in_layer_or_view=in_fc,
-        where_clause="SCRV IS NULL")
+    table = {"SHAPE@XY": np.array([point for point, _ in points],
+                                  dtype=np.float64).reshape(-1, 2)}
+    for field, values in zip(field_names, attributes):
+        if field in ("XS_LN_ID", "WTR_NM"):
+            table[field] = np.array(["" if value is None else value for value in values],
+                                    dtype=object)
+        else:
+            table[field] = np.array([-9999 if value is None else value for value in values],
+                                    dtype=np.float64)
+    return table
 
-    # Calculate the selected row to the SCRV
-    arcpy.management.CalculateField(
-        in_table=selected,
-        field="SCRV",
-        expression=-9999)            
-    
 
-def create_review_field(in_fc):
+def project_xy(xy, from_sr, to_sr):
     """
-    Add the review field based on the SCRV and ERR values
-    
+    Project point coordinates in one geometry operation.
+
     parameters:
-        in_fc - the feature class to update
+        xy - (n, 2) array of coordinates
+        from_sr - the spatial reference of the coordinates
+        to_sr - the spatial reference to project to
+
+    returns:
+        An (n, 2) array of projected coordinates.
+    """
+    if len(xy) == 0 or from_sr.exportToString() == to_sr.exportToString():
+        return xy
+
+    multipoint = arcpy.Multipoint(
+        arcpy.Array([arcpy.Point(x, y) for x, y in xy]), from_sr).projectAs(to_sr)
+    return np.array([[point.X, point.Y] for point in multipoint], dtype=np.float64)
+
+
+def add_samples(table, raster_list, spatial_ref, method="NEAREST"):
+    """
+    Sample rasters at the points of an in memory QC table.
+
+    NoData and points outside of a raster are stored as -9999.
+
+    parameters:
+        table - dictionary of field name to NumPy array with SHAPE@XY
+        raster_list - list of [raster, field name]
+        spatial_ref - the spatial reference of the table's points
+        method - NEAREST or BILINEAR sampling
 
     returns:
         None
     """
-    arcpy.AddMessage("Adding the Review field...")
+    # Group the rasters by spatial reference so the points are projected once per group
+    sr_groups = {}
+    for index, (in_raster, _) in enumerate(raster_list):
+        raster_sr = arcpy.Describe(in_raster).spatialReference
+        sr_groups.setdefault(raster_sr.exportToString(), [raster_sr, []])[1].append(index)
 
-    # Add the Review field
-    arcpy.management.AddField(
-        in_table=in_fc,
-        field_name="REVIEW",
-        field_type="TEXT",
-        field_length=1)
+    for raster_sr, indexes in sr_groups.values():
+        samples = sample_rasters(
+            in_rasters=[raster_list[index][0] for index in indexes],
+            xy=project_xy(table["SHAPE@XY"], spatial_ref, raster_sr),
+            method=method)
 
-    # Calculate all the rows to F for the Review field
-    arcpy.management.CalculateField(
-        in_table=in_fc,
-        field="REVIEW",
-        expression="'F'")
+        for column, index in enumerate(indexes):
+            values = samples[:, column].astype(np.float64)
+            table[raster_list[index][1]] = np.where(np.isnan(values), -9999, values)
 
-    # Potential ERR fields
-    err_fields = ["ERR_10pct", "ERR_04pct", "ERR_02pct", "ERR_01pct", "ERR_01plus",
-                  "ERR_0_2pct", "ERR_01minus", "ERR_01fut", "ERR_50pct", "ERR_20pct"]
 
-    # List of field names in the feature class
-    field_names = [field.name for field in arcpy.ListFields(dataset=in_fc)]
+def qc_field_names(xs):
+    """
+    List the cross section fields that are carried to the QC points.
+
+    parameters:
+        xs - cross section feature class
+
+    returns:
+        A list of field names.
+    """
+    xs_names = [field.name for field in arcpy.ListFields(dataset=xs)]
+    return ["XS_LN_ID", "WTR_NM", "STREAM_STN"] + [
+        "XS_" + event for event in EVENTS if "XS_" + event in xs_names]
+
+
+def build_qc_table(xs, field_names, pbl_data, raster_list, spatial_ref, cellsize,
+                   method="NEAREST", dif_tolerance=0.5, scrv_max=0.3, where_clause=None):
+    """
+    Build the in memory QC table for a set of cross sections.
+
+    The cross sections are intersected with the profile baselines, the
+    rasters are sampled at the points and the DIF, ERR, SCRV and REVIEW
+    columns are calculated.  Nothing is written to disk.
+
+    parameters:
+        xs - cross section feature class
+        field_names - cross section fields from qc_field_names
+        pbl_data - tuple of profile baseline segments, their feature ids and
+                   the segment index
+        raster_list - list of [raster, field name], including the DEM
+        spatial_ref - the spatial reference of the cross sections
+        cellsize - the cell size of the DEM
+        method - NEAREST or BILINEAR sampling of the rasters
+        dif_tolerance - differences over this are errors
+        scrv_max - errors with an SCRV at or below this are reviewed
+        where_clause - optional query to limit the cross sections
+
+    returns:
+        A dictionary of field name to NumPy array.
+    """
+    arcpy.AddMessage("Intersecting cross sections and profile baselines...")
+    points = list(intersect_lines(xs, field_names, *pbl_data, where_clause=where_clause))
+    table = points_table(points, field_names)
+    arcpy.AddMessage(f"\t{len(points)} QC points.")
+
+    arcpy.AddMessage("Extracting WSE values...")
+    add_samples(table, raster_list, spatial_ref, method)
+
+    arcpy.AddMessage("Calculating difference, SCRV and review fields...")
+    qc_differences(table, dif_tolerance)
+    qc_review(table, cellsize, scrv_max)
+    return table
+
+
+def write_qc_outputs(table, workspace, spatial_ref, dif_tolerances, scrv_cutoffs):
+    """
+    Write the final QC feature class, the columnar files and, when there is
+    more than one threshold combination, the sensitivity matrix.
+
+    parameters:
+        table - dictionary of field name to NumPy array
+        workspace - output workspace
+        spatial_ref - the spatial reference of the points
+        dif_tolerances - list of DIF tolerances
+        scrv_cutoffs - list of SCRV cutoffs
+
+    returns:
+        The path to the final QC feature class.
+    """
+    final_fc = write_qc_table(table, os.path.join(workspace, "frp_xs_elev_qc"), spatial_ref)
+    export_columnar(table={name: values for name, values in table.items()
+                           if name != "SHAPE@XY"}, workspace=workspace)
+    if len(dif_tolerances) * len(scrv_cutoffs) > 1:
+        export_sensitivity(table, workspace, dif_tolerances, scrv_cutoffs)
+    return final_fc
 
-    # Iterate through the ERR fields
-    for err_field in err_fields:
-        if err_field in field_names:
-            
-            # Selected all rows with an ERR field 'T' and an SCRV value <= 0.3
-            selected = arcpy.management.SelectLayerByAttribute(
-                in_layer_or_view=in_fc,
-                where_clause=err_field + " = 'T' And SCRV <= 0.3 And SCRV <> -9999")
 
-            # Calculate the REVIEW field to T
-            arcpy.management.CalculateField(
-                in_table=selected,
-                field="REVIEW",
-                expression="'T'")
+def stream_geometry_hashes(xs, field_names, pbl_segments, index):
+    """
+    Hash each stream's cross sections and the profile baselines near them.
+
+    The cross section attributes are part of the hash so a changed WSEL is
+    picked up along with a changed geometry.
+
+    parameters:
+        xs - cross section feature class
+        field_names - the cross section attributes to include
+        pbl_segments - (n, 4) array of profile baseline segments
+        index - the segment index from build_segment_index
+
+    returns:
+        A dictionary of WTR_NM to hex digest.
+    """
+    streams = {}
+    with arcpy.da.SearchCursor(xs, ["SHAPE@", "WTR_NM"] + field_names) as cursor:
+        for row in cursor:
+            if row[0] is None:
+                continue
+            segments = polyline_segments(row[0])
+            streams.setdefault(row[1] or "", []).append(
+                (segments.tobytes(), repr(row[2:]).encode()))
+
+    hashes = {}
+    for water_name, features in streams.items():
+        digest = hashlib.sha1()
+        xs_segments = []
+        for segment_bytes, attribute_bytes in sorted(features):
+            digest.update(segment_bytes)
+            digest.update(attribute_bytes)
+            xs_segments.append(np.frombuffer(segment_bytes).reshape(-1, 4))
+
+        # The profile baseline segments the stream's cross sections could cross
+        if index is not None:
+            candidates = query_segment_index(index, np.vstack(xs_segments))
+            digest.update(pbl_segments[candidates].tobytes())
+        hashes[water_name] = digest.hexdigest()
+    return hashes
+
+
+def sample_hash(values):
+    """
+    Hash a stream's samples of one raster.
+
+    parameters:
+        values - the samples in the QC table's point order, with NoData as
+                 -9999 as add_samples stores them
+
+    returns:
+        A hex digest.
+    """
+    return hashlib.sha1(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest()
+
+
+def load_qc_cache(cache_path):
+    """
+    Load the incremental QC cache.
+
+    parameters:
+        cache_path - the cache path without an extension
+
+    returns:
+        A tuple of (manifest dictionary, QC table dictionary).  Both are empty
+        when there is no cache.
+    """
+    if not (os.path.exists(cache_path + ".json") and os.path.exists(cache_path + ".npz")):
+        return {}, {}
+
+    with open(cache_path + ".json") as json_file:
+        manifest = json.load(json_file)
+
+    with np.load(cache_path + ".npz") as cached:
+        table = {name: cached[name] for name in manifest["columns"]}
+
+    # Text columns are stored as fixed width strings
+    for name, values in table.items():
+        if values.dtype.kind == "U":
+            table[name] = values.astype(object)
+    return manifest, table
 
-def export_final_fc(in_fc):
+
+def save_qc_cache(cache_path, manifest, table):
     """
-    Export the final feature class by reordering the fields.
+    Save the incremental QC cache.
 
     parameters:
-        in_fc - the feature class to export
+        cache_path - the cache path without an extension
+        manifest - dictionary of the cache keys
+        table - the QC table dictionary
 
     returns:
         None
     """
-    arcpy.AddMessage("Exporting the final feature class...")
+    manifest["columns"] = list(table)
+    np.savez(cache_path + ".npz", **{name: (values.astype(str) if values.dtype == object
+                                            else values) for name, values in table.items()})
+    with open(cache_path + ".json", "w") as json_file:
+        json.dump(manifest, json_file, indent=2)
 
-    # Get the path to the feature class
-    fc_path = arcpy.Describe(in_fc).path
 
-    # Path to the new feature class
-    new_fc = os.path.join(fc_path, "frp_xs_elev_qc")
+def incremental_qc(xs, pbl, workspace, rasters, dem, method="NEAREST",
+                   dif_tolerances=(0.5,), scrv_cutoffs=(0.3,)):
+    """
+    QC only the streams whose cross sections, profile baselines or rasters
+    changed since the last run, and merge them into the previous result.
 
-    # List of field names in the feature class
-    field_names = [field.name for field in arcpy.ListFields(dataset=in_fc)]
+    A stream is reprocessed when its geometry hash changed, or when a raster
+    file changed and the stream's samples of it hash differently.  The hashes
+    of reprocessed streams come from the samples in the new table, so only
+    the points of unchanged streams are sampled again, and only for the
+    rasters that changed.
+
+    parameters:
+        xs - cross sections
+        pbl - profile baselines
+        workspace - output workspace
+        rasters - WSE rasters to extract values from
+        dem - the DEM
+        method - NEAREST or BILINEAR sampling of the rasters
+        dif_tolerances - DIF tolerances.  The first one sets the ERR fields.
+        scrv_cutoffs - SCRV cutoffs.  The first one sets the REVIEW field.
 
-    # Field mappings
-    field_map = ""
-    
-    xs_ln_id = f"XS_LN_ID \"XS_LN_ID\" true true false 25 Text 0 0,First,#,{in_fc},XS_LN_ID,0,24;"
-    wtr_nm = f"WTR_NM \"WTR_NM\" true true false 100 Text 0 0,First,#,{in_fc},WTR_NM,0,99;"
-    stream_stn = f"STREAM_STN \"STREAM_STN\" true true false 8 Double 0 0,First,#,{in_fc},STREAM_STN,-1,-1;"
-    review = f"REVIEW \"REVIEW\" true true false 1 Text 0 0,First,#,{in_fc},REVIEW,0,0;"
-    scrv = f"SCRV \"SCRV\" true true false 4 Float 0 0,First,#,{in_fc},SCRV,-1,-1;"
-    dem = f"DEM \"DEM\" true true false 4 Float 0 0,First,#,{in_fc},DEM,-1,-1;"
-
-    field_map = xs_ln_id + wtr_nm + stream_stn + review + scrv + dem
-
-    for event in ['10pct','04pct', '02pct', '01pct', '01plus', '0_2pct', '01minus', '01fut', '50pct', '20pct']:
-        xs = "XS_" + event
-        if xs in field_names:
-            xs_formatted = f"{xs} \"{xs}\" true true false 8 Double 0 0,First,#,{in_fc},{xs},-1,-1;"
-            field_map += xs_formatted
-
-        wse = "WSE_" + event
-        if wse in field_names:
-            wse_formatted = f"{wse} \"{wse}\" true true false 4 Float 0 0,First,#,{in_fc},{wse},-1,-1;"
-            field_map += wse_formatted
-        
-        diff = "DIF_" + event
-        if diff in field_names:
-            diff_formatted = f"{diff} \"{diff}\" true true false 4 Float 0 0,First,#,{in_fc},{diff},-1,-1;"
-            field_map += diff_formatted
-
-        err = "ERR_" + event
-        if err in field_names:
-            err_formatted = f"{err} \"{err}\" true true false 1 Text 0 0,First,#,{in_fc},{err},0,0;"
-            field_map += err_formatted
-
-    # Export the feature class
-    arcpy.conversion.ExportFeatures(
-        in_features=in_fc,
-        out_features=new_fc,
-        field_mapping=field_map)                 
-
-    # Delete the original feature class
-    arcpy.management.Delete(in_fc)
-
-
-def main(xs, pbl, workspace, rasters, dem):
+    returns:
+        The QC table, or None when there are no QC points.  It is also
+        written to frp_xs_elev_qc in the workspace.
+    """
+    arcpy.AddMessage("Checking for changed streams...")
+
+    cache_path = os.path.join(output_folder(workspace), "frp_xs_elev_qc_cache")
+    manifest, previous = load_qc_cache(cache_path)
+
+    spatial_ref = arcpy.Describe(xs).spatialReference
+    raster_list = wse_raster_list(rasters) + [[dem, "DEM"]]
+    raster_fields = [field for _, field in raster_list]
+
+    field_names = qc_field_names(xs)
+
+    # Start over when the rasters or fields being QC'd are not the ones cached
+    settings = {"rasters": raster_fields, "fields": field_names, "method": method,
+                "dif_tolerance": dif_tolerances[0], "scrv_max": scrv_cutoffs[0]}
+    if manifest.get("settings") != settings:
+        manifest, previous = {}, {}
+
+    pbl_segments, pbl_feature_ids = read_line_segments(in_fc=pbl, spatial_ref=spatial_ref)
+    index = build_segment_index(pbl_segments) if len(pbl_segments) else None
+    geometry_hashes = stream_geometry_hashes(
+        xs, [field for field in field_names if field != "WTR_NM"], pbl_segments, index)
+
+    cached_streams = manifest.get("streams", {})
+    affected = {name for name, digest in geometry_hashes.items()
+                if cached_streams.get(name, {}).get("geometry") != digest}
+
+    # The rasters whose files changed since the last run
+    raster_states = {in_raster: [os.path.getmtime(in_raster), os.path.getsize(in_raster)]
+                     if os.path.isfile(in_raster) else None for in_raster, _ in raster_list}
+    changed_rasters = [in_raster for in_raster, state in raster_states.items()
+                       if state is None or manifest.get("rasters", {}).get(in_raster) != state]
+
+    sample_hashes = {name: dict(cached_streams.get(name, {}).get("samples", {}))
+                     for name in geometry_hashes}
+
+    # Sample each changed raster once at the unchanged streams' points
+    if previous and changed_rasters:
+        water_names = previous["WTR_NM"].astype(str)
+        unchanged = np.isin(water_names, list(set(geometry_hashes) - affected))
+        names = water_names[unchanged]
+        for in_raster in changed_rasters:
+            samples = sample_rasters(
+                in_rasters=[in_raster],
+                xy=project_xy(previous["SHAPE@XY"][unchanged], spatial_ref,
+                              arcpy.Describe(in_raster).spatialReference),
+                method=method)[:, 0].astype(np.float64)
+            samples = np.where(np.isnan(samples), -9999, samples)
+            for name in set(names):
+                digest = sample_hash(samples[names == name])
+                if sample_hashes[name].get(in_raster) != digest:
+                    affected.add(name)
+                sample_hashes[name][in_raster] = digest
+
+    removed = set(cached_streams) - set(geometry_hashes)
+    arcpy.AddMessage(f"\t{len(affected)} of {len(geometry_hashes)} streams need to be "
+                     f"reprocessed.  {len(removed)} streams were removed.")
+
+    # Reprocess the affected streams
+    tables = []
+    if previous:
+        keep = ~np.isin(previous["WTR_NM"].astype(str), list(affected | removed))
+        tables.append({name: values[keep] for name, values in previous.items()})
+
+    if affected and index is not None:
+        wtr_nm_field = arcpy.AddFieldDelimiters(datasource=xs, field="WTR_NM")
+        names = ", ".join("'" + name.replace("'", "''") + "'" for name in sorted(affected))
+        where_clause = f"{wtr_nm_field} IN ({names})"
+
+        table = build_qc_table(
+            xs=xs, field_names=field_names, pbl_data=(pbl_segments, pbl_feature_ids, index),
+            raster_list=raster_list, spatial_ref=spatial_ref,
+            cellsize=arcpy.Describe(dem).children[0].meanCellHeight, method=method,
+            dif_tolerance=dif_tolerances[0], scrv_max=scrv_cutoffs[0],
+            where_clause=where_clause)
+        tables.append(table)
+
+        # Hash the samples already in the new table
+        water_names = table["WTR_NM"].astype(str)
+        for name in affected:
+            in_stream = water_names == name
+            sample_hashes[name] = {in_raster: sample_hash(table[field][in_stream])
+                                   for in_raster, field in raster_list}
+
+    tables = [table for table in tables if len(table["SHAPE@XY"])]
+    if not tables:
+        arcpy.AddWarning("There are no QC points.")
+        return None
+    table = concat_tables(tables)
+
+    write_qc_outputs(table, workspace, spatial_ref, dif_tolerances, scrv_cutoffs)
+
+    manifest = {"settings": settings, "rasters": raster_states,
+                "streams": {name: {"geometry": geometry_hashes[name],
+                                   "samples": sample_hashes[name]}
+                            for name in geometry_hashes}}
+    save_qc_cache(cache_path, manifest, table)
+
+    return table
+
+
+def main(xs, pbl, workspace, rasters, dem, method="NEAREST", dense=False, incremental=False,
+         dif_tolerances=(0.5,), scrv_cutoffs=(0.3,)):
     """
     Main function.
 
@@ -484,34 +1422,201 @@ def main(xs, pbl, workspace, rasters, dem):
         workspace - output workspace
         rasters - WSE rasters to extract values from
         dem - the DEM
+        method - NEAREST or BILINEAR sampling of the rasters
+        dense - also sample the rasters at every cell along the cross sections
+        incremental - only reprocess the streams that changed since the last run
+        dif_tolerances - DIF tolerances.  The first one sets the ERR fields.
+        scrv_cutoffs - SCRV cutoffs.  The first one sets the REVIEW field.
 
     returns:
-        None
+        The QC table, or None when there is nothing to QC.  It is also written
+        to frp_xs_elev_qc in the workspace.
     """
     arcpy.env.overwriteOutput = True
-   
-    intersect_fc = convert_to_points(xs=xs, pbl=pbl, workspace=workspace)
-    qc_fc = convert_from_multipoint(in_fc=intersect_fc)
-    drop_fields(in_fc=qc_fc)
-    extract_wse_values(in_rasters=rasters, in_fc=qc_fc, in_dem=dem)
-    calc_nulls(in_fc=qc_fc)
-    calc_diff_fields(in_fc=qc_fc)
-    calc_diff_error(in_fc=qc_fc)
-    calc_scrv(in_fc=qc_fc, dem=dem)
-    create_review_field(in_fc=qc_fc)
-    export_final_fc(in_fc=qc_fc)
+
+    if incremental:
+        table = incremental_qc(xs=xs, pbl=pbl, workspace=workspace, rasters=rasters,
+                               dem=dem, method=method, dif_tolerances=dif_tolerances,
+                               scrv_cutoffs=scrv_cutoffs)
+        if dense:
+            dense_qc(xs=xs, in_rasters=rasters, workspace=workspace)
+        return table
+
+    spatial_ref = arcpy.Describe(xs).spatialReference
+
+    # Index the profile baseline segments in the cross section coordinates
+    pbl_segments, pbl_feature_ids = read_line_segments(in_fc=pbl, spatial_ref=spatial_ref)
+    if len(pbl_segments) == 0:
+        arcpy.AddWarning("There are no profile baselines.")
+        return None
+    pbl_data = (pbl_segments, pbl_feature_ids, build_segment_index(pbl_segments))
+
+    for _, raster_name in wse_raster_list(rasters):
+        arcpy.AddMessage(f"\t{raster_name} will be extracted...")
+
+    table = build_qc_table(
+        xs=xs, field_names=qc_field_names(xs), pbl_data=pbl_data,
+        raster_list=wse_raster_list(rasters) + [[dem, "DEM"]], spatial_ref=spatial_ref,
+        cellsize=arcpy.Describe(dem).children[0].meanCellHeight, method=method,
+        dif_tolerance=dif_tolerances[0], scrv_max=scrv_cutoffs[0])
+
+    write_qc_outputs(table, workspace, spatial_ref, dif_tolerances, scrv_cutoffs)
+
+    if dense:
+        dense_qc(xs=xs, in_rasters=rasters, workspace=workspace)
+
+    return table
+
+
+def read_manifest(manifest_path):
+    """
+    Read a county QC manifest.
+
+    The manifest is a CSV file with the columns COUNTY, XS, PBL, WORKSPACE,
+    RASTERS and DEM.  RASTERS is a ';' separated list of the WSE rasters.
+
+    parameters:
+        manifest_path - path to the manifest CSV file
+
+    returns:
+        A list of dictionaries, one per county.
+    """
+    with open(manifest_path, newline="") as csv_file:
+        counties = [{key.strip().upper(): value.strip() for key, value in row.items()}
+                    for row in csv.DictReader(csv_file)]
+
+    for county in counties:
+        county["RASTERS"] = [raster for raster in county["RASTERS"].split(';') if raster]
+    return counties
+
+
+def run_county(county, options):
+    """
+    Run the QC for one county.
+
+    This runs in a worker process of batch_main.
+
+    parameters:
+        county - dictionary of a county from read_manifest
+        options - dictionary of keyword arguments for main
+
+    returns:
+        The county's per stream summary with a COUNTY column.
+    """
+    table = main(xs=county["XS"], pbl=county["PBL"], workspace=county["WORKSPACE"],
+                 rasters=county["RASTERS"], dem=county["DEM"], **options)
+    if table is None:
+        return None
+
+    summary = qc_summary(table)
+    return {"COUNTY": np.full(len(summary["WTR_NM"]), county["COUNTY"], dtype=object),
+            **summary}
+
+
+def batch_main(manifest_path, out_folder, max_workers=None, disk_mb_per_sec=None,
+               worker_mb_per_sec=WORKER_MB_PER_SEC, **options):
+    """
+    Run the QC for every county in a manifest with a process pool.
+
+    The number of workers is the CPU count, capped by max_workers.  When the
+    disk bandwidth is given, it is also capped at the number of workers the
+    disk can feed at worker_mb_per_sec each.
+
+    Each county writes its QC feature class, columnar files and cache next to
+    its workspace, so counties that would write to the same folder are
+    rejected before any of them run.
+
+    parameters:
+        manifest_path - path to the manifest CSV file
+        out_folder - folder for the consolidated summary
+        max_workers - the most counties to run at once
+        disk_mb_per_sec - read bandwidth of the disk holding the rasters
+        worker_mb_per_sec - read bandwidth one county needs, see
+                            WORKER_MB_PER_SEC
+        options - keyword arguments passed on to main
+
+    returns:
+        The path to the consolidated summary.
+    """
+    counties = read_manifest(manifest_path)
+
+    folders = {}
+    for county in counties:
+        folder = os.path.normcase(os.path.abspath(output_folder(county["WORKSPACE"])))
+        if folder in folders:
+            raise ValueError(f"{county['COUNTY']} and {folders[folder]} both write to {folder}.  "
+                             f"Give each county its own workspace folder.")
+        folders[folder] = county["COUNTY"]
+
+    workers = min(os.cpu_count() or 1, len(counties) or 1)
+    if max_workers:
+        workers = min(workers, int(max_workers))
+    if disk_mb_per_sec:
+        workers = min(workers, max(1, int(float(disk_mb_per_sec) // float(worker_mb_per_sec))))
+
+    arcpy.AddMessage(f"QC'ing {len(counties)} counties with {workers} workers...")
+
+    arcgis_workers.use_python_workers()
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_county, county, options): county["COUNTY"]
+                   for county in counties}
+
+        for counter, future in enumerate(as_completed(futures), start=1):
+            county_name = futures[future]
+            try:
+                summary = future.result()
+            except Exception as error:
+                arcpy.AddWarning(f"{county_name} failed: {error}")
+                continue
+
+            if summary is not None:
+                summaries.append(summary)
+            arcpy.AddMessage(f"{county_name}: {counter} of {len(counties)}")
+
+    summary = concat_tables(summaries) if summaries else qc_summary(
+        {"WTR_NM": np.empty(0, dtype=object)})
+    summary_path = write_columns(summary, os.path.join(out_folder, "frp_qc_county_summary"))
+    arcpy.AddMessage(f"\t{summary_path}")
+    return summary_path
+
 
 if __name__ == '__main__':
+    # Batch mode: --batch <manifest csv> <output folder> [max workers] [disk MB/s] [county MB/s]
+    if sys.argv[1] == "--batch":
+        batch_main(
+            manifest_path=sys.argv[2],
+            out_folder=sys.argv[3],
+            max_workers=int(sys.argv[4]) if len(sys.argv) > 4 else None,
+            disk_mb_per_sec=float(sys.argv[5]) if len(sys.argv) > 5 else None,
+            worker_mb_per_sec=float(sys.argv[6]) if len(sys.argv) > 6 else WORKER_MB_PER_SEC)
+        sys.exit(0)
+
     cross_sections = sys.argv[1]
     profile_baselines = sys.argv[2]
     out_workspace = sys.argv[3]
     wse_rasters = sys.argv[4].split(';')
     project_dem = sys.argv[5]
-    
+    sample_method = sys.argv[6] if len(sys.argv) > 6 else "NEAREST"
+    dense_mode = len(sys.argv) > 7 and sys.argv[7].lower() == "true"
+    incremental_mode = len(sys.argv) > 8 and sys.argv[8].lower() == "true"
+    tolerance_list = [0.5]
+    if len(sys.argv) > 9:
+        tolerance_list = [float(value) for value in sys.argv[9].split(';')]
+    cutoff_list = [0.3]
+    if len(sys.argv) > 10:
+        cutoff_list = [float(value) for value in sys.argv[10].split(';')]
+
     main(
         xs=cross_sections,
         pbl=profile_baselines,
         workspace=out_workspace,
         rasters=wse_rasters,
-        dem=project_dem
+        dem=project_dem,
+        method=sample_method,
+        dense=dense_mode,
+        incremental=incremental_mode,
+        dif_tolerances=tolerance_list,
+        scrv_cutoffs=cutoff_list
     )
@@ -7,8 +7,13 @@
 import os
 import sys
 import arcpy
+import numpy as np
 from arcpy.sa import ExtractByMask, SetNull
 from arcpy.da import SearchCursor, UpdateCursor, Walk
+import frp_elevation_qc
+
+# Reach event names that differ from the QC event names
+QC_EVENT_NAMES = {"WSE_01min": "01minus"}
 
 def create_polygon(in_xs_path, station_1, station_2, out_fc):
     """
@@ -616,8 +621,90 @@ def create_static_grids(workspace, flooding, coord_sys, buffer_size, units):
         build_rat="DO_NOT_BUILD")
 
 
+def qc_reach(workspace, event_list, dem, folder_name, pbl_index, coord_sys, dif_tolerance=0.5):
+    """Sample a reach's event rasters where its cross-sections cross the profile baselines.
+
+    Keyword arguments:
+    workspace -- the workspace that contains the folders of stream names
+    event_list -- the flood events that were processed
+    dem -- the digital elevation model of the terrain
+    folder_name -- the name of the reach folder
+    pbl_index -- tuple of profile baseline segments, their feature ids and
+                 the segment index
+    coord_sys -- the spatial reference of the cross-sections
+    dif_tolerance -- differences over this are errors
+
+    Returns
+        the reach's QC table, or None if no cross-sections cross a profile baseline
+    """
+    xs_elev_fc = os.path.join(workspace, folder_name, "xs_elev.shp")
+
+    # Events that are part of the QC
+    qc_events = {}
+    for event in event_list:
+        qc_event = QC_EVENT_NAMES.get(event, event.replace("WSE_", ""))
+        if qc_event in frp_elevation_qc.EVENTS:
+            qc_events[event] = qc_event
+
+    field_names = ["XS_LN_ID", "WTR_NM", "STREAM_STN"] + list(qc_events)
+    points = list(frp_elevation_qc.intersect_lines(xs_elev_fc, field_names, *pbl_index))
+    if not points:
+        arcpy.AddMessage("\t\tNo cross-sections cross a profile baseline.")
+        return None
+    table = frp_elevation_qc.points_table(points, field_names)
+
+    # The cross-section elevations use -8888 for no value as well
+    for event, qc_event in qc_events.items():
+        xs_values = table.pop(event)
+        table["XS_" + qc_event] = np.where(xs_values == -8888, -9999.0, xs_values)
+        table["WSE_" + qc_event] = np.full(xs_values.shape, -9999.0)
+
+    # Sample the reach rasters and the DEM.  The points are projected to each raster.
+    raster_list = [[os.path.join(workspace, folder_name, event + ".tif"), "WSE_" + qc_event]
+                   for event, qc_event in qc_events.items()]
+    raster_list = [[raster, field] for raster, field in raster_list if arcpy.Exists(raster)]
+    frp_elevation_qc.add_samples(table, raster_list + [[dem, "DEM"]], coord_sys)
+
+    frp_elevation_qc.qc_differences(table, dif_tolerance)
+
+    error_count = sum(int(np.sum(table["ERR_" + qc_event] == "T"))
+                      for qc_event in qc_events.values())
+    arcpy.AddMessage(f"\t\t{len(points)} QC points, {error_count} differences over {dif_tolerance:g}.")
+    return table
+
+
+def write_qc_results(workspace, qc_tables, dem, coord_sys):
+    """Finish the accumulated reach QC tables and write the final QC table.
+
+    Keyword arguments:
+    workspace -- the workspace that contains the folders of stream names
+    qc_tables -- list of the reach QC tables
+    dem -- the digital elevation model of the terrain
+    coord_sys -- the coordinate system of the QC points
+    """
+    if not qc_tables:
+        arcpy.AddMessage("There are no QC points.")
+        return
+
+    qc_gdb = os.path.join(workspace, "frp_qc.gdb")
+    if not arcpy.Exists(dataset=qc_gdb):
+        arcpy.management.CreateFileGDB(out_folder_path=workspace, out_name="frp_qc.gdb")
+
+    # SCRV runs along the whole stream so it is calculated after every reach is done
+    table = frp_elevation_qc.concat_tables(qc_tables)
+    cellsize = arcpy.Describe(dem).children[0].meanCellHeight
+    frp_elevation_qc.qc_review(table, cellsize)
+
+    frp_elevation_qc.write_qc_table(table, os.path.join(qc_gdb, "frp_xs_elev_qc"), coord_sys)
+    frp_elevation_qc.write_columns(table={name: values for name, values in table.items()
+                                          if name != "SHAPE@XY"},
+                                   out_path=os.path.join(workspace, "frp_xs_elev_qc"))
+    frp_elevation_qc.write_columns(table=frp_elevation_qc.qc_summary(table),
+                                   out_path=os.path.join(workspace, "frp_xs_elev_qc_summary"))
+
+
 def main(xs_fc, flooding, process_list, elev_table, events, process_static, dem,
-         coord_sys, cell_size, out_folder, mosaic):
+         coord_sys, cell_size, out_folder, mosaic, qc_pbl=None):
     """The main function
 
     Keyword arguments:
@@ -632,6 +719,7 @@ def main(xs_fc, flooding, process_list, elev_table, events, process_static, dem,
     cell_size -- the final cell size of the rasters
     out_folder -- the folder where all data processing will occur
     mosaic -- boolean stating whether to make the mosaicked rasters
+    qc_pbl -- profile baselines.  When given, each reach is QC'd as soon as it finishes
     """
 
     # Set the snap raster for the raster processing
@@ -660,6 +748,17 @@ def main(xs_fc, flooding, process_list, elev_table, events, process_static, dem,
                              buffer_size=cell_size, units=spatial_units,
                              event="500 year", coord_sys=spatial_ref)
 
+    # Index the profile baselines once for the reach QC
+    qc_tables = []
+    pbl_index = None
+    if qc_pbl:
+        arcpy.AddMessage("Indexing the profile baselines for QC.")
+        pbl_segments, pbl_feature_ids = frp_elevation_qc.read_line_segments(
+            in_fc=qc_pbl, spatial_ref=spatial_ref)
+        if len(pbl_segments):
+            pbl_index = (pbl_segments, pbl_feature_ids,
+                         frp_elevation_qc.build_segment_index(pbl_segments))
+
     # Process each water name
     for process_name in process_list:
         water_name, start_id = process_name.split("--")
@@ -700,6 +799,19 @@ def main(xs_fc, flooding, process_list, elev_table, events, process_static, dem,
                 extract_raster_from_dem(workspace=out_folder, event=event,
                                         dem=dem, folder_name=folder_name)
 
+        if pbl_index:
+            arcpy.AddMessage("\tQC'ing the reach rasters.")
+            qc_table = qc_reach(workspace=out_folder, event_list=events, dem=dem,
+                                folder_name=folder_name, pbl_index=pbl_index,
+                                coord_sys=spatial_ref)
+            if qc_table is not None:
+                qc_tables.append(qc_table)
+
+    if qc_pbl:
+        arcpy.AddMessage("\nWriting the QC results.")
+        write_qc_results(workspace=out_folder, qc_tables=qc_tables, dem=dem,
+                         coord_sys=spatial_ref)
+
     # Make any static bfe raster
     if process_static:
         arcpy.AddMessage("Creating Static BFE WSE grids.")
@@ -731,6 +843,11 @@ if __name__ == "__main__":
     COORD_SYS = sys.argv[10]
     MAKE_MOSAIC = sys.argv[11]
 
+    # Optional: --qc <profile baselines>
+    QC_PBL = None
+    if "--qc" in sys.argv[12:]:
+        QC_PBL = sys.argv[sys.argv.index("--qc") + 1]
+
     if MAKE_MOSAIC.lower() == 'true':
         MAKE_MOSAIC = True
     else:
@@ -752,5 +869,6 @@ if __name__ == "__main__":
         cell_size=OUT_CELL_SIZE,
         coord_sys=COORD_SYS,
         out_folder=OUTPUT_FOLDER,
-        mosaic=MAKE_MOSAIC
+        mosaic=MAKE_MOSAIC,
+        qc_pbl=QC_PBL
     )
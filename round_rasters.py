@@ -1,13 +1,53 @@
 """
 Round a raster to a specified precision.
 
+Rasters written to a folder are read and rounded one block of rows at a time and
+written straight to a compressed tiled GeoTIFF, so memory use is one block and
+each raster is written once.  Rasters written to a file geodatabase are rounded
+with map algebra.  Values are rounded half away from zero, so -2.5 rounds to -3.
+
+Rasters written to a folder are rounded at the same time.  The blocks are
+rounded in a process pool, each raster is written by its own thread and the
+tiles of all of the rasters are compressed in one shared thread pool.  Blocks
+are sized so the blocks in flight for the whole batch stay within BLOCK_CELLS,
+but are never shorter than MIN_BLOCK_ROWS.  Rasters written to a file
+geodatabase are rounded one at a time, since saving several rasters to one
+geodatabase at once can fail on its schema locks.
+
+With pack, rounded values are stored as whole numbers of the precision in the
+smallest unsigned integer type that fits, with GDAL scale and offset metadata,
+which compresses several times better than float32.  GDAL reports the scale
+and offset of the band, and a value is code * scale + offset.
+
 Author: Jesse Morgan
 Created: 2/16/2026
 """
 import sys
 import os
 import arcpy
-from arcpy.sa import Raster, Float, Int
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from arcpy.sa import Raster, Float, Con, RoundDown, RoundUp
+import arcgis_workers
+import tiled_geotiff
+
+# NoData of the rounded float rasters written to folders
+NODATA = -3.4028235e38
+
+# Integer types for packed rasters, smallest first
+PACKED_TYPES = [np.uint8, np.uint16, np.uint32]
+
+# Most cells read at once for a batch of rasters.  The blocks are float64 while
+# they are rounded, so this is about 256 MB.
+BLOCK_CELLS = 32 * 1024 ** 2
+
+# Number of blocks block_strips submits ahead of the one being written
+LOOKAHEAD = 4
+
+# Fewest rows per block, one row of tiled_geotiff tiles.  Smaller blocks would
+# read wide rasters in thousands of RasterToNumPyArray calls.
+MIN_BLOCK_ROWS = 256
 
 
 def determine_precision(in_prec):
@@ -27,9 +67,6 @@ def determine_precision(in_prec):
         arcpy.AddError("ERROR: Precision must be number between 0 and 5.")
         sys.exit(1)
 
-    rounding_value = 0
-    multiplier = 0
-
     if precision < 0:
         arcpy.AddError("ERROR: Precision value must not be negative.")
         sys.exit(1)
@@ -38,75 +75,430 @@ def determine_precision(in_prec):
         arcpy.AddError("ERROR: Precision value must not be greater than 5.")
         sys.exit(1)
 
-    if precision > 0:
-        rounding_value = 5 / 10 ** (precision + 1)
-        multiplier = 1 * 10 ** precision
+    rounding_value = 5 / 10 ** (precision + 1)
+    multiplier = 1 * 10 ** precision
 
     return rounding_value, multiplier
 
-def main(rasters, out_workspace, precision):
+
+def round_codes(block, rounding_value, multiplier):
+    """
+    Round a block of cells half away from zero to whole multiples of the
+    precision, as codes of value * multiplier.
+
+    The block is rounded in place in float64 since a float32 runs out of digits
+    when it is multiplied by 10 ** 5.
+
+    parameters:
+        block - float64 array with NoData as NaN
+        rounding_value - the rounding value from determine_precision
+        multiplier - the multiplier from determine_precision
+
+    returns:
+        The block of whole number codes with NoData as NaN."""
+    magnitude = np.abs(block)
+    magnitude *= multiplier
+    magnitude += rounding_value * multiplier
+    np.floor(magnitude, out=magnitude)
+    np.copysign(magnitude, block, out=block)
+    return block
+
+
+def round_block(block, rounding_value, multiplier):
+    """
+    Round a block of cells half away from zero.  See round_codes.
+
+    returns:
+        The rounded block as float32 with NoData as NaN."""
+    block = round_codes(block, rounding_value, multiplier)
+    block /= multiplier
+
+    # Adding zero turns -0.0 into 0.0
+    block += 0.0
+    return block.astype(np.float32)
+
+
+def raster_info(raster):
+    """
+    Describe what round_to_tiff needs from a raster.  The result can be passed
+    to other processes, unlike a Raster.
+
+    parameters:
+        raster - path to the raster
+
+    returns:
+        A dictionary of the raster's path, size, extent, NoData and EPSG code."""
+    in_raster = Raster(raster)
+    spatial_reference = in_raster.spatialReference
+    return {"path": raster,
+            "rows": in_raster.height,
+            "cols": in_raster.width,
+            "x_min": in_raster.extent.XMin,
+            "y_max": in_raster.extent.YMax,
+            "cell_width": in_raster.meanCellWidth,
+            "cell_height": in_raster.meanCellHeight,
+            "nodata": in_raster.noDataValue,
+            "epsg": spatial_reference.factoryCode,
+            "geographic": spatial_reference.type == "Geographic"}
+
+
+def read_rows(info, row, nrows):
+    """
+    Read one block of rows.
+
+    parameters:
+        info - the raster from raster_info
+        row - the first row of the block
+        nrows - the number of rows in the block
+
+    returns:
+        A float64 block with NoData as NaN."""
+    cells = arcpy.RasterToNumPyArray(
+        in_raster=info["path"],
+        lower_left_corner=arcpy.Point(info["x_min"], info["y_max"] - (row + nrows) * info["cell_height"]),
+        ncols=info["cols"],
+        nrows=nrows)
+    block = cells.astype(np.float64)
+    if info["nodata"] is not None:
+        block[cells == info["nodata"]] = np.nan
+    return block
+
+
+def round_rows(info, row, nrows, rounding_value, multiplier):
+    """
+    Read and round one block of rows.  Runs in a worker process.
+
+    returns:
+        The rounded block as float32 with NoData as NaN."""
+    return round_block(read_rows(info, row, nrows), rounding_value, multiplier)
+
+
+def code_rows(info, row, nrows, rounding_value, multiplier):
+    """
+    Read one block of rows and round it to codes.  Runs in a worker process.
+
+    returns:
+        The float64 block of codes with NoData as NaN."""
+    return round_codes(read_rows(info, row, nrows), rounding_value, multiplier)
+
+
+def code_range(info, row, nrows, rounding_value, multiplier):
+    """
+    Find the smallest and largest code in one block of rows.  Runs in a worker
+    process.
+
+    returns:
+        A tuple of (smallest code, largest code), or None when the block is
+        all NoData."""
+    codes = code_rows(info, row, nrows, rounding_value, multiplier)
+    if np.isnan(codes).all():
+        return None
+    return int(np.nanmin(codes)), int(np.nanmax(codes))
+
+
+def pack_rows(info, row, nrows, rounding_value, multiplier, code_min, nodata_code, dtype):
+    """
+    Read one block of rows and pack its codes into an integer type.  Runs in a
+    worker process.
+
+    parameters:
+        code_min - the code stored as 0
+        nodata_code - the integer stored for NoData
+        dtype - the integer type
+
+    returns:
+        The packed block."""
+    codes = code_rows(info, row, nrows, rounding_value, multiplier)
+    codes -= code_min
+    codes[np.isnan(codes)] = nodata_code
+    return codes.astype(dtype)
+
+
+def block_strips(info, function, args=(), block_rows=1024, executor=None, lookahead=LOOKAHEAD):
+    """
+    Run a function on a raster one block of rows at a time.
+
+    With a process pool, the next blocks are worked on while the current one is
+    compressed.  At most lookahead blocks are waiting, so memory stays a few
+    blocks per raster.
+
+    parameters:
+        info - the raster from raster_info
+        function - function of (info, first row, number of rows, *args), such
+                   as round_rows
+        args - the other arguments of the function
+        block_rows - the number of rows per block
+        executor - optional ProcessPoolExecutor that runs the function
+        lookahead - the number of blocks submitted ahead of the one used
+
+    returns:
+        A generator of (first row, result) in row order."""
+    rows = info["rows"]
+    if executor is None:
+        for row in range(0, rows, block_rows):
+            yield row, function(info, row, min(block_rows, rows - row), *args)
+        return
+
+    pending = deque()
+    for row in range(0, rows, block_rows):
+        pending.append((row, executor.submit(function, info, row, min(block_rows, rows - row), *args)))
+        if len(pending) > lookahead:
+            first_row, future = pending.popleft()
+            yield first_row, future.result()
+    while pending:
+        first_row, future = pending.popleft()
+        yield first_row, future.result()
+
+
+def budget_rows(cols, raster_count, lookahead=LOOKAHEAD):
+    """
+    Choose the rows per block so the blocks in flight for a batch of rasters
+    stay within BLOCK_CELLS.  Each raster has up to lookahead blocks waiting
+    and one being written.  Blocks are at least MIN_BLOCK_ROWS rows, so a
+    batch of very wide rasters can go over the budget.
+
+    parameters:
+        cols - the number of columns in the raster
+        raster_count - the number of rasters rounded at the same time
+        lookahead - the number of blocks submitted ahead of the one used
+
+    returns:
+        The number of rows per block."""
+    return max(MIN_BLOCK_ROWS, BLOCK_CELLS // (cols * (lookahead + 1) * raster_count))
+
+
+def round_to_tiff(info, out_raster, rounding_value, multiplier, block_rows=1024, executor=None,
+                  compressor=None):
+    """
+    Round a raster block by block into a compressed tiled GeoTIFF.
+
+    parameters:
+        info - the raster from raster_info
+        out_raster - the output .tif
+        rounding_value - the rounding value from determine_precision
+        multiplier - the multiplier from determine_precision
+        block_rows - the number of rows per block
+        executor - optional ProcessPoolExecutor that rounds the blocks
+        compressor - optional ThreadPoolExecutor that compresses the tiles"""
+    tiled_geotiff.write_strips(
+        out_path=out_raster,
+        strips=block_strips(info, round_rows, (rounding_value, multiplier), block_rows, executor),
+        rows=info["rows"],
+        cols=info["cols"],
+        dtype=np.float32,
+        x_min=info["x_min"],
+        y_max=info["y_max"],
+        cell_width=info["cell_width"],
+        cell_height=info["cell_height"],
+        epsg=info["epsg"],
+        geographic=info["geographic"],
+        nodata=NODATA,
+        executor=compressor)
+
+
+def packed_type(code_span):
+    """
+    Return the smallest unsigned integer type that holds codes 0 to code_span
+    with the largest value left for NoData, or None when none do."""
+    for dtype in PACKED_TYPES:
+        if code_span < np.iinfo(dtype).max:
+            return dtype
+    return None
+
+
+def pack_to_tiff(info, out_raster, rounding_value, multiplier, block_rows=1024, executor=None,
+                 compressor=None):
+    """
+    Round a raster and pack it into the smallest integer type that fits.
+
+    The value of a cell is code * scale + offset, with scale = 1 / multiplier
+    and offset the smallest rounded value.  The scale and offset are written to
+    the GDAL metadata and the largest code of the type is NoData.  Rasters with
+    a range too large for uint32 are written as float32.  The packed raster is
+    read back one row of tiles at a time and checked against the rounded codes.
+
+    parameters:
+        info - the raster from raster_info
+        out_raster - the output .tif
+        rounding_value - the rounding value from determine_precision
+        multiplier - the multiplier from determine_precision
+        block_rows - the number of rows per block
+        executor - optional ProcessPoolExecutor that works on the blocks
+        compressor - optional ThreadPoolExecutor that compresses the tiles
+
+    returns:
+        A tuple of (type name, compressed size over uncompressed float32 size,
+        largest difference from the float32 rounding read back).  The
+        difference is None for float32 rasters."""
+    ranges = [block_range for _, block_range in
+              block_strips(info, code_range, (rounding_value, multiplier), block_rows, executor) if block_range]
+    code_min = min([block_range[0] for block_range in ranges], default=0)
+    code_max = max([block_range[1] for block_range in ranges], default=0)
+    float_bytes = info["rows"] * info["cols"] * 4
+
+    dtype = packed_type(code_max - code_min)
+    if dtype is None:
+        round_to_tiff(info, out_raster, rounding_value, multiplier, block_rows, executor, compressor)
+        return "float32", float_bytes / os.path.getsize(out_raster), None
+
+    nodata_code = int(np.iinfo(dtype).max)
+    scale, offset = 1 / multiplier, code_min / multiplier
+    _, compressed_bytes = tiled_geotiff.write_strips(
+        out_path=out_raster,
+        strips=block_strips(info, pack_rows, (rounding_value, multiplier, code_min, nodata_code, dtype),
+                            block_rows, executor),
+        rows=info["rows"],
+        cols=info["cols"],
+        dtype=dtype,
+        x_min=info["x_min"],
+        y_max=info["y_max"],
+        cell_width=info["cell_width"],
+        cell_height=info["cell_height"],
+        epsg=info["epsg"],
+        geographic=info["geographic"],
+        nodata=nodata_code,
+        metadata={"scale": scale, "offset": offset},
+        executor=compressor)
+
+    # Read the packed raster back a row of tiles at a time and compare it to the codes
+    # and the float32 rounding, so only a block and a row of tiles are in memory
+    tile_rows = tiled_geotiff.read_tile_rows(out_raster)
+    stored_rows = np.empty((0, info["cols"]), dtype=dtype)
+    largest_error = 0.0
+    for row, codes in block_strips(info, code_rows, (rounding_value, multiplier), block_rows, executor):
+        while len(stored_rows) < len(codes):
+            stored_rows = np.concatenate([stored_rows, next(tile_rows)[1]])
+        stored, stored_rows = stored_rows[:len(codes)], stored_rows[len(codes):]
+        nodata = np.isnan(codes)
+        if not np.array_equal(nodata, stored == nodata_code) or \
+                not np.array_equal(codes[~nodata] - code_min, stored[~nodata]):
+            raise ValueError(f"The packed values of {out_raster} do not match the rounded values.")
+        unpacked = stored[~nodata] * scale + offset
+        expected = ((codes[~nodata] / multiplier) + 0.0).astype(np.float32)
+        largest_error = max(largest_error, float(np.max(np.abs(unpacked - expected), initial=0.0)))
+    return np.dtype(dtype).name, float_bytes / compressed_bytes, largest_error
+
+
+def round_map_algebra(raster, rounding_value, multiplier):
+    """
+    Round a raster half away from zero with map algebra.
+
+    Int truncates toward zero, so adding the rounding value before Int rounds
+    negative values the wrong way.  Negative values round down from the
+    rounding value below them instead.
+
+    returns:
+        The rounded Raster."""
+    shifted = raster * multiplier
+    half = rounding_value * multiplier
+    return Float(Con(shifted >= 0, RoundDown(shifted + half), RoundUp(shifted - half))) / multiplier
+
+
+def round_to_gdb(raster, out_raster, rounding_value, multiplier):
+    """
+    Round a raster into a file geodatabase with map algebra."""
+    rounded_raster = round_map_algebra(Raster(raster), rounding_value, multiplier)
+    rounded_raster.save(out_raster)
+
+
+def output_rasters(rasters, out_workspace, to_gdb):
+    """
+    Name the output raster of each input raster and check they can be written.
+
+    parameters:
+        rasters - list of rasters to round
+        out_workspace - output location for the rounded rasters
+        to_gdb - whether the output location is a file geodatabase
+
+    returns:
+        A list of output raster paths in the same order."""
+    out_rasters = []
+    for raster in rasters:
+        desc = arcpy.Describe(raster)
+        in_raster_name = desc.name
+        extension = desc.extension
+        out_raster_name = in_raster_name.replace("." + extension, "") if extension else in_raster_name
+
+        if not to_gdb:  # Output is a folder
+            out_raster_name = out_raster_name + ".tif"
+
+        final_raster = os.path.join(out_workspace, out_raster_name)
+
+        # Check if the output raster already exists.
+        if arcpy.Exists(final_raster) or final_raster in out_rasters:
+            arcpy.AddError(f"ERROR: {final_raster} already exists. Exiting...")
+            sys.exit(1)
+        out_rasters.append(final_raster)
+    return out_rasters
+
+
+def main(rasters, out_workspace, precision, max_workers=None, pack=False):
     """
     main function
 
+    Rasters written to a folder are rounded at the same time.  Blocks are read
+    and rounded in a process pool while a thread per raster writes it and a
+    shared thread pool compresses the tiles, so a batch takes about as long as
+    its largest raster.  Rasters written to a file geodatabase are rounded one
+    at a time to avoid its schema locks.
+
     parameters:
         rasters - list of rasters to round
         out_workspace - output location for the rounded rasters
         precision - how many decimal places to round to
+        max_workers - the number of worker processes.  Defaults to the number
+                      of CPUs.
+        pack - write the rounded values as scaled integers, see pack_to_tiff.
+               Only for folder outputs.
     """
     try:
-        for raster in rasters:
-            arcpy.AddMessage(f"Rounding {raster}")
-            
-            # Get raster information
-            orig_raster = Raster(raster)
-            desc = arcpy.Describe(orig_raster)
-            in_raster_name = desc.name
-            extension = desc.extension
-
-            # Create place holders for new rasters
-            new_raster = None
-            final_raster = None
-
-            # Determine out raster
-            out_desc = arcpy.Describe(out_workspace)
-
-
-            if out_desc.name.endswith(".gdb"):  # Output is a file geodatabase
-                out_raster_name = in_raster_name.replace("." + extension, "")  # Remove extension
-                new_raster = os.path.join(out_workspace, out_raster_name)
-            else:
-                out_raster_name = "temp_" + desc.name  # Temp raster to copy later
-
-                if not extension:  # The input raster was in a file geodatabase
-                    out_raster_name = out_raster_name + ".tif"
-                    in_raster_name = in_raster_name + ".tif"
-
-            new_raster = os.path.join(out_workspace, out_raster_name)
-            final_raster = os.path.join(out_workspace, in_raster_name)
-
-            # Check if the output raster already exists.
-            if arcpy.Exists(new_raster):
-                arcpy.AddError(f"ERROR: {new_raster} already exists. Exiting...")
-                sys.exit(1)
-
-            if final_raster:
-                if arcpy.Exists(final_raster):
-                    arcpy.AddError(f"ERROR: {new_raster} already exists. Exiting...")
-                    sys.exit(1)                
-
-            # Get the values for the rounding formula
-            rounding_value, multiplier = determine_precision(precision)
-
-            # Round the raster
-            rounded_raster = (Float(Int((orig_raster + rounding_value) * multiplier))) / multiplier          
-            rounded_raster.save(new_raster)
-
-            # If the output workspace is a folder, copy the raster to invoke the LZW compression
-            if out_raster_name.startswith("temp"):
-                arcpy.management.CopyRaster(
-                    in_raster=new_raster,
-                    out_rasterdataset=final_raster)
-                arcpy.management.Delete(new_raster)
+        # Check the output location and precision once for the batch
+        if not arcpy.Exists(out_workspace):
+            arcpy.AddError(f"ERROR: {out_workspace} does not exist. Exiting...")
+            sys.exit(1)
+        to_gdb = arcpy.Describe(out_workspace).name.endswith(".gdb")
+        rounding_value, multiplier = determine_precision(precision)
+        if pack and to_gdb:
+            arcpy.AddError("ERROR: Packed rasters can only be written to a folder. Exiting...")
+            sys.exit(1)
+        out_rasters = output_rasters(rasters, out_workspace, to_gdb)
+
+        arcpy.SetProgressor("step", "Rounding rasters...", 0, len(rasters), 1)
+        if to_gdb:
+            for done, (raster, final_raster) in enumerate(zip(rasters, out_rasters), 1):
+                round_to_gdb(raster, final_raster, rounding_value, multiplier)
+                arcpy.AddMessage(f"Rounded {raster} ({done} of {len(rasters)})")
+                arcpy.SetProgressorPosition(done)
+            arcpy.AddMessage("Done")
+            return
+
+        arcgis_workers.use_python_workers()
+
+        with ProcessPoolExecutor(max_workers=max_workers) as processes, \
+                ThreadPoolExecutor(max_workers=len(rasters)) as writers, \
+                ThreadPoolExecutor() as compressor:
+            futures = {}
+            for raster, final_raster in zip(rasters, out_rasters):
+                info = raster_info(raster)
+                future = writers.submit(pack_to_tiff if pack else round_to_tiff, info, final_raster,
+                                        rounding_value, multiplier, budget_rows(info["cols"], len(rasters)),
+                                        executor=processes, compressor=compressor)
+                futures[future] = (raster, final_raster)
+
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                raster, final_raster = futures[future]
+                if pack:
+                    packed_type_name, ratio, largest_error = result
+                    arcpy.AddMessage(f"Packed {raster} as {packed_type_name}: {ratio:.1f} times smaller than "
+                                     f"uncompressed float32")
+                    if largest_error is not None:
+                        arcpy.AddMessage(f"Read back within {largest_error:.2g} of the float32 rounding")
+
+                tiled_geotiff.define_projection(final_raster, Raster(raster).spatialReference)
+
+                arcpy.AddMessage(f"Rounded {raster} ({done} of {len(rasters)})")
+                arcpy.SetProgressorPosition(done)
 
         arcpy.AddMessage("Done")
 
@@ -119,8 +511,16 @@ if __name__ == '__main__':
     workspace = sys.argv[2]
     in_precision = sys.argv[3]
 
+    # Optional number of worker processes and whether to pack the rasters
+    workers = None
+    if len(sys.argv) > 4 and sys.argv[4] not in ["", "#"]:
+        workers = int(sys.argv[4])
+    pack_rasters = len(sys.argv) > 5 and sys.argv[5].lower() in ["true", "pack"]
+
     main(
         rasters=in_rasters,
         out_workspace=workspace,
-        precision=in_precision
+        precision=in_precision,
+        max_workers=workers,
+        pack=pack_rasters
     )
@@ -0,0 +1,475 @@
+"""
+Write tiled, DEFLATE compressed GeoTIFFs straight from NumPy strips.
+
+The rasters are written one strip of rows at a time, so a raster never has to be
+in memory or on disk uncompressed.  Tiles are compressed in a thread pool (zlib
+releases the GIL) while the caller computes the next strip.  Float rasters use
+the floating point predictor (3) and integer rasters use horizontal
+differencing (2), which is what GDAL and ArcGIS write for compressed rasters.
+
+The files are classic TIFF, or BigTIFF when the raster could be larger than
+4 GB.  Only EPSG codes are written to the GeoKeys.  Other coordinate systems,
+such as ESRI's 102xxx codes, are written as user-defined and define_projection
+records them for ArcGIS.  read_array and read_tile_rows read the files back for
+checking.
+
+Author: Jesse Morgan
+"""
+import os
+import struct
+import zlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+# TIFF tags
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+SAMPLES_PER_PIXEL = 277
+PLANAR_CONFIGURATION = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+EXTRA_SAMPLES = 338
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+GEO_KEY_DIRECTORY = 34735
+GDAL_METADATA = 42112
+GDAL_NODATA = 42113
+
+# TIFF field types
+ASCII, SHORT, LONG, DOUBLE, LONG8 = 2, 3, 4, 12, 16
+TYPE_FORMATS = {ASCII: "s", SHORT: "H", LONG: "I", DOUBLE: "d", LONG8: "Q"}
+
+DEFLATE = 8
+
+# Sample formats
+UINT, INT, FLOAT = 1, 2, 3
+
+# GeoKey value of a user-defined coordinate system.  EPSG codes are below it.
+USER_DEFINED = 32767
+
+
+def sample_format(dtype):
+    """Return the TIFF sample format for a NumPy type."""
+    if dtype.kind == "f":
+        return FLOAT
+    if dtype.kind == "i":
+        return INT
+    return UINT
+
+
+def is_epsg(code):
+    """
+    Return whether a coordinate system code, such as a factoryCode, can be
+    written to the GeoKeys as an EPSG code.
+    """
+    return bool(code) and 0 < code < USER_DEFINED
+
+
+def geo_keys(epsg, geographic):
+    """
+    Build the GeoKeyDirectory for a coordinate system.
+
+    parameters:
+        epsg - the EPSG code of the coordinate system.  Other codes are
+               written as user-defined.
+        geographic - True for a geographic (GCS) coordinate system
+
+    returns:
+        A list of SHORT values.
+    """
+    # GTModelType, GTRasterType (PixelIsArea), then the coordinate system key
+    keys = [(1024, 0, 1, 2 if geographic else 1),
+            (1025, 0, 1, 1),
+            (2048 if geographic else 3072, 0, 1, epsg if is_epsg(epsg) else USER_DEFINED)]
+    directory = [1, 1, 0, len(keys)]
+    for key in keys:
+        directory.extend(key)
+    return directory
+
+
+def predict(tile, predictor):
+    """
+    Apply a TIFF predictor to a tile before it is compressed.
+
+    parameters:
+        tile - 2-D array in the file's byte order
+        predictor - 1 (none), 2 (horizontal) or 3 (floating point)
+
+    returns:
+        The bytes to compress.
+    """
+    if predictor == 2:
+        # Differences between neighbors in each row, wrapping on overflow
+        diff = tile.copy()
+        diff[:, 1:] = tile[:, 1:] - tile[:, :-1]
+        return diff.tobytes()
+
+    if predictor == 3:
+        # The bytes of each row are split into planes, most significant byte first, and
+        # then differenced as one row of bytes.
+        rows, cols = tile.shape
+        size = tile.dtype.itemsize
+        planes = tile.astype(tile.dtype.newbyteorder(">")).view(np.uint8).reshape(rows, cols, size)
+        planes = planes.transpose(0, 2, 1).reshape(rows, cols * size)
+        diff = planes.copy()
+        diff[:, 1:] = planes[:, 1:] - planes[:, :-1]
+        return diff.tobytes()
+
+    return tile.tobytes()
+
+
+def unpredict(data, shape, dtype, predictor):
+    """
+    Undo a TIFF predictor on a decompressed tile.
+
+    parameters:
+        data - the decompressed bytes
+        shape - the tile shape
+        dtype - the type of the tile in the file's byte order
+        predictor - 1 (none), 2 (horizontal) or 3 (floating point)
+
+    returns:
+        A 2-D array.
+    """
+    rows, cols = shape
+    if predictor == 3:
+        size = dtype.itemsize
+        planes = np.cumsum(np.frombuffer(data, np.uint8).reshape(rows, cols * size), axis=1, dtype=np.uint8)
+        planes = planes.reshape(rows, size, cols).transpose(0, 2, 1).copy()
+        return planes.view(dtype.newbyteorder(">")).reshape(rows, cols).astype(dtype)
+
+    tile = np.frombuffer(data, dtype).reshape(rows, cols)
+    if predictor == 2:
+        tile = np.cumsum(tile, axis=1, dtype=dtype)
+    return tile
+
+
+def compress_tile(tile, predictor, level):
+    """Apply the predictor to a tile and DEFLATE it."""
+    return zlib.compress(predict(tile, predictor), level)
+
+
+def write_ifd(f, entries, bigtiff):
+    """
+    Write an image file directory at the end of the file.
+
+    parameters:
+        f - the open file
+        entries - list of (tag, type, values).  ASCII values are a str.
+        bigtiff - True to write the BigTIFF layout
+
+    returns:
+        The offset of the directory.
+    """
+    count_format, entry_format, offset_format = ("<Q", "<HHQ", "<Q") if bigtiff else ("<H", "<HHI", "<I")
+    inline = 8 if bigtiff else 4
+
+    # Values that do not fit in the entry are written before the directory
+    f.seek(0, os.SEEK_END)
+    packed_entries = []
+    for tag, field_type, values in sorted(entries, key=lambda entry: entry[0]):
+        if field_type == ASCII:
+            data = values.encode("ascii") + b"\0"
+            count = len(data)
+        else:
+            count = len(values)
+            data = struct.pack("<" + TYPE_FORMATS[field_type] * count, *values)
+
+        if len(data) <= inline:
+            value = data.ljust(inline, b"\0")
+        else:
+            if f.tell() % 2:
+                f.write(b"\0")
+            value = struct.pack(offset_format, f.tell())
+            f.write(data)
+        packed_entries.append(struct.pack(entry_format, tag, field_type, count) + value)
+
+    if f.tell() % 2:
+        f.write(b"\0")
+    ifd_offset = f.tell()
+    f.write(struct.pack(count_format, len(packed_entries)))
+    f.write(b"".join(packed_entries))
+    f.write(struct.pack(offset_format, 0))
+    return ifd_offset
+
+
+def write_strips(out_path, strips, rows, cols, dtype, x_min, y_max, cell_width, cell_height,
+                 epsg, geographic=True, nodata=None, metadata=None, tile_size=256, level=6,
+                 max_workers=None, band_names=None, executor=None):
+    """
+    Write strips of rows to a tiled, DEFLATE compressed GeoTIFF.
+
+    The strips can be any height.  Rows are held until a full row of tiles is
+    available and then the tiles are compressed in a thread pool.  For more
+    than one band, the strips are 3-D (band, row, column) and each band is
+    stored in its own tiles.
+
+    parameters:
+        out_path - the output .tif
+        strips - iterable of (first row, 2-D or 3-D array) in row order
+        rows - the number of rows in the raster
+        cols - the number of columns in the raster
+        dtype - the NumPy type of the raster
+        x_min - the left edge of the raster
+        y_max - the top edge of the raster
+        cell_width - the cell width
+        cell_height - the cell height
+        epsg - the EPSG code of the coordinate system
+        geographic - True for a geographic (GCS) coordinate system
+        nodata - the NoData value.  NaN in float strips is written as this value.
+        metadata - optional dictionary of band metadata, such as scale and offset
+        tile_size - the tile width and height, a multiple of 16
+        level - the zlib compression level
+        max_workers - the number of compression threads
+        band_names - names of the bands for a multiband raster
+        executor - optional ThreadPoolExecutor that compresses the tiles, so
+                   rasters written at the same time can share one pool.  It
+                   is left running.  max_workers is ignored when it is given.
+
+    returns:
+        A tuple of (uncompressed bytes, compressed bytes).
+    """
+    bands = len(band_names) if band_names else 1
+    dtype = np.dtype(dtype).newbyteorder("<")
+    predictor = 3 if dtype.kind == "f" else 2
+    tiles_across = -(-cols // tile_size)
+    tiles_down = -(-rows // tile_size)
+    fill = nodata if nodata is not None else 0
+
+    # BigTIFF when the tiles could pass 4 GB even without compression
+    bigtiff = bands * tiles_across * tiles_down * tile_size * tile_size * dtype.itemsize > 0xF0000000
+
+    offsets = [[] for _ in range(bands)]
+    byte_counts = [[] for _ in range(bands)]
+    temp_path = out_path + ".part"
+    pool = ThreadPoolExecutor(max_workers=max_workers) if executor is None else nullcontext(executor)
+    with open(temp_path, "wb") as f, pool as executor:
+        if bigtiff:
+            f.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, 0))
+        else:
+            f.write(b"II" + struct.pack("<HI", 42, 0))
+
+        def write_tile_row(tile_rows):
+            # Pad each band to whole tiles and compress each tile
+            futures = []
+            for band in range(bands):
+                padded = np.full((tile_size, tiles_across * tile_size), fill, dtype=dtype)
+                padded[:tile_rows.shape[1], :cols] = tile_rows[band]
+                futures.extend((band, executor.submit(compress_tile, padded[:, c:c + tile_size],
+                                                      predictor, level))
+                               for c in range(0, tiles_across * tile_size, tile_size))
+            return futures
+
+        def flush(futures):
+            for band, future in futures:
+                data = future.result()
+                offsets[band].append(f.tell())
+                byte_counts[band].append(len(data))
+                f.write(data)
+
+        pending = None
+        buffer = np.empty((bands, 0, cols), dtype=dtype)
+        next_row = 0
+        for row, strip in strips:
+            if row != next_row:
+                raise ValueError(f"Expected the strip at row {next_row} but got row {row}.")
+            strip = np.asarray(strip).reshape(bands, -1, cols)
+            if nodata is not None and strip.dtype.kind == "f":
+                strip = np.where(np.isnan(strip), nodata, strip)
+            buffer = np.concatenate([buffer, strip.astype(dtype)], axis=1)
+            next_row += strip.shape[1]
+
+            # Compress full tile rows while the next strip is computed.  The previous tile
+            # row is written once this one is submitted, so two tile rows are in flight.
+            while buffer.shape[1] >= tile_size or (next_row == rows and buffer.shape[1]):
+                futures = write_tile_row(buffer[:, :tile_size])
+                buffer = buffer[:, tile_size:]
+                if pending is not None:
+                    flush(pending)
+                pending = futures
+
+        if next_row != rows:
+            raise ValueError(f"Expected {rows} rows but got {next_row}.")
+        if pending is not None:
+            flush(pending)
+
+        offset_type = LONG8 if bigtiff else LONG
+        entries = [
+            (IMAGE_WIDTH, LONG, [cols]),
+            (IMAGE_LENGTH, LONG, [rows]),
+            (BITS_PER_SAMPLE, SHORT, [dtype.itemsize * 8] * bands),
+            (COMPRESSION, SHORT, [DEFLATE]),
+            (PHOTOMETRIC, SHORT, [1]),
+            (SAMPLES_PER_PIXEL, SHORT, [bands]),
+            (PLANAR_CONFIGURATION, SHORT, [1 if bands == 1 else 2]),
+            (PREDICTOR, SHORT, [predictor]),
+            (TILE_WIDTH, SHORT, [tile_size]),
+            (TILE_LENGTH, SHORT, [tile_size]),
+            (TILE_OFFSETS, offset_type, [offset for band in offsets for offset in band]),
+            (TILE_BYTE_COUNTS, offset_type, [count for band in byte_counts for count in band]),
+            (SAMPLE_FORMAT, SHORT, [sample_format(dtype)] * bands),
+            (MODEL_PIXEL_SCALE, DOUBLE, [cell_width, cell_height, 0.0]),
+            (MODEL_TIEPOINT, DOUBLE, [0.0, 0.0, 0.0, x_min, y_max, 0.0]),
+            (GEO_KEY_DIRECTORY, SHORT, geo_keys(epsg, geographic)),
+        ]
+        if nodata is not None:
+            entries.append((GDAL_NODATA, ASCII, repr(float(nodata)) if dtype.kind == "f" else str(int(nodata))))
+        if bands > 1:
+            # The extra bands are unspecified data
+            entries.append((EXTRA_SAMPLES, SHORT, [0] * (bands - 1)))
+        items = []
+        for band in range(bands):
+            for name, value in (metadata or {}).items():
+                items.append(f'<Item name="{name.upper()}" sample="{band}" role="{name.lower()}">{value}</Item>')
+            if band_names:
+                items.append(f'<Item name="DESCRIPTION" sample="{band}" role="description">'
+                             f'{band_names[band]}</Item>')
+        if items:
+            entries.append((GDAL_METADATA, ASCII, f"<GDALMetadata>{''.join(items)}</GDALMetadata>"))
+
+        ifd_offset = write_ifd(f, entries, bigtiff)
+        f.seek(8 if bigtiff else 4)
+        f.write(struct.pack("<Q" if bigtiff else "<I", ifd_offset))
+
+    os.replace(temp_path, out_path)
+    return bands * rows * cols * dtype.itemsize, os.path.getsize(out_path)
+
+
+def define_projection(out_path, spatial_reference):
+    """
+    Record a coordinate system that the GeoKeys of a raster cannot hold.
+
+    Rasters whose coordinate system has no EPSG code get user-defined GeoKeys
+    from write_strips.  ArcGIS writes their coordinate system to the .aux.xml
+    with DefineProjection.  Without arcpy, the coordinate system's WKT is
+    written to a .prj next to the raster.
+
+    parameters:
+        out_path - the raster written by write_strips
+        spatial_reference - the coordinate system, such as an arcpy
+                            SpatialReference
+    """
+    if is_epsg(spatial_reference.factoryCode):
+        return
+    if arcpy is not None:
+        arcpy.management.DefineProjection(out_path, spatial_reference)
+    else:
+        with open(os.path.splitext(out_path)[0] + ".prj", "w") as f:
+            f.write(spatial_reference.exportToString())
+
+
+def write_array(out_path, array, x_min, y_max, cell_width, cell_height, epsg, geographic=True,
+                nodata=None, metadata=None, **kwargs):
+    """
+    Write a 2-D array to a tiled, DEFLATE compressed GeoTIFF.  See write_strips.
+
+    returns:
+        A tuple of (uncompressed bytes, compressed bytes).
+    """
+    rows, cols = array.shape[-2:]
+    return write_strips(out_path, [(0, array)], rows, cols, array.dtype, x_min, y_max, cell_width,
+                        cell_height, epsg, geographic, nodata, metadata, **kwargs)
+
+
+def read_tags(f):
+    """
+    Read the first image file directory of a TIFF.
+
+    returns:
+        A dictionary of tag to value.  Single values are not in a list.
+    """
+    f.seek(0)
+    header = f.read(16)
+    if header[:2] != b"II":
+        raise ValueError("Only little-endian TIFFs are supported.")
+    bigtiff = struct.unpack("<H", header[2:4])[0] == 43
+    if bigtiff:
+        ifd_offset = struct.unpack("<Q", header[8:16])[0]
+        count_format, entry_format, entry_size, inline = "<Q", "<HHQ", 20, 8
+    else:
+        ifd_offset = struct.unpack("<I", header[4:8])[0]
+        count_format, entry_format, entry_size, inline = "<H", "<HHI", 12, 4
+
+    f.seek(ifd_offset)
+    count = struct.unpack(count_format, f.read(struct.calcsize(count_format)))[0]
+    entries = f.read(count * entry_size)
+
+    tags = {}
+    for i in range(count):
+        entry = entries[i * entry_size:(i + 1) * entry_size]
+        tag, field_type, value_count = struct.unpack(entry_format, entry[:entry_size - inline])
+        size = struct.calcsize(TYPE_FORMATS.get(field_type, "B")) * value_count
+        data = entry[entry_size - inline:]
+        if size > inline:
+            f.seek(struct.unpack("<Q" if bigtiff else "<I", data)[0])
+            data = f.read(size)
+        if field_type == ASCII:
+            tags[tag] = data[:value_count].rstrip(b"\0").decode("ascii")
+        elif field_type in TYPE_FORMATS:
+            values = struct.unpack("<" + TYPE_FORMATS[field_type] * value_count, data[:size])
+            tags[tag] = values[0] if value_count == 1 else list(values)
+    return tags
+
+
+def read_tile_rows(in_path):
+    """
+    Read a tiled, DEFLATE compressed GeoTIFF written by this module one row of
+    tiles at a time, so only one row of tiles is in memory.
+
+    returns:
+        A generator of (first row, array) in row order.  The arrays are
+        tile_size rows tall, except the last, and 3-D (band, row, column) when
+        there is more than one band.
+    """
+    with open(in_path, "rb") as f:
+        tags = read_tags(f)
+        rows, cols = tags[IMAGE_LENGTH], tags[IMAGE_WIDTH]
+        tile_size = tags[TILE_WIDTH]
+        bands = tags.get(SAMPLES_PER_PIXEL, 1)
+        kind = {UINT: "u", INT: "i", FLOAT: "f"}[np.atleast_1d(tags.get(SAMPLE_FORMAT, UINT))[0]]
+        dtype = np.dtype(f"<{kind}{np.atleast_1d(tags[BITS_PER_SAMPLE])[0] // 8}")
+        predictor = tags.get(PREDICTOR, 1)
+
+        offsets = np.atleast_1d(tags[TILE_OFFSETS])
+        byte_counts = np.atleast_1d(tags[TILE_BYTE_COUNTS])
+        tiles_across = -(-cols // tile_size)
+        tiles_down = -(-rows // tile_size)
+        for tile_row in range(tiles_down):
+            tile_rows = np.empty((bands, tile_size, tiles_across * tile_size), dtype=dtype)
+            for band in range(bands):
+                for col in range(tiles_across):
+                    index = (band * tiles_down + tile_row) * tiles_across + col
+                    f.seek(int(offsets[index]))
+                    data = zlib.decompress(f.read(int(byte_counts[index])))
+                    tile_rows[band, :, col * tile_size:(col + 1) * tile_size] = \
+                        unpredict(data, (tile_size, tile_size), dtype, predictor)
+            row = tile_row * tile_size
+            tile_rows = tile_rows[:, :min(tile_size, rows - row), :cols]
+            yield row, (tile_rows[0] if bands == 1 else tile_rows)
+
+
+def read_array(in_path):
+    """
+    Read a tiled, DEFLATE compressed GeoTIFF written by this module.
+
+    returns:
+        A tuple of (array, tags).  The array is 3-D (band, row, column) when
+        there is more than one band.
+    """
+    with open(in_path, "rb") as f:
+        tags = read_tags(f)
+    array = np.concatenate([tile_rows for _, tile_rows in read_tile_rows(in_path)], axis=-2)
+    return array, tags